@@ -32,3 +32,32 @@ def service(subparser):
     subparser.add_argument("units", help="The units the composite score represents, i.e., 'reads/sec'.")
     subparser.add_argument("direction", help="'asc' if a lower score is better, 'desc' if a higher score is better.")
     return Benchmark.set_composite_score
+
+
+@cmdline.subcommand_builder('hook-benchmark',
+                            description="Benchmark charm helpers against "
+                                        "simulated hook tools")
+def hook_benchmark(subparser):
+    subparser.add_argument("--size", action="append", dest="sizes",
+                           metavar="PEERS,RELATIONS,UNITS",
+                           help="Model size to run against; may be repeated.")
+    subparser.add_argument("--scenario", action="append", dest="scenarios",
+                           help="Scenario to run; may be repeated. Default all.")
+    subparser.add_argument("--repeat", type=int, default=3,
+                           help="Runs per scenario; the fastest is reported.")
+    subparser.add_argument("--latency", type=float, default=0.0,
+                           help="Seconds added to each hook tool call.")
+    subparser.add_argument("--prefetch", action="store_true",
+                           help="Enable hookenv relation prefetching.")
+
+    def _hook_benchmark(sizes, scenarios, repeat, latency, prefetch):
+        from charmhelpers.contrib.simulator import scale
+        if sizes:
+            sizes = [tuple(int(n) for n in size.split(',')) for size in sizes]
+        rows = scale.run(sizes=sizes or scale.DEFAULT_SIZES,
+                         scenarios=scenarios, repeat=repeat,
+                         tool_latency=latency, prefetch=prefetch)
+        fields = ['scenario', 'peers', 'relations', 'remote_units',
+                  'seconds', 'forks', 'error']
+        return [fields] + [[row.get(f, '') for f in fields] for row in rows]
+    return _hook_benchmark
@@ -28,3 +28,4 @@ from . import host  # noqa
 from . import benchmark  # noqa
 from . import unitdata  # noqa
 from . import hookenv  # noqa
+from . import tracing  # noqa
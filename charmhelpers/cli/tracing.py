@@ -0,0 +1,54 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+
+from . import cmdline
+from charmhelpers.core import tracing
+
+
+SUMMARY_FIELDS = ('count', 'total', 'mean', 'max')
+
+
+@cmdline.subcommand_builder('trace-summary',
+                            description="Summarize hook tool call traces")
+def trace_summary(subparser):
+    subparser.add_argument('paths', nargs='+',
+                           help='Trace files, or directories of trace files')
+    subparser.add_argument('--by', choices=('tool', 'args_class', 'caller'),
+                           default='args_class',
+                           help='Group calls by tool, argument class or the '
+                                'charm helper that made them')
+    subparser.add_argument('--limit', type=int, default=None,
+                           help='Only show the slowest LIMIT groups')
+
+    def _trace_summary(paths, by, limit):
+        events = []
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(glob.glob(os.path.join(path, '*.json')))
+            else:
+                files = [path]
+            for trace_file in files:
+                events.extend(tracing.load_events(trace_file))
+        key = ('tool',) if by == 'tool' else ('tool', by)
+        summary = tracing.summarize(events, key=key)[:limit]
+        rows = [list(key) + list(SUMMARY_FIELDS)]
+        for row in summary:
+            rows.append([row[k] for k in key] +
+                        [row['count']] +
+                        [round(row[k], 6) for k in SUMMARY_FIELDS[1:]])
+        return rows
+    return _trace_summary
@@ -26,12 +26,33 @@ def unitdata_cmd(subparser):
     set_cmd.add_argument('key', help='Key to set')
     set_cmd.add_argument('value', help='Value to store')
     set_cmd.set_defaults(action='set')
+    stats_cmd = nested.add_parser(
+        'stats', help='Report the size of the unit state database')
+    stats_cmd.set_defaults(action='stats', key=None, value=None)
+    compact_cmd = nested.add_parser(
+        'compact', help='Prune revision history and reclaim space')
+    compact_cmd.add_argument('--keep-revisions', type=int,
+                             help='Number of most recent revisions to keep')
+    compact_cmd.add_argument('--keep-days', type=float,
+                             help='Age in days of the oldest revision to keep')
+    compact_cmd.set_defaults(action='compact', key=None, value=None)
+    for cmd in (get_cmd, set_cmd, stats_cmd):
+        cmd.set_defaults(keep_revisions=None, keep_days=None)
 
-    def _unitdata_cmd(action, key, value):
+    def _unitdata_cmd(action, key, value, keep_revisions, keep_days):
         if action == 'get':
             return unitdata.kv().get(key)
         elif action == 'set':
             unitdata.kv().set(key, value)
             unitdata.kv().flush()
             return ''
+        elif action == 'stats':
+            return unitdata.kv().stats()
+        elif action == 'compact':
+            before = unitdata.kv().stats()
+            removed = unitdata.kv().compact(keep_revisions, keep_days)
+            after = unitdata.kv().stats()
+            return {'revisions_removed': removed,
+                    'size_before': before['size'],
+                    'size_after': after['size']}
     return _unitdata_cmd
@@ -29,9 +29,137 @@ else:
     from UserDict import IterableUserDict as UserDict  # pragma: nocover
 
 
-class Relations(OrderedDict):
+class _LazyOrderedDict(OrderedDict):
+    '''An OrderedDict populated by its _load method on first access.
+
+    Subclasses implement _load, which fills in the mapping using
+    self._store. Nothing is loaded until the mapping is first read.
+    '''
+    _loaded = False
+
+    def _load(self):
+        raise NotImplementedError  # pragma: nocover
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self._load()
+
+    def _store(self, key, value):
+        super(_LazyOrderedDict, self).__setitem__(key, value)
+
+    def __getitem__(self, key):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self._ensure_loaded()
+        super(_LazyOrderedDict, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._ensure_loaded()
+        super(_LazyOrderedDict, self).__delitem__(key)
+
+    def __contains__(self, key):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__contains__(key)
+
+    def __iter__(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__iter__()
+
+    def __reversed__(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__reversed__()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__len__()
+
+    def __eq__(self, other):
+        self._ensure_loaded()
+        if isinstance(other, _LazyOrderedDict):
+            other._ensure_loaded()
+        return super(_LazyOrderedDict, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).__repr__()
+
+    def get(self, key, default=None):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).get(key, default)
+
+    def keys(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).keys()
+
+    def values(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).values()
+
+    def items(self):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).items()
+
+    if six.PY2:  # pragma: nocover
+        def iterkeys(self):
+            self._ensure_loaded()
+            return super(_LazyOrderedDict, self).iterkeys()
+
+        def itervalues(self):
+            self._ensure_loaded()
+            return super(_LazyOrderedDict, self).itervalues()
+
+        def iteritems(self):
+            self._ensure_loaded()
+            return super(_LazyOrderedDict, self).iteritems()
+
+        def has_key(self, key):
+            return key in self
+
+    def pop(self, *args):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).popitem(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self._ensure_loaded()
+        return super(_LazyOrderedDict, self).update(*args, **kwargs)
+
+    def clear(self):
+        # Nothing left to load once cleared.
+        self._loaded = True
+        return super(_LazyOrderedDict, self).clear()
+
+    if not six.PY2:
+        def move_to_end(self, *args, **kwargs):
+            self._ensure_loaded()
+            return super(_LazyOrderedDict, self).move_to_end(*args, **kwargs)
+
+    def copy(self):
+        self._ensure_loaded()
+        return OrderedDict(self.items())
+
+
+class Relations(_LazyOrderedDict):
     '''Mapping relation name -> relation id -> Relation.
 
+    The model is built on demand. Relation ids are only listed when
+    a relation name is first accessed, and the units of a relation when
+    that Relation is first accessed, so a hook reading a single relation
+    does not pay for the rest of the model.
+
     >>> rels = Relations()
     >>> rels['sprog']['sprog:12']['client/6']['widget']
     'remote widget'
@@ -41,28 +169,41 @@ class Relations(OrderedDict):
     >>> rels.peer.local['widget']
     'local widget on the peer relation'
     '''
-    def __init__(self):
-        super(Relations, self).__init__()
+    def _load(self):
         for relname in sorted(hookenv.relation_types()):
-            self[relname] = OrderedDict()
-            relids = hookenv.relation_ids(relname)
-            relids.sort(key=lambda x: int(x.split(':', 1)[-1]))
-            for relid in relids:
-                self[relname][relid] = Relation(relid)
+            self._store(relname, RelationIds(relname))
 
     @property
     def peer(self):
         peer_relid = hookenv.peer_relation_id()
-        for rels in self.values():
-            if peer_relid in rels:
-                return rels[peer_relid]
+        if peer_relid:
+            relname = peer_relid.split(':', 1)[0]
+            return self.get(relname, {}).get(peer_relid)
 
 
-class Relation(OrderedDict):
+class RelationIds(_LazyOrderedDict):
+    '''Mapping of relation id -> Relation for a relation name.
+
+    Ordered numerically by relation id.
+    '''
+    relname = None  # The relation name (also known as relation type).
+
+    def __init__(self, relname):
+        super(RelationIds, self).__init__()
+        self.relname = relname
+
+    def _load(self):
+        relids = sorted(hookenv.relation_ids(self.relname),
+                        key=lambda x: int(x.split(':', 1)[-1]))
+        for relid in relids:
+            self._store(relid, Relation(relid))
+
+
+class Relation(_LazyOrderedDict):
     '''Mapping of unit -> remote RelationInfo for a relation.
 
     This is an OrderedDict mapping, ordered numerically by
-    by unit number.
+    by unit number. The remote units are listed on first access.
 
     Also provides access to the local RelationInfo, and peer RelationInfo
     instances by the 'local' and 'peers' attributes.
@@ -77,38 +218,44 @@ class Relation(OrderedDict):
     '''
     relid = None    # The relation id.
     relname = None  # The relation name (also known as relation type).
-    service = None  # The remote service name, if known.
     local = None    # The local end's RelationInfo.
-    peers = None    # Map of peer -> RelationInfo. None if no peer relation.
 
     def __init__(self, relid):
-        remote_units = hookenv.related_units(relid)
-        remote_units.sort(key=lambda u: int(u.split('/', 1)[-1]))
-        super(Relation, self).__init__((unit, RelationInfo(relid, unit))
-                                       for unit in remote_units)
-
+        super(Relation, self).__init__()
         self.relname = relid.split(':', 1)[0]
         self.relid = relid
         self.local = RelationInfo(relid, hookenv.local_unit())
 
+    def _load(self):
+        remote_units = sorted(hookenv.related_units(self.relid),
+                              key=lambda u: int(u.split('/', 1)[-1]))
+        for unit in remote_units:
+            self._store(unit, RelationInfo(self.relid, unit))
+
+    @property
+    def service(self):
+        '''The remote service name, if known.'''
         for relinfo in self.values():
-            self.service = relinfo.service
-            break
+            return relinfo.service
+
+    @property
+    def peers(self):
+        '''Map of peer -> RelationInfo. None if no peer relation.'''
+        if '_peers' not in self.__dict__:
+            self._peers = self._load_peers()
+        return self._peers
 
+    def _load_peers(self):
         # If we have peers, and they have joined both the provided peer
         # relation and this relation, we can peek at their data too.
         # This is useful for creating consensus without leadership.
         peer_relid = hookenv.peer_relation_id()
-        if peer_relid and peer_relid != relid:
-            peers = hookenv.related_units(peer_relid)
-            if peers:
-                peers.sort(key=lambda u: int(u.split('/', 1)[-1]))
-                self.peers = OrderedDict((peer, RelationInfo(relid, peer))
-                                         for peer in peers)
-            else:
-                self.peers = OrderedDict()
-        else:
-            self.peers = None
+        if not peer_relid or peer_relid == self.relid:
+            return None
+        peers = sorted(hookenv.related_units(peer_relid) or [],
+                       key=lambda u: int(u.split('/', 1)[-1]))
+        return OrderedDict((peer, RelationInfo(self.relid, peer))
+                           for peer in peers)
 
     def __str__(self):
         return '{} ({})'.format(self.relid, self.service)
@@ -139,8 +286,9 @@ class RelationInfo(UserDict):
     False
 
     This class wraps hookenv.relation_get and hookenv.relation_set.
-    All caching is left up to these two methods to avoid synchronization
-    issues. Data is only loaded on demand.
+    Data is only loaded on demand. Remote data is read once and kept
+    for the life of the instance; caching of the local unit's data is
+    left up to these two methods to avoid synchronization issues.
     '''
     relid = None    # The relation id.
     relname = None  # The relation name (also know as the relation type).
@@ -160,7 +308,11 @@ class RelationInfo(UserDict):
 
     @property
     def data(self):
-        return hookenv.relation_get(rid=self.relid, unit=self.unit)
+        if self.unit == hookenv.local_unit():
+            return hookenv.relation_get(rid=self.relid, unit=self.unit)
+        if '_data' not in self.__dict__:
+            self._data = hookenv.relation_get(rid=self.relid, unit=self.unit)
+        return self._data
 
     def __setitem__(self, key, value):
         if self.unit != hookenv.local_unit():
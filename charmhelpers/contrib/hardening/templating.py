@@ -20,9 +20,12 @@ from charmhelpers.core.hookenv import (
     DEBUG,
     WARNING,
 )
+from charmhelpers.core.templating import environment
 
+# Hardening may run before the apt lists have been fetched, so make sure
+# jinja2 is installed (and the lists updated) before environment() needs it.
 try:
-    from jinja2 import FileSystemLoader, Environment
+    import jinja2  # noqa: F401
 except ImportError:
     from charmhelpers.fetch import apt_install
     from charmhelpers.fetch import apt_update
@@ -31,7 +34,6 @@ except ImportError:
         apt_install('python-jinja2', fatal=True)
     else:
         apt_install('python3-jinja2', fatal=True)
-    from jinja2 import FileSystemLoader, Environment
 
 
 # NOTE: function separated from main rendering code to facilitate easier
@@ -59,7 +61,7 @@ def render_and_write(template_dir, path, context):
     :param path: the path to write the templated contents to
     :param context: the parameters to pass to the rendering engine
     """
-    env = Environment(loader=FileSystemLoader(template_dir))
+    env = environment(template_dir)
     template_file = os.path.basename(path)
     template = env.get_template(template_file)
     log('Rendering from template: %s' % template.name, level=DEBUG)
@@ -17,7 +17,9 @@ import re
 import subprocess
 import six
 import socket
+import struct
 
+from collections import OrderedDict
 from functools import partial
 
 from charmhelpers.fetch import apt_install, apt_update
@@ -554,6 +556,133 @@ def port_has_listener(address, port):
     return not(bool(result))
 
 
+PROC_NET_TCP = ['/proc/net/tcp', '/proc/net/tcp6']
+# socket state of a listening socket in /proc/net/tcp{,6}
+_TCP_LISTEN = '0A'
+# a socket bound to one of these accepts connections to any local address
+_WILDCARD_ADDRESSES = ('0.0.0.0', '::')
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+
+def _is_loopback(address):
+    """Returns True if a canonical address is a loopback address."""
+    return address == '::1' or address.startswith('127.')
+
+
+def _canonical_address(address):
+    """
+    Returns address in canonical text form, with IPv4-mapped IPv6
+    addresses given as IPv4, or None if it is not an IP address.
+    """
+    try:
+        return socket.inet_ntop(socket.AF_INET,
+                                socket.inet_pton(socket.AF_INET, address))
+    except (socket.error, ValueError, TypeError):
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, address)
+    except (socket.error, ValueError, TypeError):
+        return None
+    if packed.startswith(_IPV4_MAPPED_PREFIX):
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def _proc_net_address(hex_address):
+    """
+    Decodes an address from /proc/net/tcp{,6}, stored as 32 bit words in
+    host byte order.
+    """
+    packed = b''.join(struct.pack('=I', int(hex_address[i:i + 8], 16))
+                      for i in range(0, len(hex_address), 8))
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed)
+    if packed.startswith(_IPV4_MAPPED_PREFIX):
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def listening_sockets():
+    """
+    Returns the set of (address, port) of local TCP sockets in the LISTEN
+    state, read once from /proc/net/tcp and /proc/net/tcp6.
+
+    @returns set of (address, integer port) tuples, or None if /proc could
+             not be read
+    """
+    sockets = set()
+    found = False
+    for path in PROC_NET_TCP:
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            continue
+        found = True
+        # first line is the column header
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) < 4 or fields[3] != _TCP_LISTEN:
+                continue
+            try:
+                hex_address, hex_port = fields[1].rsplit(':', 1)
+                sockets.add((_proc_net_address(hex_address),
+                             int(hex_port, 16)))
+            except (socket.error, struct.error, ValueError):
+                continue
+    if not found:
+        return None
+    return sockets
+
+
+def listening_ports():
+    """
+    Returns the set of local TCP ports that have a socket in the LISTEN
+    state on any address, read once from /proc/net/tcp and /proc/net/tcp6.
+
+    @returns set of integer ports, or None if /proc could not be read
+    """
+    sockets = listening_sockets()
+    if sockets is None:
+        return None
+    return set(port for _, port in sockets)
+
+
+def ports_have_listener(address, ports):
+    """
+    Returns an OrderedDict of port: boolean saying whether each port is
+    open and being listened to on address.
+
+    For an IP address the state of all ports is taken from a single read
+    of /proc/net/tcp{,6}: a port is open if a socket listens on address
+    itself or on the wildcard address (0.0.0.0 or ::). As connecting to the
+    wildcard address reaches the loopback interface, a socket listening on
+    a loopback address also counts when address is 0.0.0.0 or ::. For
+    hostnames, or when /proc is not available, falls back to
+    port_has_listener() for each port.
+
+    @param address: an IP address or hostname
+    @param ports: list of integer ports
+    """
+    ports = list(ports)
+    canonical = _canonical_address(address)
+    sockets = None
+    if ports and canonical is not None:
+        sockets = listening_sockets()
+    states = OrderedDict()
+    if sockets is None:
+        for port in ports:
+            states[port] = port_has_listener(address, port)
+        return states
+    matches = (canonical,) + _WILDCARD_ADDRESSES
+    loopback = canonical in _WILDCARD_ADDRESSES
+    listening = set(port for bound, port in sockets
+                    if bound in matches or loopback and _is_loopback(bound))
+    for port in ports:
+        states[port] = int(port) in listening
+    return states
+
+
 def assert_charm_supports_ipv6():
     """Check whether we are able to support charms ipv6."""
     release = lsb_release()['DISTRIB_CODENAME'].lower()
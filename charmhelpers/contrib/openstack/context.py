@@ -144,6 +144,11 @@ class OSContextGenerator(object):
     related = False
     complete = False
     missing_data = []
+    # Set to True by generators that may be evaluated in a worker thread
+    # alongside other generators, see OSConfigRenderer's context_workers.
+    # Only generators that just read config, relation or network data
+    # qualify; those writing files, leader settings or unitdata do not.
+    concurrent = False
 
     def __call__(self):
         raise NotImplementedError
@@ -203,6 +208,8 @@ class SharedDBContext(OSContextGenerator):
         self.ssl_dir = ssl_dir
         self.rel_name = self.interfaces[0]
         self.relation_id = relation_id
+        # db_ssl() writes client certificates into ssl_dir.
+        self.concurrent = ssl_dir is None
 
     def __call__(self):
         self.database = self.database or config('database')
@@ -267,6 +274,7 @@ class SharedDBContext(OSContextGenerator):
 
 class PostgresqlDBContext(OSContextGenerator):
     interfaces = ['pgsql-db']
+    concurrent = True
 
     def __init__(self, database=None):
         self.database = database
@@ -337,6 +345,8 @@ class IdentityServiceContext(OSContextGenerator):
         self.service_user = service_user
         self.rel_name = rel_name
         self.interfaces = [self.rel_name]
+        # _setup_pki_cache() creates the signing cache directory.
+        self.concurrent = not (service and service_user)
 
     def _setup_pki_cache(self):
         if self.service and self.service_user:
@@ -461,6 +471,8 @@ class AMQPContext(OSContextGenerator):
         self.relation_prefix = relation_prefix
         self.interfaces = [rel_name]
         self.relation_id = relation_id
+        # The rabbit CA certificate is written into ssl_dir.
+        self.concurrent = ssl_dir is None
 
     def __call__(self):
         log('Generating template context for amqp', level=DEBUG)
@@ -750,6 +762,7 @@ class HAProxyContext(OSContextGenerator):
 
 class ImageServiceContext(OSContextGenerator):
     interfaces = ['image-service']
+    concurrent = True
 
     def __call__(self):
         """Obtains the glance API server from the image-service relation.
@@ -1472,6 +1485,7 @@ class NeutronAPIContext(OSContextGenerator):
     defaults if it is not present.
     '''
     interfaces = ['neutron-plugin-api']
+    concurrent = True
 
     def __call__(self):
         self.neutron_defaults = {
@@ -1629,6 +1643,7 @@ class PhyNICMTUContext(DataPortContext):
 
 
 class NetworkServiceContext(OSContextGenerator):
+    concurrent = True
 
     def __init__(self, rel_name='quantum-network-service'):
         self.rel_name = rel_name
@@ -12,13 +12,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import hashlib
 import os
+import stat
+import time
+from collections import OrderedDict
 
 import six
 
 from charmhelpers.fetch import apt_install, apt_update
+from charmhelpers.core.host import write_file
 from charmhelpers.core.hookenv import (
+    cached,
+    charm_dir,
     log,
+    DEBUG,
     ERROR,
     INFO,
     TRACE
@@ -26,21 +35,50 @@ from charmhelpers.core.hookenv import (
 from charmhelpers.contrib.openstack.utils import OPENSTACK_CODENAMES
 
 try:
-    from jinja2 import FileSystemLoader, ChoiceLoader, Environment, exceptions
+    from jinja2 import (
+        BaseLoader, FileSystemLoader, ChoiceLoader, Environment, exceptions)
 except ImportError:
     apt_update(fatal=True)
     if six.PY2:
         apt_install('python-jinja2', fatal=True)
     else:
         apt_install('python3-jinja2', fatal=True)
-    from jinja2 import FileSystemLoader, ChoiceLoader, Environment, exceptions
+    from jinja2 import (
+        BaseLoader, FileSystemLoader, ChoiceLoader, Environment, exceptions)
 
 
 class OSConfigException(Exception):
     pass
 
 
-def get_loader(templates_dir, os_release):
+def _template_dirs(templates_dir, os_release):
+    """
+    Return the template search path for os_release, most specific first:
+    the release directories up to and including os_release in descending
+    order, templates_dir and the templates shipped with this module.
+    """
+    if not os.path.isdir(templates_dir):
+        log('Templates directory not found @ %s.' % templates_dir,
+            level=ERROR)
+        raise OSConfigException
+
+    # the bottom contains tempaltes_dir and possibly a common templates dir
+    # shipped with the helper.
+    dirs = [templates_dir]
+    helper_templates = os.path.join(os.path.dirname(__file__), 'templates')
+    if os.path.isdir(helper_templates):
+        dirs.append(helper_templates)
+
+    for rel in six.itervalues(OPENSTACK_CODENAMES):
+        tmpl_dir = os.path.join(templates_dir, rel)
+        if os.path.isdir(tmpl_dir):
+            dirs.insert(0, tmpl_dir)
+        if rel == os_release:
+            break
+    return dirs
+
+
+def get_loader(templates_dir, os_release, indexed=False):
     """
     Create a jinja2.ChoiceLoader containing template dirs up to
     and including os_release.  If directory template directory
@@ -57,30 +95,17 @@ def get_loader(templates_dir, os_release):
         sub-directories.
     :param os_release (str): OpenStack release codename to construct template
         loader.
+    :param indexed (bool): Return a TemplateIndexLoader resolving templates
+        from the same search path through template_index() instead.
     :returns: jinja2.ChoiceLoader constructed with a list of
         jinja2.FilesystemLoaders, ordered in descending
         order by OpenStack release.
     """
-    tmpl_dirs = [(rel, os.path.join(templates_dir, rel))
-                 for rel in six.itervalues(OPENSTACK_CODENAMES)]
-
-    if not os.path.isdir(templates_dir):
-        log('Templates directory not found @ %s.' % templates_dir,
-            level=ERROR)
-        raise OSConfigException
-
-    # the bottom contains tempaltes_dir and possibly a common templates dir
-    # shipped with the helper.
-    loaders = [FileSystemLoader(templates_dir)]
-    helper_templates = os.path.join(os.path.dirname(__file__), 'templates')
-    if os.path.isdir(helper_templates):
-        loaders.append(FileSystemLoader(helper_templates))
+    if indexed:
+        return TemplateIndexLoader(template_index(templates_dir, os_release))
 
-    for rel, tmpl_dir in tmpl_dirs:
-        if os.path.isdir(tmpl_dir):
-            loaders.insert(0, FileSystemLoader(tmpl_dir))
-        if rel == os_release:
-            break
+    loaders = [FileSystemLoader(tmpl_dir)
+               for tmpl_dir in _template_dirs(templates_dir, os_release)]
     # demote this log to the lowest level; we don't really need to see these
     # lots in production even when debugging.
     log('Creating choice loader with dirs: %s' %
@@ -88,6 +113,147 @@ def get_loader(templates_dir, os_release):
     return ChoiceLoader(loaders)
 
 
+def _charm_revision():
+    """Return the contents of the charm's revision file, if any"""
+    try:
+        with open(os.path.join(charm_dir() or '', 'revision')) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def template_index(templates_dir, os_release):
+    """
+    Map each template name to the file it resolves to for os_release,
+    searching the same directories in the same order as get_loader().
+
+    The index is built once per charm revision and cached, across hooks
+    too while hookenv.persistent_cache() is enabled.
+
+    :param templates_dir (str): Base template directory containing release
+        sub-directories.
+    :param os_release (str): OpenStack release codename.
+    :returns: dict of template name -> absolute file path.
+    """
+    return _build_template_index(os.path.abspath(templates_dir), os_release,
+                                 _charm_revision())
+
+
+@cached(persist=True, invalidate_on=('upgrade-charm',))
+def _build_template_index(templates_dir, os_release, revision):
+    index = {}
+    for tmpl_dir in _template_dirs(templates_dir, os_release):
+        for dirpath, _, filenames in os.walk(tmpl_dir, followlinks=True):
+            relpath = os.path.relpath(dirpath, tmpl_dir)
+            for filename in filenames:
+                name = filename if relpath == os.curdir else '/'.join(
+                    relpath.split(os.sep) + [filename])
+                index.setdefault(name, os.path.join(dirpath, filename))
+    log('Indexed {} templates for {} in {}'.format(
+        len(index), os_release, templates_dir), level=TRACE)
+    return index
+
+
+class TemplateIndexLoader(BaseLoader):
+    """
+    jinja2 loader resolving template names through a template_index(), so
+    that looking up a template, or failing to find one, does not probe
+    each directory of the search path.
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def get_source(self, environment, template):
+        path = self.index.get(template)
+        if path is None:
+            raise exceptions.TemplateNotFound(template)
+        try:
+            with open(path, 'rb') as f:
+                contents = f.read().decode('utf-8')
+            mtime = os.path.getmtime(path)
+        except (IOError, OSError):
+            raise exceptions.TemplateNotFound(template)
+
+        def uptodate():
+            try:
+                return os.path.getmtime(path) == mtime
+            except OSError:
+                return False
+        return contents, path, uptodate
+
+    def list_templates(self):
+        return sorted(self.index)
+
+
+class ContextPass(object):
+    """
+    Evaluates each distinct context generator once for a render pass.
+
+    The same generator instances are usually registered for many config
+    files; within a pass their results are shared by all the templates.
+    The time each generator took is recorded in `timings`, an OrderedDict
+    of generator -> seconds in evaluation order.
+    """
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self._results = {}
+
+    def __call__(self, context):
+        key = id(context)
+        if key not in self._results:
+            self._store(context, *self._evaluate(context))
+        return self._results[key][1]
+
+    @staticmethod
+    def _evaluate(context):
+        start = time.time()
+        return context(), time.time() - start
+
+    def _store(self, context, result, seconds):
+        # Keep a reference to the generator so its id is not reused.
+        self._results[id(context)] = (context, result)
+        self.timings[context] = seconds
+
+    def evaluate_all(self, contexts, workers=None):
+        """
+        Evaluate context generators ahead of rendering.
+
+        With more than one worker, generators run concurrently in a pool
+        of up to `workers` threads if their `concurrent` attribute is
+        True; all others run in the calling thread. Results and
+        timings are recorded in the order the generators are given, so the
+        merged template contexts do not depend on which thread finishes
+        first.
+
+        :param contexts: Context generators, duplicates are evaluated once.
+        :param workers: Maximum number of generators to run at a time.
+        """
+        pending = []
+        for context in contexts:
+            if (id(context) not in self._results and
+                    not any(context is p for p in pending)):
+                pending.append(context)
+        threaded = [context for context in pending
+                    if getattr(context, 'concurrent', False)]
+        results = {}
+        if workers and workers > 1 and len(threaded) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(threaded)))
+            try:
+                for context, result in zip(threaded,
+                                           pool.map(self._evaluate,
+                                                    threaded)):
+                    results[id(context)] = result
+            finally:
+                pool.close()
+                pool.join()
+        for context in pending:
+            if id(context) not in results:
+                results[id(context)] = self._evaluate(context)
+            self._store(context, *results[id(context)])
+
+
 class OSConfigTemplate(object):
     """
     Associates a config file template with a list of context generators.
@@ -106,10 +272,16 @@ class OSConfigTemplate(object):
 
         self.config_template = config_template
 
-    def context(self):
+    def context(self, evaluate=None):
+        """
+        Build the template context from the context generators.
+
+        :param evaluate: Callable used to evaluate each generator, such as a
+            `ContextPass`. By default each generator is called.
+        """
         ctxt = {}
         for context in self.contexts:
-            _ctxt = context()
+            _ctxt = evaluate(context) if evaluate else context()
             if _ctxt:
                 ctxt.update(_ctxt)
                 # track interfaces for every complete context.
@@ -118,13 +290,13 @@ class OSConfigTemplate(object):
                  if interface not in self._complete_contexts]
         return ctxt
 
-    def complete_contexts(self):
+    def complete_contexts(self, evaluate=None):
         '''
         Return a list of interfaces that have satisfied contexts.
         '''
         if self._complete_contexts:
             return self._complete_contexts
-        self.context()
+        self.context(evaluate)
         return self._complete_contexts
 
     @property
@@ -201,6 +373,10 @@ class OSConfigRenderer(object):
     $CHARM/hooks/charmhelpers/contrib/openstack/templates.  This allows
     us to ship common templates (haproxy, apache) with the helpers.
 
+    With `indexed_templates`, templates are resolved through a
+    `template_index()` of the same search path, built once per charm
+    revision, rather than by probing each directory on every lookup.
+
     **Context generators**
 
     Context generators are used to generate template contexts during hook
@@ -209,8 +385,22 @@ class OSConfigRenderer(object):
     of generators.  When a template is rendered and written, all context
     generates are called in a chain to generate the context dictionary
     passed to the jinja2 template. See context.py for more info.
+
+    Within a `render_pass()`, as used by `write_all()`, each distinct
+    context generator is evaluated only once and its result is shared by
+    every template it is registered for. The time each generator took in
+    the last pass is available from `context_timings`.
+
+    With `context_workers` greater than one, `write_all()` and
+    `complete_contexts()` start by evaluating the distinct generators of
+    the templates they need in a pool of up to that many threads, so
+    their hook tool calls overlap. Keep the cap low enough for the hook
+    tools to cope with. Only generators whose class sets `concurrent` to
+    True, declaring them safe to run off the main thread, are evaluated
+    in the pool; the others run in the calling thread.
     """
-    def __init__(self, templates_dir, openstack_release):
+    def __init__(self, templates_dir, openstack_release,
+                 context_workers=None, indexed_templates=False):
         if not os.path.isdir(templates_dir):
             log('Could not locate templates dir %s' % templates_dir,
                 level=ERROR)
@@ -220,6 +410,11 @@ class OSConfigRenderer(object):
         self.openstack_release = openstack_release
         self.templates = {}
         self._tmpl_env = None
+        self._context_pass = None
+        self.context_timings = OrderedDict()
+        self.context_workers = context_workers
+        self._digests = {}
+        self.indexed_templates = indexed_templates
 
         if None in [Environment, ChoiceLoader, FileSystemLoader]:
             # if this code is running, the object is created pre-install hook.
@@ -250,7 +445,12 @@ class OSConfigRenderer(object):
 
     def _get_tmpl_env(self):
         if not self._tmpl_env:
-            loader = get_loader(self.templates_dir, self.openstack_release)
+            if self.indexed_templates:
+                loader = get_loader(self.templates_dir,
+                                    self.openstack_release, indexed=True)
+            else:
+                loader = get_loader(self.templates_dir,
+                                    self.openstack_release)
             self._tmpl_env = Environment(loader=loader)
 
     def _get_template(self, template):
@@ -278,7 +478,7 @@ class OSConfigRenderer(object):
             raise OSConfigException
 
         ostmpl = self.templates[config_file]
-        ctxt = ostmpl.context()
+        ctxt = ostmpl.context(self._context_pass)
 
         if ostmpl.is_string_template:
             template = self._get_template_from_string(ostmpl)
@@ -313,6 +513,13 @@ class OSConfigRenderer(object):
     def write(self, config_file):
         """
         Write a single config file, raises if config file is not registered.
+
+        The config is rendered in memory and the file is only written if
+        the content differs from what is on disk. An existing file is
+        replaced atomically with host.write_file(), keeping its ownership,
+        permissions and extended attributes; symlinks are written through.
+
+        :returns: True if the file was written, False if it was unchanged.
         """
         if config_file not in self.templates:
             log('Config not registered: %s' % config_file, level=ERROR)
@@ -322,16 +529,92 @@ class OSConfigRenderer(object):
         if six.PY3:
             _out = _out.encode('UTF-8')
 
-        with open(config_file, 'wb') as out:
-            out.write(_out)
-
+        digest = hashlib.sha256(_out).hexdigest()
+        if digest == self._file_digest(config_file):
+            log('Config file %s unchanged.' % config_file, level=DEBUG)
+            return False
+
+        try:
+            st = os.stat(config_file)
+        except OSError:
+            # Nothing can be reading a file that does not exist yet.
+            with open(config_file, 'wb') as out:
+                out.write(_out)
+        else:
+            write_file(config_file, _out, owner=st.st_uid, group=st.st_gid,
+                       perms=stat.S_IMODE(st.st_mode), atomic=True)
+        self._remember_digest(config_file, digest)
         log('Wrote template %s.' % config_file, level=INFO)
+        return True
+
+    def _file_digest(self, config_file):
+        """
+        Return the sha256 of a config file on disk, None if it is missing.
+        Digests are cached until the file's inode, size or mtime change.
+        """
+        try:
+            st = os.stat(config_file)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        cached = self._digests.get(config_file)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(config_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._digests[config_file] = (key, digest)
+        return digest
+
+    def _remember_digest(self, config_file, digest):
+        try:
+            st = os.stat(config_file)
+        except OSError:
+            return
+        self._digests[config_file] = (
+            (st.st_ino, st.st_size, st.st_mtime), digest)
+
+    @contextlib.contextmanager
+    def render_pass(self):
+        """
+        Evaluate each distinct context generator at most once while the
+        block runs, sharing the results between all rendered templates.
+
+        Passes may be nested; the outermost one applies. When it ends,
+        `context_timings` holds the time taken by each generator.
+        """
+        if self._context_pass is not None:
+            yield self._context_pass
+            return
+        self._context_pass = ContextPass()
+        try:
+            yield self._context_pass
+        finally:
+            context_pass, self._context_pass = self._context_pass, None
+            self.context_timings = context_pass.timings
 
     def write_all(self):
         """
         Write out all registered config files.
+
+        :returns: Map of config file to True if it was written or False if
+            it was unchanged, e.g. for deciding which services to restart.
+        :rtype: OrderedDict
+        """
+        with self.render_pass():
+            self._prefetch_contexts(six.itervalues(self.templates))
+            return OrderedDict((k, self.write(k))
+                               for k in six.iterkeys(self.templates))
+
+    def _prefetch_contexts(self, templates):
+        """
+        Evaluate the generators of templates in the current render pass,
+        concurrently when context_workers allows it.
         """
-        [self.write(k) for k in six.iterkeys(self.templates)]
+        if self.context_workers and self.context_workers > 1:
+            self._context_pass.evaluate_all(
+                [context for ostmpl in templates
+                 for context in ostmpl.contexts],
+                self.context_workers)
 
     def set_release(self, openstack_release):
         """
@@ -347,8 +630,13 @@ class OSConfigRenderer(object):
         Returns a list of context interfaces that yield a complete context.
         '''
         interfaces = []
-        [interfaces.extend(i.complete_contexts())
-         for i in six.itervalues(self.templates)]
+        with self.render_pass() as context_pass:
+            # Templates with complete contexts already remember them.
+            self._prefetch_contexts(
+                [i for i in six.itervalues(self.templates)
+                 if not i._complete_contexts])
+            [interfaces.extend(i.complete_contexts(context_pass))
+             for i in six.itervalues(self.templates)]
         return interfaces
 
     def get_incomplete_context_data(self, interfaces):
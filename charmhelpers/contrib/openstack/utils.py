@@ -63,18 +63,21 @@ from charmhelpers.contrib.storage.linux.lvm import (
 from charmhelpers.contrib.network.ip import (
     get_ipv6_addr,
     is_ipv6,
-    port_has_listener,
+    ports_have_listener,
 )
 
 from charmhelpers.core.host import (
     lsb_release,
     mounts,
     umount,
-    service_running,
+    services_running,
     service_pause,
     service_resume,
     restart_on_change_helper,
 )
+# No longer used here, but kept importable for charms that patch them.
+from charmhelpers.contrib.network.ip import port_has_listener  # noqa: F401
+from charmhelpers.core.host import service_running  # noqa: F401
 from charmhelpers.fetch import (
     apt_cache,
     import_key as fetch_import_key,
@@ -1058,8 +1061,9 @@ def _check_running_services(services):
     @returns [(service, boolean), ...], : results for checks
              [boolean]                  : just the result of the service checks
     """
-    services_running = [service_running(s) for s in services]
-    return list(zip(services, services_running)), services_running
+    states = services_running(list(services))
+    running = [states[s] for s in services]
+    return list(zip(services, running)), running
 
 
 def _check_listening_on_services_ports(services, test=False):
@@ -1076,7 +1080,8 @@ def _check_listening_on_services_ports(services, test=False):
     """
     test = not(not(test))  # ensure test is True or False
     all_ports = list(itertools.chain(*services.values()))
-    ports_states = [port_has_listener('0.0.0.0', p) for p in all_ports]
+    states = ports_have_listener('0.0.0.0', all_ports)
+    ports_states = [states[p] for p in all_ports]
     map_ports = OrderedDict()
     matched_ports = [p for p, opened in zip(all_ports, ports_states)
                      if opened == test]  # essentially opened xor test
@@ -1096,7 +1101,8 @@ def _check_listening_on_ports_list(ports):
     @param ports: LIST or port numbers.
     @returns [(port_num, boolean), ...], [boolean]
     """
-    ports_open = [port_has_listener('0.0.0.0', p) for p in ports]
+    states = ports_have_listener('0.0.0.0', ports)
+    ports_open = [states[p] for p in ports]
     return zip(ports, ports_open), ports_open
 
 
@@ -1429,7 +1435,9 @@ def make_assess_status_func(*args, **kwargs):
 
 
 def pausable_restart_on_change(restart_map, stopstart=False,
-                               restart_functions=None):
+                               restart_functions=None, restart_workers=None,
+                               restart_dependencies=None,
+                               restart_timings=None):
     """A restart_on_change decorator that checks to see if the unit is
     paused. If it is paused then the decorated function doesn't fire.
 
@@ -1459,6 +1467,11 @@ def pausable_restart_on_change(restart_map, stopstart=False,
     @param restart_map: (optionally callable, which then returns the
         restart_map) the restart map {conf_file: [services]}
     @param stopstart: DEFAULT false; whether to stop, start or just restart
+    @param restart_workers: number of services to restart concurrently
+    @param restart_dependencies: {svc: [svc, ...]} services that must be
+        restarted before svc
+    @param restart_timings: dict updated with {svc: seconds} for each
+        service restarted
     @returns decorator to use a restart_on_change with pausability
     """
     def wrap(f):
@@ -1476,7 +1489,8 @@ def pausable_restart_on_change(restart_map, stopstart=False,
             # otherwise, normal restart_on_change functionality
             return restart_on_change_helper(
                 (lambda: f(*args, **kwargs)), __restart_map_cache['cache'],
-                stopstart, restart_functions)
+                stopstart, restart_functions, restart_workers,
+                restart_dependencies, restart_timings)
         return wrapped_f
     return wrap
 
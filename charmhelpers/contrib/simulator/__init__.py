@@ -0,0 +1,481 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-in for the Juju hook tools.
+
+:class:`HookToolSimulator` intercepts the hook tools run through the
+subprocess module (``relation-get``, ``relation-ids``, ``relation-list``,
+``relation-set``, ``config-get``, ``leader-get``, ``network-get``,
+``juju-log``, ...) and answers them from a :class:`Model`, so that charm
+helpers can be exercised and benchmarked without a Juju controller::
+
+    model = Model.generate(peers=3, relations=50, remote_units=500)
+    with HookToolSimulator(model) as sim:
+        hookenv.relation_ids('shared-db')
+        print(sim.forks, sim.calls)
+
+Hook tools are answered in-process; ``tool_latency`` can be used to add
+the cost of the fork and the round trip to the unit agent to each call.
+Commands that are not hook tools are run as normal.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+import six
+import yaml
+
+from charmhelpers.core import hookenv
+
+RELATION_ROLES = ('provides', 'requires', 'peers')
+# Endpoints used by Model.generate(), as (name, interface, role)
+GENERATED_ENDPOINTS = (
+    ('shared-db', 'mysql-shared', 'requires'),
+    ('amqp', 'rabbitmq', 'requires'),
+    ('identity-service', 'keystone', 'requires'),
+    ('ha', 'hacluster', 'requires'),
+    ('website', 'http', 'provides'),
+)
+PEER_ENDPOINT = ('cluster', 'cluster', 'peers')
+# Address keys published by remote units on the generated endpoints. Only
+# addresses are published, so no relation ever becomes complete and
+# context generators have to look at every unit.
+ENDPOINT_ADDRESS_KEYS = {
+    'shared-db': ('db_host',),
+    'amqp': ('hostname',),
+    'identity-service': ('service_host', 'auth_host'),
+}
+
+
+def _address(n):
+    return '10.{}.{}.{}'.format((n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+
+class Model(object):
+    """The state of a Juju model as seen by a single unit.
+
+    :param unit: Name of the local unit.
+    :type unit: str
+    :param config: Charm config.
+    :type config: dict
+    :param leader: Whether the local unit is the leader.
+    :type leader: bool
+    :param leader_settings: Leadership settings.
+    :type leader_settings: dict
+    :param juju_version: Version reported for the unit agent.
+    :type juju_version: str
+    """
+
+    def __init__(self, unit='local/0', config=None, leader=True,
+                 leader_settings=None, juju_version='2.7.0'):
+        self.unit = unit
+        self.config = dict(config or {})
+        self.leader = leader
+        self.leader_settings = dict(leader_settings or {})
+        self.juju_version = juju_version
+        self.address = _address(1)
+        self.endpoints = OrderedDict()
+        self.relations = OrderedDict()
+        self._next_relation_id = 0
+
+    def add_endpoint(self, name, interface, role='requires'):
+        """Declare a relation endpoint in the charm metadata"""
+        self.endpoints[name] = (role, interface)
+
+    def add_relation(self, name, units=None, local_settings=None):
+        """Add an established relation.
+
+        :param name: Endpoint name; must have been declared with
+                     :meth:`add_endpoint`.
+        :type name: str
+        :param units: Remote unit name: settings.
+        :type units: dict
+        :param local_settings: Settings of the local unit on the relation.
+        :type local_settings: dict
+        :returns: The relation id.
+        :rtype: str
+        """
+        rid = '{}:{}'.format(name, self._next_relation_id)
+        self._next_relation_id += 1
+        self.relations[rid] = {
+            'name': name,
+            'units': OrderedDict(units or {}),
+            'local': dict(local_settings or {}),
+        }
+        return rid
+
+    @property
+    def remote_units(self):
+        """Total number of remote units over all relations"""
+        return sum(len(rel['units']) for rel in self.relations.values())
+
+    def relation_ids(self, name):
+        return [rid for rid, rel in self.relations.items()
+                if rel['name'] == name]
+
+    def settings(self, rid, unit):
+        rel = self.relations.get(rid)
+        if rel is None:
+            return None
+        if unit == self.unit:
+            return rel['local']
+        return rel['units'].get(unit)
+
+    def metadata(self):
+        """Return the charm metadata.yaml contents for this model"""
+        md = {'name': self.unit.split('/')[0]}
+        for name, (role, interface) in self.endpoints.items():
+            md.setdefault(role, {})[name] = {'interface': interface}
+        return md
+
+    @classmethod
+    def generate(cls, peers=3, relations=5, remote_units=50, settings=10,
+                 **kwargs):
+        """Generate a model of a given size.
+
+        The peer relation holds ``peers`` units including the local unit.
+        ``relations`` relations are spread round-robin over the endpoints in
+        ``GENERATED_ENDPOINTS`` and ``remote_units`` units are spread evenly
+        over them. Every remote unit publishes addresses and ``settings``
+        further keys.
+
+        :returns: The generated model.
+        :rtype: Model
+        """
+        model = cls(**kwargs)
+        app = model.unit.split('/')[0]
+        n = 2
+        model.add_endpoint(*PEER_ENDPOINT)
+        for name, interface, role in GENERATED_ENDPOINTS:
+            model.add_endpoint(name, interface, role)
+
+        def unit_settings(n, endpoint=None):
+            data = {'private-address': _address(n),
+                    'ingress-address': _address(n),
+                    'egress-subnets': '{}/32'.format(_address(n))}
+            for key in ENDPOINT_ADDRESS_KEYS.get(endpoint, ()):
+                data[key] = _address(n)
+            for i in range(settings):
+                data['key-{}'.format(i)] = 'value-{}-{}'.format(n, i)
+            return data
+
+        peer_units = OrderedDict()
+        for i in range(1, peers):
+            peer_units['{}/{}'.format(app, i)] = unit_settings(n)
+            n += 1
+        model.add_relation(PEER_ENDPOINT[0], peer_units,
+                           {'private-address': model.address})
+        for r in range(relations):
+            name = GENERATED_ENDPOINTS[r % len(GENERATED_ENDPOINTS)][0]
+            count = remote_units // relations + (
+                1 if r < remote_units % relations else 0)
+            units = OrderedDict()
+            for u in range(count):
+                units['remote-{}/{}'.format(r, u)] = unit_settings(n, name)
+                n += 1
+            model.add_relation(name, units,
+                               {'private-address': model.address})
+        return model
+
+
+def _options(args, with_value=('-r', '-l', '--file', '--format')):
+    """Split hook tool arguments into options and positional arguments"""
+    options = {}
+    positional = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg.startswith('-') and arg != '-':
+            if '=' in arg:
+                key, value = arg.split('=', 1)
+                options[key] = value
+            elif arg in with_value and args:
+                options[arg] = args.pop(0)
+            else:
+                options[arg] = True
+        else:
+            positional.append(arg)
+    return options, positional
+
+
+class HookToolSimulator(object):
+    """Answer hook tool calls from a :class:`Model`.
+
+    Used as a context manager; on entry it writes the model's metadata.yaml
+    to a temporary charm directory, sets the hook environment and replaces
+    the subprocess functions used by charm helpers. Everything is restored
+    on exit.
+
+    :param model: Model to serve.
+    :type model: Model
+    :param hook_name: Name of the simulated hook.
+    :type hook_name: str
+    :param relation_id: Relation id of a simulated relation hook.
+    :type relation_id: str
+    :param remote_unit: Remote unit of a simulated relation hook.
+    :type remote_unit: str
+    :param tool_latency: Seconds to sleep in every hook tool call.
+    :type tool_latency: float
+    """
+
+    PATCHED = ('call', 'check_call', 'check_output')
+
+    def __init__(self, model, hook_name='config-changed', relation_id=None,
+                 remote_unit=None, tool_latency=0.0):
+        self.model = model
+        self.hook_name = hook_name
+        self.relation_id = relation_id
+        self.remote_unit = remote_unit
+        self.tool_latency = tool_latency
+        self.calls = {}
+        self.log = []
+        self.charm_dir = None
+        self._saved = {}
+        self._environ = None
+        self.tools = {
+            'relation-get': self.relation_get,
+            'relation-set': self.relation_set,
+            'relation-ids': self.relation_ids,
+            'relation-list': self.relation_list,
+            'config-get': self.config_get,
+            'leader-get': self.leader_get,
+            'leader-set': self.leader_set,
+            'is-leader': self.is_leader,
+            'unit-get': self.unit_get,
+            'network-get': self.network_get,
+            'goal-state': self.goal_state,
+            'status-get': self.status_get,
+            'opened-ports': lambda args: [],
+            'juju-log': self.juju_log,
+        }
+        for tool in ('status-set', 'application-version-set', 'open-port',
+                     'close-port', 'action-set', 'action-fail',
+                     'add-metric', 'juju-reboot'):
+            self.tools[tool] = lambda args: ''
+
+    @property
+    def forks(self):
+        """Number of hook tool calls made"""
+        return sum(self.calls.values())
+
+    def reset(self):
+        """Zero the call counters and drop hookenv's per-hook caches"""
+        self.calls = {}
+        del self.log[:]
+        hookenv.cache.clear()
+        hookenv._cache_config = None
+        hookenv.flush_relation_snapshot()
+
+    def __enter__(self):
+        self.charm_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.charm_dir, 'metadata.yaml'), 'w') as f:
+            yaml.safe_dump(self.model.metadata(), f)
+        self._environ = os.environ.copy()
+        os.environ.update({
+            'CHARM_DIR': self.charm_dir,
+            'JUJU_CHARM_DIR': self.charm_dir,
+            'JUJU_UNIT_NAME': self.model.unit,
+            'JUJU_HOOK_NAME': self.hook_name,
+            'UNIT_STATE_DB': os.path.join(self.charm_dir, '.unit-state.db'),
+        })
+        for key, value in (('JUJU_RELATION_ID', self.relation_id),
+                           ('JUJU_REMOTE_UNIT', self.remote_unit)):
+            if value:
+                os.environ[key] = value
+            else:
+                os.environ.pop(key, None)
+        if self.relation_id:
+            os.environ['JUJU_RELATION'] = self.relation_id.split(':')[0]
+        for name in self.PATCHED:
+            self._saved[name] = getattr(subprocess, name)
+            setattr(subprocess, name, self._wrap(name))
+        self._saved['juju_version'] = hookenv.juju_version
+        hookenv.juju_version = lambda: self.model.juju_version
+        self.reset()
+        return self
+
+    def __exit__(self, *exc_info):
+        hookenv.juju_version = self._saved.pop('juju_version')
+        for name, func in self._saved.items():
+            setattr(subprocess, name, func)
+        self._saved = {}
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.charm_dir, ignore_errors=True)
+        self.reset()
+
+    def _wrap(self, name):
+        original = self._saved[name]
+
+        def simulated(*args, **kwargs):
+            cmd = args[0] if args else kwargs.get('args')
+            if isinstance(cmd, six.string_types) or not cmd:
+                return original(*args, **kwargs)
+            tool = os.path.basename(str(cmd[0]))
+            if tool not in self.tools:
+                return original(*args, **kwargs)
+            returncode, output = self.run(cmd)
+            if name == 'call':
+                return returncode
+            if returncode:
+                raise subprocess.CalledProcessError(
+                    returncode, cmd, output.encode('UTF-8'))
+            if name == 'check_call':
+                return 0
+            if kwargs.get('universal_newlines'):
+                return output
+            return output.encode('UTF-8')
+        return simulated
+
+    def run(self, cmd):
+        """Run a hook tool command against the model.
+
+        :returns: (returncode, output)
+        :rtype: tuple
+        """
+        tool = os.path.basename(str(cmd[0]))
+        self.calls[tool] = self.calls.get(tool, 0) + 1
+        if self.tool_latency:
+            time.sleep(self.tool_latency)
+        args = [str(arg) for arg in cmd[1:]]
+        try:
+            result = self.tools[tool](args)
+        except KeyError as e:
+            return 2, 'ERROR {}'.format(e)
+        if isinstance(result, tuple):
+            return result
+        if _options(args)[0].get('--format') == 'json':
+            return 0, json.dumps(result)
+        return 0, '' if result is None else str(result)
+
+    def _rid(self, options):
+        return options.get('-r') or os.environ.get('JUJU_RELATION_ID')
+
+    def relation_get(self, args):
+        if '--help' in args:
+            return ''
+        options, positional = _options(args)
+        attribute = positional[0] if positional else '-'
+        unit = (positional[1] if len(positional) > 1
+                else os.environ.get('JUJU_REMOTE_UNIT'))
+        settings = self.model.settings(self._rid(options), unit)
+        if settings is None:
+            return 2, 'ERROR cannot read settings for unit {}'.format(unit)
+        if attribute == '-':
+            return settings
+        return settings.get(attribute)
+
+    def relation_set(self, args):
+        if '--help' in args:
+            return '--file  file containing key-value pairs'
+        options, positional = _options(args)
+        settings = {}
+        if '--file' in options:
+            with open(options['--file']) as f:
+                settings.update(yaml.safe_load(f) or {})
+        for arg in positional:
+            key, value = arg.split('=', 1)
+            settings[key] = value
+        local = self.model.relations[self._rid(options)]['local']
+        for key, value in settings.items():
+            if value in (None, ''):
+                local.pop(key, None)
+            else:
+                local[key] = str(value)
+        return ''
+
+    def relation_ids(self, args):
+        options, positional = _options(args)
+        name = positional[0] if positional else os.environ.get(
+            'JUJU_RELATION')
+        return self.model.relation_ids(name)
+
+    def relation_list(self, args):
+        options, positional = _options(args)
+        rel = self.model.relations[self._rid(options)]
+        return list(rel['units'])
+
+    def config_get(self, args):
+        options, positional = _options(args)
+        if positional:
+            return self.model.config.get(positional[0])
+        return self.model.config
+
+    def leader_get(self, args):
+        options, positional = _options(args)
+        if positional and positional[0] != '-':
+            return self.model.leader_settings.get(positional[0])
+        return self.model.leader_settings
+
+    def leader_set(self, args):
+        if not self.model.leader:
+            return 1, 'ERROR cannot write leadership settings: not the leader'
+        for arg in args:
+            key, value = arg.split('=', 1)
+            if value:
+                self.model.leader_settings[key] = value
+            else:
+                self.model.leader_settings.pop(key, None)
+        return ''
+
+    def is_leader(self, args):
+        return self.model.leader
+
+    def unit_get(self, args):
+        options, positional = _options(args)
+        if positional and positional[0] in ('private-address',
+                                            'public-address'):
+            return self.model.address
+        return None
+
+    def network_get(self, args):
+        options, positional = _options(args)
+        if '--primary-address' in options:
+            return self.model.address
+        address = self.model.address
+        info = {
+            'bind-addresses': [{
+                'macaddress': '00:16:3e:00:00:01',
+                'interfacename': 'eth0',
+                'addresses': [{'address': address,
+                               'cidr': '10.0.0.0/8'}],
+            }],
+            'ingress-addresses': [address],
+            'egress-subnets': ['{}/32'.format(address)],
+        }
+        return yaml.safe_dump(info)
+
+    def goal_state(self, args):
+        units = {self.model.unit: {'status': 'active'}}
+        relations = {}
+        for rel in self.model.relations.values():
+            endpoint = relations.setdefault(rel['name'], {})
+            for unit in rel['units']:
+                endpoint[unit] = {'status': 'active'}
+                if rel['name'] == PEER_ENDPOINT[0]:
+                    units[unit] = {'status': 'active'}
+        return {'units': units, 'relations': relations}
+
+    def status_get(self, args):
+        return {'status': 'active', 'message': '', 'status-data': {}}
+
+    def juju_log(self, args):
+        options, positional = _options(args)
+        self.log.append((options.get('-l'), ' '.join(positional)))
+        return ''
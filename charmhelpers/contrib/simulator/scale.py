@@ -0,0 +1,140 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scale benchmarks for charm helpers against a simulated model.
+
+Each scenario performs the relation reads a typical hook makes through one
+layer of charm helpers. :func:`run` times every scenario against models of
+growing size and reports wall time and the number of hook tool calls::
+
+    from charmhelpers.contrib.simulator import scale
+    for row in scale.run(sizes=[(3, 5, 50), (3, 50, 500)]):
+        print(row)
+
+or from the command line with ``chlp hook-benchmark``.
+"""
+
+import time
+from collections import OrderedDict
+
+from charmhelpers.core import hookenv
+from charmhelpers.contrib.simulator import (
+    GENERATED_ENDPOINTS,
+    HookToolSimulator,
+    Model,
+)
+
+# (peers, relations, remote units)
+DEFAULT_SIZES = ((3, 5, 50), (3, 50, 500), (3, 100, 2000))
+SCENARIOS = OrderedDict()
+
+
+def scenario(name):
+    """Register a benchmark scenario, a function taking the model"""
+    def wrapper(func):
+        SCENARIOS[name] = func
+        return func
+    return wrapper
+
+
+@scenario('hookenv')
+def hookenv_relations(model):
+    """Read every unit's settings on every relation through hookenv"""
+    for reltype in hookenv.relation_types():
+        for rid in hookenv.relation_ids(reltype):
+            for unit in hookenv.related_units(rid):
+                hookenv.relation_get(unit=unit, rid=rid)
+
+
+@scenario('context.Relations')
+def context_relations(model):
+    """Build charmhelpers.context.Relations and read all remote data"""
+    from charmhelpers.context import Relations
+    for relids in Relations().values():
+        for relation in relids.values():
+            for info in relation.values():
+                dict(info)
+
+
+@scenario('services')
+def services_relation_contexts(model):
+    """Evaluate a core.services RelationContext for every endpoint"""
+    from charmhelpers.core.services.helpers import RelationContext
+    for name, interface, role in GENERATED_ENDPOINTS:
+        RelationContext(name=name,
+                        additional_required_keys=['missing']).is_ready()
+
+
+@scenario('openstack')
+def openstack_contexts(model):
+    """Evaluate OpenStack context generators over incomplete relations"""
+    from charmhelpers.contrib.openstack import context
+    context.SharedDBContext(database='bench', user='bench')()
+    context.AMQPContext()()
+    context.IdentityServiceContext()()
+
+
+def run(sizes=DEFAULT_SIZES, scenarios=None, repeat=3, tool_latency=0.0,
+        prefetch=False):
+    """Run the benchmark scenarios against models of the given sizes.
+
+    :param sizes: (peers, relations, remote units) tuples.
+    :type sizes: list
+    :param scenarios: Names of the scenarios to run, default all.
+    :type scenarios: list
+    :param repeat: Runs per scenario and size; the fastest is reported.
+    :type repeat: int
+    :param tool_latency: Seconds added to each hook tool call.
+    :type tool_latency: float
+    :param prefetch: Run with :func:`hookenv.relation_prefetch` enabled.
+    :type prefetch: bool
+    :returns: One dict per scenario and size with the model size, wall time
+              in seconds, number of hook tool calls and per-tool counts, or
+              the error the scenario raised.
+    :rtype: list
+    """
+    rows = []
+    for peers, relations, remote_units in sizes:
+        model = Model.generate(peers=peers, relations=relations,
+                               remote_units=remote_units,
+                               config={'rabbit-user': 'bench',
+                                       'rabbit-vhost': 'bench'})
+        with HookToolSimulator(model, tool_latency=tool_latency) as sim:
+            for name in scenarios or SCENARIOS:
+                row = OrderedDict((
+                    ('scenario', name),
+                    ('peers', peers),
+                    ('relations', relations),
+                    ('remote_units', remote_units),
+                ))
+                best = None
+                try:
+                    for _ in range(repeat):
+                        sim.reset()
+                        hookenv.relation_prefetch(prefetch)
+                        start = time.time()
+                        SCENARIOS[name](model)
+                        elapsed = time.time() - start
+                        if best is None or elapsed < best:
+                            best = elapsed
+                except Exception as e:
+                    row['error'] = '{}: {}'.format(type(e).__name__, e)
+                else:
+                    row['seconds'] = best
+                    row['forks'] = sim.forks
+                    row['calls'] = dict(sim.calls)
+                finally:
+                    hookenv.relation_prefetch(False)
+                rows.append(row)
+    return rows
@@ -19,11 +19,14 @@
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
 from __future__ import print_function
+import atexit as _py_atexit
 import copy
 from distutils.version import LooseVersion
 from functools import wraps
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import glob
+import hashlib
+import marshal
 import os
 import json
 import yaml
@@ -32,6 +35,8 @@ import subprocess
 import sys
 import errno
 import tempfile
+import threading
+import time
 from subprocess import CalledProcessError
 
 import six
@@ -40,6 +45,11 @@ if not six.PY3:
 else:
     from collections import UserDict
 
+from charmhelpers.core import tracing
+
+# Trace hook tool calls when CHARM_HELPERS_TRACE_DIR is set
+tracing.enable_from_environment()
+
 
 CRITICAL = "CRITICAL"
 ERROR = "ERROR"
@@ -50,10 +60,143 @@ TRACE = "TRACE"
 MARKER = object()
 SH_MAX_ARG = 131071
 
-cache = {}
 
+class Cache(object):
+    """Return value cache used by :func:`cached`.
 
-def cached(func):
+    Entries are keyed on a hashable ``(func, args, kwargs)`` tuple and
+    indexed by function name and by every string argument, so
+    invalidating everything for a function, a unit or a relation id does
+    not need to scan the whole cache.
+
+    :param maxsize: Maximum number of entries to hold. When exceeded, the
+                    least recently used entry is evicted. ``None`` (the
+                    default) means unbounded, which is appropriate for a
+                    single hook invocation.
+    :type maxsize: Optional[int]
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._index = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _freeze(value):
+        if isinstance(value, dict):
+            return tuple(sorted((k, Cache._freeze(v))
+                                for k, v in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(Cache._freeze(v) for v in value)
+        if isinstance(value, set):
+            return frozenset(Cache._freeze(v) for v in value)
+        try:
+            hash(value)
+        except TypeError:
+            return str(value)
+        return value
+
+    def make_key(self, func, args, kwargs):
+        """Return the cache key for a call of func with args and kwargs"""
+        return (func, self._freeze(args),
+                self._freeze(kwargs) if kwargs else ())
+
+    @staticmethod
+    def _tokens(key):
+        func, args, kwargs = key
+        tokens = set([func.__name__])
+        for value in args + tuple(v for _, v in kwargs):
+            if isinstance(value, six.string_types):
+                tokens.add(value)
+        return tokens
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            if self.maxsize is not None:
+                del self._entries[key]
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+            else:
+                for token in self._tokens(key):
+                    self._index.setdefault(token, set()).add(key)
+            self._entries[key] = value
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._discard(next(iter(self._entries)))
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        for token in self._tokens(key):
+            keys = self._index.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[token]
+
+    def flush(self, token):
+        """Remove all entries for the function named token, or for calls
+        passing token as an argument (e.g. a unit name or relation id)."""
+        with self._lock:
+            for key in list(self._index.get(token, ())):
+                self._discard(key)
+
+    def flush_function(self, func):
+        """Remove all entries for func (a function or its name)"""
+        self.flush(getattr(func, '__name__', func))
+
+    def flush_relation(self, rid):
+        """Remove all entries for calls made against relation rid"""
+        self.flush(rid)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dict of hit/miss counters and the current size"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = Cache()
+
+PERSISTENT_CACHE_PREFIX = 'charmhelpers.hookenv.cache.'
+# Hooks that discard values remembered across hooks. Names starting with
+# '-' match every hook ending with them.
+PERSISTENT_CACHE_INVALIDATE_ON = ('upgrade-charm', 'config-changed',
+                                  '-relation-departed')
+
+_persistent_cache = False
+_persistent_cache_swept = False
+
+
+def cached(func=None, persist=False, ttl=None,
+           invalidate_on=PERSISTENT_CACHE_INVALIDATE_ON):
     """Cache return values for multiple executions of func + args
 
     For example::
@@ -65,40 +208,173 @@ def cached(func):
         unit_get('test')
 
     will cache the result of unit_get + 'test' for future calls.
+
+    Functions whose results rarely change between hooks can also be
+    remembered across hooks in :mod:`charmhelpers.core.unitdata` while
+    :func:`persistent_cache` is enabled::
+
+        @cached(persist=True, ttl=3600)
+        def juju_version():
+            pass
+
+    Only calls whose arguments and return value are JSON serializable are
+    persisted; exceptions are never cached.
+
+    :param persist: Remember results across hooks.
+    :type persist: bool
+    :param ttl: Seconds a persisted result stays valid, or None for no
+                limit.
+    :type ttl: Optional[float]
+    :param invalidate_on: Hooks that discard persisted results, see
+                          ``PERSISTENT_CACHE_INVALIDATE_ON``.
+    :type invalidate_on: tuple
     """
+    if func is None:
+        return lambda f: cached(f, persist=persist, ttl=ttl,
+                                invalidate_on=invalidate_on)
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = json.dumps((func, args, kwargs), sort_keys=True, default=str)
-        try:
-            return cache[key]
-        except KeyError:
-            pass  # Drop out of the exception handler scope.
-        res = func(*args, **kwargs)
-        cache[key] = res
+        key = cache.make_key(func, args, kwargs)
+        res = cache.get(key, MARKER)
+        if res is MARKER:
+            if persist and _persistent_cache:
+                res = _persistent_call(func, args, kwargs, ttl,
+                                       invalidate_on)
+            else:
+                res = func(*args, **kwargs)
+            cache.set(key, res)
         return res
     wrapper._wrapped = func
     return wrapper
 
 
 def flush(key):
-    """Flushes any entries from function cache where the
-    key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
-    for item in flush_list:
-        del cache[item]
+    """Flushes any entries from function cache for the function named key,
+    or where key was passed as an argument """
+    cache.flush(key)
+
+
+def persistent_cache(enabled=True):
+    """Remember the results of ``@cached(persist=True)`` functions across
+    hooks.
+
+    Results are stored in :func:`charmhelpers.core.unitdata.kv`, outside
+    of its revision history, and are saved along with the charm's own
+    changes when it flushes the store (e.g. at the end of
+    ``kv().hook_scope()``); nothing is committed on the charm's behalf. At
+    the start of each hook, results that have expired or that the current
+    hook invalidates are discarded.
+
+    :param enabled: Whether persisted results should be used.
+    :type enabled: bool
+    """
+    global _persistent_cache, _persistent_cache_swept
+    _persistent_cache = enabled
+    _persistent_cache_swept = False
+
+
+def flush_persistent_cache(func=None):
+    """Discard results remembered across hooks.
+
+    :param func: Only discard results of this function (or function name).
+    """
+    from charmhelpers.core import unitdata
+    prefix = PERSISTENT_CACHE_PREFIX
+    if func is not None:
+        prefix += '{}:'.format(getattr(func, '__name__', func))
+    unitdata.kv().unsetrange(prefix=prefix, history=False)
+
+
+def _persistent_cache_invalidated(hook, invalidate_on):
+    for trigger in invalidate_on:
+        if hook == trigger or (trigger.startswith('-') and
+                               hook.endswith(trigger)):
+            return True
+    return False
+
+
+def _sweep_persistent_cache(db):
+    global _persistent_cache_swept
+    if _persistent_cache_swept:
+        return
+    _persistent_cache_swept = True
+    hook = hook_name()
+    now = time.time()
+    stale = [key for key, entry in
+             db.getrange(PERSISTENT_CACHE_PREFIX).items()
+             if (entry.get('expires') is not None and
+                 entry['expires'] <= now) or
+             _persistent_cache_invalidated(hook,
+                                           entry.get('invalidate_on', ()))]
+    if stale:
+        db.unsetrange(stale, history=False)
+
+
+def in_main_thread():
+    """Whether the caller runs in the main thread.
+
+    Helpers that use :func:`charmhelpers.core.unitdata.kv`, whose sqlite
+    connection is bound to the thread that opened it, check this before
+    touching it from worker threads.
+
+    :rtype: bool
+    """
+    main_thread = getattr(threading, 'main_thread', None)
+    if main_thread is not None:
+        return threading.current_thread() is main_thread()
+    return isinstance(threading.current_thread(),
+                      threading._MainThread)  # pragma: nocover
+
+
+def _persistent_call(func, args, kwargs, ttl, invalidate_on):
+    """Call func, or return its result remembered from an earlier hook"""
+    from charmhelpers.core import unitdata
+    if not in_main_thread():
+        # The unitdata connection may only be used by the thread that
+        # opened it; helpers run from worker threads are not persisted.
+        return func(*args, **kwargs)
+    try:
+        key = '{}{}:{}'.format(PERSISTENT_CACHE_PREFIX, func.__name__,
+                               json.dumps([args, kwargs], sort_keys=True))
+    except (TypeError, ValueError):
+        return func(*args, **kwargs)
+    db = unitdata.kv()
+    _sweep_persistent_cache(db)
+    entry = db.get(key)
+    if entry is not None and (entry['expires'] is None or
+                              entry['expires'] > time.time()):
+        return entry['value']
+    res = func(*args, **kwargs)
+    try:
+        db.set(key, {'value': res,
+                     'expires': time.time() + ttl if ttl else None,
+                     'invalidate_on': list(invalidate_on)}, history=False)
+    except (TypeError, ValueError):
+        return res
+    return res
 
 
 def log(message, level=None):
-    """Write a message to the juju log"""
+    """Write a message to the juju log
+
+    If :func:`log_buffering` is enabled, messages below ``ERROR`` are
+    queued and written in batches; ``ERROR`` and ``CRITICAL`` messages
+    flush the queue and are written immediately.
+    """
+    if not isinstance(message, six.string_types):
+        message = repr(message)
+    sink = _log_sink
+    if sink is not None and sink.write(message, level):
+        return
+    _juju_log(message, level)
+
+
+def _juju_log(message, level=None):
+    """Run juju-log for a single (possibly multi-line) message"""
     command = ['juju-log']
     if level:
         command += ['-l', level]
-    if not isinstance(message, six.string_types):
-        message = repr(message)
     command += [message[:SH_MAX_ARG]]
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
@@ -114,6 +390,148 @@ def log(message, level=None):
             raise
 
 
+LOG_FLUSH_INTERVAL = 1.0
+LOG_BATCH_SIZE = 100
+
+
+class BufferedLogSink(object):
+    """Queue log messages and write them to juju-log in batches.
+
+    Consecutive messages with the same level are joined with newlines into
+    a single ``juju-log`` call (bounded by ``SH_MAX_ARG``), so ordering and
+    levels are preserved while the number of forks drops. Batches are
+    written by a daemon thread every ``flush_interval`` seconds, as soon as
+    ``batch_size`` messages are queued, and when the process exits.
+
+    Messages at ``ERROR`` or above, and any failure to write a batch, flush
+    the queue and switch the sink to synchronous writes so that nothing is
+    lost if the hook is about to crash.
+
+    :param flush_interval: Seconds between background flushes.
+    :type flush_interval: float
+    :param batch_size: Number of queued messages that triggers a flush.
+    :type batch_size: int
+    """
+
+    SYNC_LEVELS = (ERROR, CRITICAL)
+
+    def __init__(self, flush_interval=LOG_FLUSH_INTERVAL,
+                 batch_size=LOG_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.synchronous = False
+        self._queue = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def write(self, message, level=None):
+        """Queue a message.
+
+        :returns: False if the caller should write the message itself,
+                  after the queue has been flushed.
+        :rtype: bool
+        """
+        if self.synchronous or self._stopped or level in self.SYNC_LEVELS:
+            self.flush()
+            return False
+        with self._lock:
+            self._queue.append((level, message[:SH_MAX_ARG]))
+            full = len(self._queue) >= self.batch_size
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='juju-log-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    @staticmethod
+    def _batches(queue):
+        """Group queued (level, message) items into juju-log calls"""
+        batch, size = [], 0
+        for item in queue:
+            if batch and (item[0] != batch[0][0] or
+                          size + len(item[1]) + 1 > SH_MAX_ARG):
+                yield batch
+                batch, size = [], 0
+            batch.append(item)
+            size += len(item[1]) + 1
+        if batch:
+            yield batch
+
+    def flush(self):
+        """Write all queued messages, in order"""
+        with self._flush_lock:
+            with self._lock:
+                queue, self._queue = self._queue, []
+            batches = list(self._batches(queue))
+            while batches:
+                batch = batches[0]
+                try:
+                    _juju_log('\n'.join(m for _, m in batch), batch[0][0])
+                except Exception:
+                    # Requeue what is left and write synchronously from now on
+                    self.synchronous = True
+                    with self._lock:
+                        self._queue[:0] = [i for b in batches for i in b]
+                    raise
+                batches.pop(0)
+
+    def close(self):
+        """Stop the background thread and flush anything still queued"""
+        self._stopped = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.flush()
+
+
+_log_sink = None
+
+
+def log_buffering(enabled=True, flush_interval=LOG_FLUSH_INTERVAL,
+                  batch_size=LOG_BATCH_SIZE):
+    """Buffer :func:`log` messages in a :class:`BufferedLogSink`.
+
+    Any previously active sink is closed and flushed first. The sink is
+    also flushed when the process exits, whether or not the hook succeeds.
+
+    :param enabled: Whether messages should be buffered.
+    :type enabled: bool
+    :param flush_interval: Seconds between background flushes.
+    :type flush_interval: float
+    :param batch_size: Number of queued messages that triggers a flush.
+    :type batch_size: int
+    """
+    global _log_sink
+    if _log_sink is not None:
+        sink, _log_sink = _log_sink, None
+        sink.close()
+    if enabled:
+        _log_sink = BufferedLogSink(flush_interval, batch_size)
+        _py_atexit.register(_log_sink.close)
+
+
+def log_flush():
+    """Write out any buffered log messages"""
+    if _log_sink is not None:
+        _log_sink.flush()
+
+
 class Serializable(UserDict):
     """Wrapper, an object that can be serialized to yaml or json"""
 
@@ -420,9 +838,142 @@ def config(scope=None):
         return None
 
 
+class RelationSnapshot(object):
+    """A point-in-time copy of the relation data visible to this unit.
+
+    The snapshot is populated on first use by listing the relation ids of
+    every relation type declared in metadata.yaml, the units of each of
+    those relations and the complete settings of every unit (including the
+    local unit). Individual attribute reads are then answered from memory
+    rather than by forking one ``relation-get`` per attribute.
+
+    Reads for relations or units that are not part of the snapshot (e.g. a
+    departing unit that is no longer listed) fall through to the hook tools
+    and are added to the snapshot. A unit whose settings cannot be read
+    while loading is left out, so only reads for that unit fail.
+    """
+
+    def __init__(self):
+        self._loaded = False
+        self._relation_ids = {}
+        self._units = {}
+        self._settings = {}
+
+    def load(self):
+        """Populate the snapshot from the hook tools"""
+        for reltype in relation_types():
+            rids = _relation_ids(reltype)
+            self._relation_ids[reltype] = rids
+            for rid in rids:
+                units = _related_units(rid)
+                self._units[rid] = units
+                for unit in units + [local_unit()]:
+                    try:
+                        self.settings(unit, rid)
+                    except CalledProcessError:
+                        # e.g. the unit departed since relation-list ran
+                        pass
+        self._loaded = True
+
+    def relation_ids(self, reltype):
+        if not self._loaded:
+            self.load()
+        if reltype not in self._relation_ids:
+            self._relation_ids[reltype] = _relation_ids(reltype)
+        return list(self._relation_ids[reltype])
+
+    def related_units(self, rid):
+        if not self._loaded:
+            self.load()
+        if rid not in self._units:
+            self._units[rid] = _related_units(rid)
+        return list(self._units[rid])
+
+    def settings(self, unit, rid):
+        """Return the full settings of unit on relation rid"""
+        key = (rid, unit)
+        if key not in self._settings:
+            self._settings[key] = _relation_get(unit=unit, rid=rid)
+        return self._settings[key]
+
+    def get(self, attribute=None, unit=None, rid=None):
+        if not self._loaded:
+            self.load()
+        settings = self.settings(unit, rid)
+        if settings is None:
+            return None
+        if attribute is None:
+            return dict(settings)
+        return settings.get(attribute)
+
+    def invalidate(self, rid=None, unit=None):
+        """Drop cached settings, optionally limited to a relation or unit"""
+        for key in list(self._settings):
+            if rid is not None and key[0] != rid:
+                continue
+            if unit is not None and key[1] != unit:
+                continue
+            del self._settings[key]
+
+
+_relation_prefetch = False
+_relation_snapshot = None
+
+
+def relation_prefetch(enabled=True):
+    """Serve relation reads from a :class:`RelationSnapshot`.
+
+    When enabled, the first call to :func:`relation_get`,
+    :func:`relation_ids` or :func:`related_units` snapshots all relation
+    data visible to this unit and subsequent reads are served from memory.
+    :func:`relation_set` invalidates the local unit's settings on the
+    relation being written.
+
+    :param enabled: Whether relation reads should use the snapshot.
+    :type enabled: bool
+    """
+    global _relation_prefetch
+    _relation_prefetch = enabled
+    flush_relation_snapshot()
+
+
+def relation_snapshot():
+    """Return the current :class:`RelationSnapshot`, creating it if needed"""
+    global _relation_snapshot
+    if _relation_snapshot is None:
+        _relation_snapshot = RelationSnapshot()
+    return _relation_snapshot
+
+
+def flush_relation_snapshot():
+    """Discard the current relation snapshot, if any"""
+    global _relation_snapshot
+    _relation_snapshot = None
+
+
 @cached
 def relation_get(attribute=None, unit=None, rid=None):
     """Get relation information"""
+    if _defer_writes and unit and unit == local_unit():
+        pending = _deferred_relation_settings.get(
+            rid or os.environ.get('JUJU_RELATION_ID'))
+        if pending:
+            return _pending_settings(
+                _relation_read(attribute, unit, rid),
+                attribute, pending)
+    return _relation_read(attribute, unit, rid)
+
+
+def _relation_read(attribute=None, unit=None, rid=None):
+    if _relation_prefetch:
+        unit = unit or remote_unit()
+        rid = rid or relation_id()
+        if unit and rid:
+            return relation_snapshot().get(attribute, unit, rid)
+    return _relation_get(attribute, unit, rid)
+
+
+def _relation_get(attribute=None, unit=None, rid=None):
     _args = ['relation-get', '--format=json']
     if rid:
         _args.append('-r')
@@ -441,27 +992,46 @@ def relation_get(attribute=None, unit=None, rid=None):
 
 
 def relation_set(relation_id=None, relation_settings=None, **kwargs):
-    """Set relation information for the current unit"""
+    """Set relation information for the current unit
+
+    If :func:`defer_writes` is enabled the settings are queued and written
+    with a single ``relation-set`` per relation when the hook exits.
+    """
     relation_settings = relation_settings if relation_settings else {}
-    relation_cmd_line = ['relation-set']
-    accepts_file = "--file" in subprocess.check_output(
-        relation_cmd_line + ["--help"], universal_newlines=True)
-    if relation_id is not None:
-        relation_cmd_line.extend(('-r', relation_id))
     settings = relation_settings.copy()
     settings.update(kwargs)
+    _stringify_settings(settings)
+    if _defer_writes:
+        rid = relation_id or os.environ.get('JUJU_RELATION_ID')
+        _deferred_relation_settings.setdefault(rid, {}).update(settings)
+        _schedule_deferred_flush()
+        flush(local_unit())
+        return
+    _relation_set(relation_id, settings)
+
+
+def _stringify_settings(settings):
     for key, value in settings.items():
         # Force value to be a string: it always should, but some call
         # sites pass in things like dicts or numbers.
         if value is not None:
             settings[key] = "{}".format(value)
+
+
+def _relation_set(relation_id, settings):
+    relation_cmd_line = ['relation-set']
+    accepts_file = "--file" in subprocess.check_output(
+        relation_cmd_line + ["--help"], universal_newlines=True)
+    if relation_id is not None:
+        relation_cmd_line.extend(('-r', relation_id))
     if accepts_file:
         # --file was introduced in Juju 1.23.2. Use it by default if
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
         # stdin, but that feature is broken in 1.23.2: Bug #1454678.
         with tempfile.NamedTemporaryFile(delete=False) as settings_file:
-            settings_file.write(yaml.safe_dump(settings).encode("utf-8"))
+            settings_file.write(
+                yaml.safe_dump(dict(settings)).encode("utf-8"))
         subprocess.check_call(
             relation_cmd_line + ["--file", settings_file.name])
         os.remove(settings_file.name)
@@ -474,6 +1044,87 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
         subprocess.check_call(relation_cmd_line)
     # Flush cache of any relation-gets for local unit
     flush(local_unit())
+    if _relation_snapshot is not None:
+        _relation_snapshot.invalidate(rid=relation_id, unit=local_unit())
+
+
+_defer_writes = False
+_deferred_relation_settings = OrderedDict()
+_deferred_leader_settings = OrderedDict()
+_deferred_flush_scheduled = False
+
+
+def defer_writes(enabled=True):
+    """Coalesce :func:`relation_set` and :func:`leader_set` calls.
+
+    While enabled, settings are accumulated per relation id (and for the
+    leader) instead of being written immediately, and are written by
+    :func:`flush_deferred_writes` when the hook completes successfully.
+    Settings that already hold the requested value are dropped, so
+    relations that end up unchanged are not written at all and do not
+    trigger ``-changed`` hooks on the remote units.
+
+    Pending settings are visible to :func:`relation_get` for the local
+    unit and to :func:`leader_get`. Disabling deferral writes out anything
+    still pending.
+
+    :param enabled: Whether writes should be deferred.
+    :type enabled: bool
+    """
+    global _defer_writes
+    if not enabled:
+        flush_deferred_writes()
+    _defer_writes = enabled
+
+
+def _schedule_deferred_flush():
+    global _deferred_flush_scheduled
+    if not _deferred_flush_scheduled:
+        atexit(flush_deferred_writes)
+        _deferred_flush_scheduled = True
+
+
+def _changed_settings(settings, current):
+    """Return the settings that differ from the current values"""
+    current = current or {}
+    return OrderedDict(
+        (key, value) for key, value in sorted(settings.items())
+        if current.get(key) != value)
+
+
+def flush_deferred_writes():
+    """Write out settings queued by :func:`defer_writes`.
+
+    Issues at most one ``relation-set`` per relation and one
+    ``leader-set``, skipping any that would not change anything.
+    """
+    global _deferred_flush_scheduled
+    _deferred_flush_scheduled = False
+    while _deferred_relation_settings:
+        rid, settings = _deferred_relation_settings.popitem(last=False)
+        changed = _changed_settings(
+            settings, _relation_read(unit=local_unit(), rid=rid))
+        if changed:
+            _relation_set(rid, changed)
+    if _deferred_leader_settings:
+        settings = OrderedDict(_deferred_leader_settings)
+        _deferred_leader_settings.clear()
+        changed = _changed_settings(settings, leader_get())
+        if changed:
+            _leader_set(changed)
+
+
+def _pending_settings(settings, attribute, pending):
+    """Overlay pending deferred writes on settings read from a hook tool"""
+    if attribute:
+        return pending[attribute] if attribute in pending else settings
+    settings = dict(settings or {})
+    for key, value in pending.items():
+        if value is None:
+            settings.pop(key, None)
+        else:
+            settings[key] = value
+    return settings
 
 
 def relation_clear(r_id=None):
@@ -491,6 +1142,12 @@ def relation_clear(r_id=None):
 def relation_ids(reltype=None):
     """A list of relation_ids"""
     reltype = reltype or relation_type()
+    if _relation_prefetch and reltype is not None:
+        return relation_snapshot().relation_ids(reltype)
+    return _relation_ids(reltype)
+
+
+def _relation_ids(reltype):
     relid_cmd_line = ['relation-ids', '--format=json']
     if reltype is not None:
         relid_cmd_line.append(reltype)
@@ -503,6 +1160,12 @@ def relation_ids(reltype=None):
 def related_units(relid=None):
     """A list of related units"""
     relid = relid or relation_id()
+    if _relation_prefetch and relid is not None:
+        return relation_snapshot().related_units(relid)
+    return _related_units(relid)
+
+
+def _related_units(relid):
     units_cmd_line = ['relation-list', '--format=json']
     if relid is not None:
         units_cmd_line.extend(('-r', relid))
@@ -607,11 +1270,140 @@ def relations_of_type(reltype=None):
     return relation_data
 
 
+METADATA_INDEX = '.metadata-index'
+METADATA_INDEX_FORMAT = 1
+METADATA_ROLES = ('provides', 'requires', 'peers')
+
+
+class MetadataIndex(object):
+    """Compiled lookups over the charm's metadata.yaml.
+
+    Maps relation names to their role and interface, interfaces to relation
+    names (overall and per role) and lists the peer relations, so that the
+    relation helpers do not walk the metadata on every call. The index can
+    be saved to and loaded from a marshal file keyed by the SHA1 of
+    metadata.yaml, which spares later hooks parsing the YAML at all.
+
+    :param metadata: Parsed metadata.yaml contents.
+    :type metadata: dict
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.relation_types = []
+        self.relations = {}
+        self.roles = {}
+        self.interfaces = {}
+        self.peers = []
+        for role in METADATA_ROLES:
+            section = metadata.get(role) or {}
+            self.roles[role] = {}
+            self.relation_types.extend(section.keys())
+            if role == 'peers':
+                self.peers.extend(section.keys())
+            for relation_name, relation in section.items():
+                interface = (relation or {}).get('interface')
+                if not interface:
+                    continue
+                self.relations.setdefault(relation_name, (role, interface))
+                self.roles[role].setdefault(
+                    interface, []).append(relation_name)
+                self.interfaces.setdefault(
+                    interface, []).append(relation_name)
+
+    _FIELDS = ('metadata', 'relation_types', 'relations', 'roles',
+               'interfaces', 'peers')
+
+    @classmethod
+    def load(cls, path, digest):
+        """Load a saved index, or return None if it is missing or stale.
+
+        :param path: Path of the saved index.
+        :type path: str
+        :param digest: SHA1 hex digest of the current metadata.yaml.
+        :type digest: str
+        :rtype: Optional[MetadataIndex]
+        """
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                header = marshal.load(f)
+                if header != (METADATA_INDEX_FORMAT,
+                              tuple(sys.version_info[:2]), digest):
+                    return None
+                fields = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        index = cls.__new__(cls)
+        for name, value in zip(cls._FIELDS, fields):
+            setattr(index, name, value)
+        return index
+
+    def save(self, path, digest):
+        """Atomically save the index next to metadata.yaml.
+
+        Failures are ignored; the index is only an optimisation.
+
+        :param path: Path to save the index to.
+        :type path: str
+        :param digest: SHA1 hex digest of the metadata.yaml it was built from.
+        :type digest: str
+        """
+        header = (METADATA_INDEX_FORMAT, tuple(sys.version_info[:2]), digest)
+        fields = tuple(getattr(self, name) for name in self._FIELDS)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       prefix=METADATA_INDEX)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    marshal.dump(header, f)
+                    marshal.dump(fields, f)
+                os.rename(tmp, path)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except (IOError, OSError, ValueError):
+            # ValueError: metadata holding values marshal can not store
+            pass
+
+
+_loaded_metadata_index = None
+
+
+def _load_metadata_index():
+    """Return the :class:`MetadataIndex` for metadata.yaml, using the saved
+    index when it matches the file's contents."""
+    global _loaded_metadata_index
+    path = os.path.join(charm_dir(), 'metadata.yaml')
+    with open(path) as md:
+        content = md.read()
+    if not isinstance(content, six.binary_type):
+        content = content.encode('UTF-8')
+    digest = hashlib.sha1(content).hexdigest()
+    index_path = os.path.join(charm_dir(), METADATA_INDEX)
+    index = MetadataIndex.load(index_path, digest)
+    if index is None:
+        index = MetadataIndex(yaml.safe_load(content))
+        index.save(index_path, digest)
+    _loaded_metadata_index = index
+    return index
+
+
 @cached
 def metadata():
     """Get the current charm metadata.yaml contents as a python object"""
-    with open(os.path.join(charm_dir(), 'metadata.yaml')) as md:
-        return yaml.safe_load(md)
+    return _load_metadata_index().metadata
+
+
+@cached
+def metadata_index():
+    """Get the :class:`MetadataIndex` for the current charm metadata"""
+    md = metadata()
+    index = _loaded_metadata_index
+    if index is None or index.metadata is not md:
+        index = MetadataIndex(md)
+    return index
 
 
 def _metadata_unit(unit):
@@ -635,25 +1427,16 @@ def _metadata_unit(unit):
 @cached
 def relation_types():
     """Get a list of relation types supported by this charm"""
-    rel_types = []
-    md = metadata()
-    for key in ('provides', 'requires', 'peers'):
-        section = md.get(key)
-        if section:
-            rel_types.extend(section.keys())
-    return rel_types
+    return list(metadata_index().relation_types)
 
 
 @cached
 def peer_relation_id():
     '''Get the peers relation id if a peers relation has been joined, else None.'''
-    md = metadata()
-    section = md.get('peers')
-    if section:
-        for key in section:
-            relids = relation_ids(key)
-            if relids:
-                return relids[0]
+    for key in metadata_index().peers:
+        relids = relation_ids(key)
+        if relids:
+            return relids[0]
     return None
 
 
@@ -675,12 +1458,7 @@ def relation_to_role_and_interface(relation_name):
 
     :returns: A tuple containing ``(role, interface)``, or ``(None, None)``.
     """
-    _metadata = metadata()
-    for role in ('provides', 'requires', 'peers'):
-        interface = _metadata.get(role, {}).get(relation_name, {}).get('interface')
-        if interface:
-            return role, interface
-    return None, None
+    return tuple(metadata_index().relations.get(relation_name, (None, None)))
 
 
 @cached
@@ -692,12 +1470,8 @@ def role_and_interface_to_relations(role, interface_name):
 
     :returns: A list of relation names.
     """
-    _metadata = metadata()
-    results = []
-    for relation_name, relation in _metadata.get(role, {}).items():
-        if relation['interface'] == interface_name:
-            results.append(relation_name)
-    return results
+    roles = metadata_index().roles
+    return list(roles.get(role, {}).get(interface_name, []))
 
 
 @cached
@@ -708,10 +1482,7 @@ def interface_to_relations(interface_name):
 
     :returns: A list of relation names.
     """
-    results = []
-    for role in ('provides', 'requires', 'peers'):
-        results.extend(role_and_interface_to_relations(role, interface_name))
-    return results
+    return list(metadata_index().interfaces.get(interface_name, []))
 
 
 @cached
@@ -830,7 +1601,17 @@ def unit_private_ip():
 
 @cached
 def storage_get(attribute=None, storage_id=None):
-    """Get storage attributes"""
+    """Get storage attributes
+
+    Attributes of storage named by storage_id are remembered across hooks
+    while :func:`persistent_cache` is enabled.
+    """
+    if storage_id:
+        return _persistent_storage_get(attribute, storage_id)
+    return _storage_get(attribute, storage_id)
+
+
+def _storage_get(attribute=None, storage_id=None):
     _args = ['storage-get', '--format=json']
     if storage_id:
         _args.extend(('-s', storage_id))
@@ -842,6 +1623,12 @@ def storage_get(attribute=None, storage_id=None):
         return None
 
 
+_persistent_storage_get = cached(
+    _storage_get, persist=True,
+    invalidate_on=('upgrade-charm', '-storage-attached',
+                   '-storage-detaching'))
+
+
 @cached
 def storage_list(storage_name=None):
     """List the storage IDs for the unit"""
@@ -1079,18 +1866,40 @@ def is_leader():
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
 def leader_get(attribute=None):
     """Juju leader get value(s)"""
+    if _defer_writes and _deferred_leader_settings:
+        return _pending_settings(_leader_get(attribute), attribute,
+                                 _deferred_leader_settings)
+    return _leader_get(attribute)
+
+
+def _leader_get(attribute=None):
     cmd = ['leader-get', '--format=json'] + [attribute or '-']
     return json.loads(subprocess.check_output(cmd).decode('UTF-8'))
 
 
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
 def leader_set(settings=None, **kwargs):
-    """Juju leader set value(s)"""
+    """Juju leader set value(s)
+
+    If :func:`defer_writes` is enabled the settings are queued and written
+    with a single ``leader-set`` when the hook exits.
+    """
+    settings = settings or {}
+    settings.update(kwargs)
+    if _defer_writes:
+        settings = dict(settings)
+        _stringify_settings(settings)
+        _deferred_leader_settings.update(settings)
+        _schedule_deferred_flush()
+        return
+    _leader_set(settings)
+
+
+@translate_exc(from_exc=OSError, to_exc=NotImplementedError)
+def _leader_set(settings):
     # Don't log secrets.
     # log("Juju leader-set '%s'" % (settings), level=DEBUG)
     cmd = ['leader-set']
-    settings = settings or {}
-    settings.update(kwargs)
     for k, v in settings.items():
         if v is None:
             cmd.append('{}='.format(k))
@@ -1151,7 +1960,7 @@ def resource_get(name):
         return False
 
 
-@cached
+@cached(persist=True, ttl=3600)
 def juju_version():
     """Full version string (eg. '1.23.3.1-trusty-amd64')"""
     # Per https://bugs.launchpad.net/juju-core/+bug/1455368/comments/1
@@ -1227,6 +2036,9 @@ def network_get_primary_address(binding):
     :return: string. The primary IP address for the named binding
     :raise: NotImplementedError if run on Juju < 2.0
     '''
+    address = network_bindings().primary_address(binding)
+    if address:
+        return address
     cmd = ['network-get', '--primary-address', binding]
     try:
         response = subprocess.check_output(
@@ -1241,12 +2053,14 @@ def network_get_primary_address(binding):
     return response
 
 
-def network_get(endpoint, relation_id=None):
+def network_get(endpoint, relation_id=None, refresh=False):
     """
     Retrieve the network details for a relation endpoint
 
     :param endpoint: string. The name of a relation endpoint
     :param relation_id: int. The ID of the relation for the current context.
+    :param refresh: bool. Discard the bindings fetched so far in this hook,
+        e.g. from long running processes that must see binding changes.
     :return: dict. The loaded YAML output of the network-get query.
     :raise: NotImplementedError if request not supported by the Juju version.
     """
@@ -1254,7 +2068,13 @@ def network_get(endpoint, relation_id=None):
         raise NotImplementedError(juju_version())  # earlier versions require --primary-address
     if relation_id and not has_juju_version('2.3'):
         raise NotImplementedError  # 2.3 added the -r option
+    if refresh:
+        flush_network_bindings()
+    return network_bindings().get(endpoint, relation_id)
 
+
+def _network_get(endpoint, relation_id=None):
+    """Run network-get for an endpoint and return the loaded YAML"""
     cmd = ['network-get', endpoint, '--format', 'yaml']
     if relation_id:
         cmd.append('-r')
@@ -1265,6 +2085,162 @@ def network_get(endpoint, relation_id=None):
     return yaml.safe_load(response)
 
 
+class NetworkBindings(object):
+    """Index of this unit's network bindings for the current hook.
+
+    The ``network-get`` output for each binding (and relation id) is
+    fetched once and reused for the rest of the hook by
+    :func:`network_get`, :func:`network_get_primary_address` and, through
+    it, ``contrib.network.ip.get_relation_ip``. With :func:`network_prefetch`
+    enabled, the first lookup fetches every endpoint and extra binding
+    declared in metadata.yaml.
+    """
+
+    def __init__(self):
+        self._bindings = {}
+        self._prefetched = False
+
+    def bindings(self):
+        """Return the names of all the bindings declared by the charm"""
+        md = metadata()
+        return sorted(set(metadata_index().relations) |
+                      set(md.get('extra-bindings') or ()))
+
+    def prefetch(self, bindings=None):
+        """Fetch the network details of several bindings.
+
+        Bindings that cannot be fetched are skipped, and are looked up
+        individually if they are used.
+
+        :param bindings: Bindings to fetch, by default all of them.
+        :type bindings: list
+        """
+        self._prefetched = True
+        if not has_juju_version('2.2'):
+            return
+        for binding in bindings or self.bindings():
+            if (binding, None) in self._bindings:
+                continue
+            try:
+                info = _network_get(binding)
+            except (CalledProcessError, OSError):
+                continue
+            if info is not None:
+                self._bindings[(binding, None)] = info
+
+    def _known(self, binding, relation_id=None):
+        key = (binding, relation_id)
+        if (key not in self._bindings and _network_prefetch and
+                not self._prefetched):
+            self.prefetch()
+        return self._bindings.get(key)
+
+    def get(self, binding, relation_id=None):
+        """Return the network-get output for binding.
+
+        :param binding: Endpoint or extra binding name.
+        :type binding: str
+        :param relation_id: Relation id for the relation specific view.
+        :type relation_id: Optional[str]
+        :rtype: dict
+        """
+        info = self._known(binding, relation_id)
+        if info is None:
+            info = _network_get(binding, relation_id)
+            if info is not None:
+                self._bindings[(binding, relation_id)] = info
+        return info
+
+    def primary_address(self, binding):
+        """Return the primary address of a fetched binding.
+
+        :returns: The first bind address, as network-get --primary-address
+                  reports it, or None if the binding has not been fetched.
+        :rtype: Optional[str]
+        """
+        info = self._known(binding)
+        try:
+            return info['bind-addresses'][0]['addresses'][0]['address']
+        except (IndexError, KeyError, TypeError):
+            return None
+
+    def addresses(self, binding, relation_id=None):
+        """Return all the bind addresses of binding"""
+        return [address['address']
+                for address in self._bind_addresses(binding, relation_id)
+                if address.get('address')]
+
+    def cidrs(self, binding, relation_id=None):
+        """Return the CIDRs of the bind addresses of binding"""
+        return [address['cidr']
+                for address in self._bind_addresses(binding, relation_id)
+                if address.get('cidr')]
+
+    def ingress_addresses(self, binding, relation_id=None):
+        """Return the addresses advertised to remote units on binding"""
+        info = self.get(binding, relation_id) or {}
+        return list(info.get('ingress-addresses') or [])
+
+    def egress_subnets(self, binding, relation_id=None):
+        """Return the subnets connections from this unit on binding come
+        from"""
+        info = self.get(binding, relation_id) or {}
+        return list(info.get('egress-subnets') or [])
+
+    def _bind_addresses(self, binding, relation_id):
+        info = self.get(binding, relation_id) or {}
+        for bind_address in info.get('bind-addresses') or []:
+            for address in bind_address.get('addresses') or []:
+                yield address
+
+    def index(self):
+        """Return binding -> addresses, cidrs, ingress-addresses and
+        egress-subnets for every binding fetched so far.
+
+        :rtype: OrderedDict
+        """
+        return OrderedDict(
+            (binding, {'addresses': self.addresses(binding),
+                       'cidrs': self.cidrs(binding),
+                       'ingress-addresses': self.ingress_addresses(binding),
+                       'egress-subnets': self.egress_subnets(binding)})
+            for binding, relation_id in sorted(self._bindings)
+            if relation_id is None)
+
+
+_network_prefetch = False
+_network_bindings = None
+
+
+def network_prefetch(enabled=True):
+    """Fetch all network bindings on the first binding lookup.
+
+    :param enabled: Whether bindings should be fetched in bulk.
+    :type enabled: bool
+    """
+    global _network_prefetch
+    _network_prefetch = enabled
+    flush_network_bindings()
+
+
+def network_bindings():
+    """Return the current :class:`NetworkBindings`, creating it if needed.
+
+    The bindings are discarded when the hook completes, see :func:`atexit`.
+    """
+    global _network_bindings
+    if _network_bindings is None:
+        _network_bindings = NetworkBindings()
+        atexit(flush_network_bindings)
+    return _network_bindings
+
+
+def flush_network_bindings():
+    """Discard the network bindings fetched so far"""
+    global _network_bindings
+    _network_bindings = None
+
+
 def add_metric(*args, **kwargs):
     """Add metric values. Values may be expressed with keyword arguments. For
     metric names containing dashes, these may be expressed as one or more
@@ -31,10 +31,14 @@ import hashlib
 import functools
 import itertools
 import six
+import stat
+import tempfile
+import time
 
 from contextlib import contextmanager
 from collections import OrderedDict
-from .hookenv import log, INFO, DEBUG, local_unit, charm_name
+from .hookenv import (
+    log, INFO, DEBUG, local_unit, charm_name, charm_dir, in_main_thread)
 from .fstab import Fstab
 from charmhelpers.osplatform import get_platform
 
@@ -306,6 +310,63 @@ def service_running(service_name, **kwargs):
         return False
 
 
+def services_running(service_names):
+    """Determine whether several system services are running.
+
+    On systemd hosts the state of every service is read with a single
+    ``systemctl show`` call rather than one ``systemctl is-active`` per
+    service.  Other init systems fall back to calling service_running()
+    for each service.
+
+    :param service_names: list of service names to check
+    :returns: OrderedDict of service_name: boolean, in the order given
+    """
+    service_names = list(service_names)
+    states = OrderedDict()
+    if not service_names:
+        return states
+    if init_is_systemd():
+        cmd = ['systemctl', 'show', '--no-pager',
+               '--property=Id,ActiveState'] + service_names
+        try:
+            output = subprocess.check_output(
+                cmd, stderr=subprocess.STDOUT).decode('UTF-8')
+        except (subprocess.CalledProcessError, OSError):
+            output = None
+        blocks = _parse_systemctl_show(output) if output else []
+        # systemctl emits one block per unit in argument order
+        if len(blocks) == len(service_names):
+            for name, props in zip(service_names, blocks):
+                states[name] = props.get('ActiveState') == 'active'
+            return states
+    for name in service_names:
+        states[name] = service_running(name)
+    return states
+
+
+def _parse_systemctl_show(output):
+    """Split ``systemctl show`` output into a list of property dicts, one
+    per unit.
+
+    :param output: str output of ``systemctl show``
+    :returns: list of dicts of property: value
+    """
+    blocks = []
+    current = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line:
+            if current:
+                blocks.append(current)
+                current = {}
+            continue
+        key, _, value = line.partition('=')
+        current[key] = value
+    if current:
+        blocks.append(current)
+    return blocks
+
+
 SYSTEMD_SYSTEM = '/run/systemd/system'
 
 
@@ -531,10 +592,46 @@ def mkdir(path, owner='root', group='root', perms=0o555, force=False):
     os.chmod(realpath, perms)
 
 
-def write_file(path, content, owner='root', group='root', perms=0o444):
-    """Create or overwrite a file with the contents of a byte string."""
-    uid = pwd.getpwnam(owner).pw_uid
-    gid = grp.getgrnam(group).gr_gid
+def _copy_xattrs(path, fd):
+    """Copy the extended attributes of path, such as POSIX ACLs, to fd"""
+    if not hasattr(os, 'listxattr'):
+        return
+    try:
+        names = os.listxattr(path)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.setxattr(fd, name, os.getxattr(path, name))
+        except OSError:
+            # e.g. security attributes that need more privileges
+            pass
+
+
+def write_file(path, content, owner='root', group='root', perms=0o444,
+               atomic=False):
+    """Create or overwrite a file with the contents of a byte string.
+
+    The file is only written if its content differs from ``content``; if
+    only ownership or permissions differ they are corrected in place. An
+    unchanged file is not touched at all, so its mtime is preserved.
+
+    :param owner: User name or uid to own the file.
+    :param group: Group name or gid to own the file.
+    :param atomic: Write the new content to a temporary file in the same
+                   directory and rename it over ``path``, so readers never
+                   see a partially written file. If ``path`` is a symlink
+                   the file it points to is replaced, and the extended
+                   attributes (including ACLs) of the replaced file are
+                   kept where the platform supports them.
+    :type atomic: bool
+    :returns: True if the content, ownership or permissions were changed.
+    :rtype: bool
+    """
+    uid = owner if isinstance(owner, int) else pwd.getpwnam(owner).pw_uid
+    gid = group if isinstance(group, int) else grp.getgrnam(group).gr_gid
+    if six.PY3 and isinstance(content, six.string_types):
+        content = content.encode('UTF-8')
     # lets see if we can grab the file and compare the context, to avoid doing
     # a write.
     existing_content = None
@@ -542,36 +639,59 @@ def write_file(path, content, owner='root', group='root', perms=0o444):
     try:
         with open(path, 'rb') as target:
             existing_content = target.read()
-        stat = os.stat(path)
+        st = os.stat(path)
         existing_uid, existing_gid, existing_perms = (
-            stat.st_uid, stat.st_gid, stat.st_mode
+            st.st_uid, st.st_gid, stat.S_IMODE(st.st_mode)
         )
     except Exception:
         pass
     if content != existing_content:
         log("Writing file {} {}:{} {:o}".format(path, owner, group, perms),
             level=DEBUG)
-        with open(path, 'wb') as target:
-            os.fchown(target.fileno(), uid, gid)
-            os.fchmod(target.fileno(), perms)
-            if six.PY3 and isinstance(content, six.string_types):
-                content = content.encode('UTF-8')
-            target.write(content)
-        return
+        if atomic:
+            # Replace the file a symlink points at, not the symlink.
+            real_path = os.path.realpath(path)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(real_path),
+                prefix='.{}.'.format(os.path.basename(real_path)))
+            try:
+                with os.fdopen(fd, 'wb') as target:
+                    if existing_content is not None:
+                        _copy_xattrs(real_path, target.fileno())
+                    os.fchown(target.fileno(), uid, gid)
+                    os.fchmod(target.fileno(), perms)
+                    target.write(content)
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.rename(tmp_path, real_path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        else:
+            with open(path, 'wb') as target:
+                os.fchown(target.fileno(), uid, gid)
+                os.fchmod(target.fileno(), perms)
+                target.write(content)
+        return True
     # the contents were the same, but we might still need to change the
     # ownership or permissions.
+    changed = False
     if existing_uid != uid:
         log("Changing uid on already existing content: {} -> {}"
             .format(existing_uid, uid), level=DEBUG)
         os.chown(path, uid, -1)
+        changed = True
     if existing_gid != gid:
         log("Changing gid on already existing content: {} -> {}"
             .format(existing_gid, gid), level=DEBUG)
         os.chown(path, -1, gid)
+        changed = True
     if existing_perms != perms:
         log("Changing permissions on existing content: {} -> {}"
             .format(existing_perms, perms), level=DEBUG)
         os.chmod(path, perms)
+        changed = True
+    return changed
 
 
 def fstab_remove(mp):
@@ -635,31 +755,112 @@ def fstab_mount(mountpoint):
     return True
 
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files modified less than this many seconds before they are hashed are not
+# added to the hash cache, as a rewrite within the filesystem's timestamp
+# granularity could leave size and mtime unchanged.
+HASH_CACHE_RACY_WINDOW = 2
+
+_hash_cache = {}
+_persist_file_hashes = False
+
+
 def file_hash(path, hash_type='md5'):
     """Generate a hash checksum of the contents of 'path' or None if not found.
 
+    The file is read in chunks of :data:`HASH_CHUNK_SIZE` bytes, so large
+    files are never held in memory.
+
     :param str hash_type: Any hash alrgorithm supported by :mod:`hashlib`,
                           such as md5, sha1, sha256, sha512, etc.
     """
     if os.path.exists(path):
         h = getattr(hashlib, hash_type)()
         with open(path, 'rb') as source:
-            h.update(source.read())
+            while True:
+                chunk = source.read(HASH_CHUNK_SIZE)
+                h.update(chunk)
+                # A buffered read only comes back short at end of file.
+                if len(chunk) < HASH_CHUNK_SIZE:
+                    break
         return h.hexdigest()
     else:
         return None
 
 
+def persist_file_hashes(enabled=True):
+    """Remember the checksums computed by :func:`cached_file_hash` across
+    hooks.
+
+    Checksums are stored in the unit's
+    :mod:`unitdata <charmhelpers.core.unitdata>` store, outside of its
+    revision history, and saved whenever the charm flushes the store.
+
+    :param enabled: Whether checksums should be persisted.
+    :type enabled: bool
+    """
+    global _persist_file_hashes
+    _persist_file_hashes = enabled
+
+
+def cached_file_hash(path, hash_type='md5'):
+    """Like :func:`file_hash`, but reuse a previously computed checksum if
+    the file's device, inode, size and mtime are unchanged.
+
+    Checksums are kept for the life of the process and, once enabled with
+    :func:`persist_file_hashes`, in the unit's
+    :mod:`unitdata <charmhelpers.core.unitdata>` store. The store is not
+    used from threads other than the main thread, as its connection is
+    bound to the thread that opened it. Files modified within the last
+    :data:`HASH_CACHE_RACY_WINDOW` seconds are always re-read, and the
+    checksums of files that no longer exist are forgotten.
+
+    :param str hash_type: Any hash alrgorithm supported by :mod:`hashlib`.
+    """
+    key = 'host.file_hash:{}:{}'.format(hash_type, path)
+    use_kv = _persist_file_hashes and charm_dir() and in_main_thread()
+    try:
+        st = os.stat(path)
+    except OSError:
+        _hash_cache.pop(key, None)
+        if use_kv:
+            from charmhelpers.core import unitdata
+            db = unitdata.kv()
+            if db.get(key) is not None:
+                db.unset(key, history=False)
+        return file_hash(path, hash_type)
+    mtime_ns = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+    stamp = [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+    entry = _hash_cache.get(key)
+    if entry is None and use_kv:
+        from charmhelpers.core import unitdata
+        entry = unitdata.kv().get(key)
+    if entry and entry['stamp'] == stamp:
+        _hash_cache[key] = entry
+        return entry['hash']
+    checksum = file_hash(path, hash_type)
+    if st.st_mtime < time.time() - HASH_CACHE_RACY_WINDOW:
+        entry = {'stamp': stamp, 'hash': checksum}
+        _hash_cache[key] = entry
+        if use_kv:
+            from charmhelpers.core import unitdata
+            unitdata.kv().set(key, entry, history=False)
+    return checksum
+
+
 def path_hash(path):
     """Generate a hash checksum of all files matching 'path'. Standard
     wildcards like '*' and '?' are supported, see documentation for the 'glob'
     module for more information.
 
+    Checksums of unchanged files are reused, see :func:`cached_file_hash`.
+
     :return: dict: A { filename: hash } dictionary for all matched files.
                    Empty if none found.
     """
     return {
-        filename: file_hash(filename)
+        filename: cached_file_hash(filename)
         for filename in glob.iglob(path)
     }
 
@@ -684,7 +885,9 @@ class ChecksumError(ValueError):
     pass
 
 
-def restart_on_change(restart_map, stopstart=False, restart_functions=None):
+def restart_on_change(restart_map, stopstart=False, restart_functions=None,
+                      restart_workers=None, restart_dependencies=None,
+                      restart_timings=None):
     """Restart services based on configuration files changing
 
     This function is used a decorator, for example::
@@ -707,6 +910,12 @@ def restart_on_change(restart_map, stopstart=False, restart_functions=None):
     @param stopstart: DEFAULT false; whether to stop, start OR restart
     @param restart_functions: nonstandard functions to use to restart services
                               {svc: func, ...}
+    @param restart_workers: number of services to restart concurrently,
+                            see restart_services()
+    @param restart_dependencies: {svc: [svc, ...]} services that must be
+                                 restarted before svc, see restart_services()
+    @param restart_timings: dict updated with {svc: seconds} for each
+                            service restarted, see restart_services()
     @returns result from decorated function
     """
     def wrap(f):
@@ -714,13 +923,16 @@ def restart_on_change(restart_map, stopstart=False, restart_functions=None):
         def wrapped_f(*args, **kwargs):
             return restart_on_change_helper(
                 (lambda: f(*args, **kwargs)), restart_map, stopstart,
-                restart_functions)
+                restart_functions, restart_workers, restart_dependencies,
+                restart_timings)
         return wrapped_f
     return wrap
 
 
 def restart_on_change_helper(lambda_f, restart_map, stopstart=False,
-                             restart_functions=None):
+                             restart_functions=None, restart_workers=None,
+                             restart_dependencies=None,
+                             restart_timings=None):
     """Helper function to perform the restart_on_change function.
 
     This is provided for decorators to restart services if files described
@@ -731,10 +943,13 @@ def restart_on_change_helper(lambda_f, restart_map, stopstart=False,
     @param stopstart: whether to stop, start or restart a service
     @param restart_functions: nonstandard functions to use to restart services
                               {svc: func, ...}
+    @param restart_workers: number of services to restart concurrently
+    @param restart_dependencies: {svc: [svc, ...]} services that must be
+                                 restarted before svc
+    @param restart_timings: dict updated with {svc: seconds} for each
+                            service restarted
     @returns result of lambda_f()
     """
-    if restart_functions is None:
-        restart_functions = {}
     checksums = {path: path_hash(path) for path in restart_map}
     r = lambda_f()
     # create a list of lists of the services to restart
@@ -744,16 +959,103 @@ def restart_on_change_helper(lambda_f, restart_map, stopstart=False,
     # create a flat list of ordered services without duplicates from lists
     services_list = list(OrderedDict.fromkeys(itertools.chain(*restarts)))
     if services_list:
-        actions = ('stop', 'start') if stopstart else ('restart',)
-        for service_name in services_list:
-            if service_name in restart_functions:
-                restart_functions[service_name](service_name)
-            else:
-                for action in actions:
-                    service(action, service_name)
+        timings = restart_services(services_list, stopstart,
+                                   restart_functions, restart_workers,
+                                   restart_dependencies)
+        if restart_timings is not None:
+            restart_timings.update(timings)
     return r
 
 
+def restart_services(services, stopstart=False, restart_functions=None,
+                     workers=None, dependencies=None):
+    """Restart a list of services, optionally several at a time.
+
+    Services are restarted in waves: a service is only restarted once all
+    of its dependencies that are also being restarted have finished. By
+    default services are restarted one after another in the order given.
+
+    :param services: Names of the services to restart.
+    :type services: List[str]
+    :param stopstart: Stop then start each service rather than restart it.
+    :type stopstart: bool
+    :param restart_functions: Nonstandard functions to use to restart
+                              services, {svc: func, ...}
+    :type restart_functions: Optional[Dict[str, Callable]]
+    :param workers: Number of services to restart concurrently within a
+                    wave. None or 1 restarts them sequentially.
+    :type workers: Optional[int]
+    :param dependencies: Services that must be restarted before a service,
+                         {svc: [svc, ...]}. For example restarting haproxy
+                         after all the API services it fronts.
+    :type dependencies: Optional[Dict[str, List[str]]]
+    :returns: The time in seconds each service took to restart, wave by
+              wave and in the order given within each wave (not the order
+              in which concurrent restarts completed).
+    :rtype: OrderedDict
+    :raises ValueError: If the dependencies are circular.
+    """
+    restart_functions = restart_functions or {}
+    actions = ('stop', 'start') if stopstart else ('restart',)
+
+    def _restart(service_name):
+        start = time.time()
+        if service_name in restart_functions:
+            restart_functions[service_name](service_name)
+        else:
+            for action in actions:
+                service(action, service_name)
+        return service_name, time.time() - start
+
+    # Work out the waves up front so circular dependencies are reported
+    # before anything is restarted.
+    waves = list(dependency_waves(services, dependencies or {}))
+    timings = OrderedDict()
+    pool = None
+    if workers and workers > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+    try:
+        for wave in waves:
+            if pool is None or len(wave) == 1:
+                results = [_restart(svc) for svc in wave]
+            else:
+                results = pool.map(_restart, wave)
+            timings.update(results)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return timings
+
+
+def dependency_waves(services, dependencies):
+    """Split services into ordered lists that can be acted on together.
+
+    Each list only holds services whose dependencies among `services` are
+    all in earlier lists, so the services of one list may be restarted or
+    reconfigured concurrently.
+
+    :param services: Names of the services, in their preferred order.
+    :type services: List[str]
+    :param dependencies: {svc: [svc, ...]} services that must come first.
+    :type dependencies: Dict[str, List[str]]
+    :returns: Generator of lists of service names.
+    :raises ValueError: If the dependencies are circular.
+    """
+    pending = list(services)
+    while pending:
+        wave = [svc for svc in pending
+                if not any(dep in pending
+                           for dep in dependencies.get(svc, ()))]
+        if not wave:
+            raise ValueError(
+                'Circular restart dependencies between: {}'.format(
+                    ', '.join(pending)))
+        pending = [svc for svc in pending if svc not in wave]
+        yield wave
+
+
 def pwgen(length=None):
     """Generate a random pasword."""
     if length is None:
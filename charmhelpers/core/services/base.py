@@ -12,13 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
 import json
+import sys
+import uuid
 from inspect import getargspec
 from collections import Iterable, OrderedDict
 
+import six
+
 from charmhelpers.core import host
 from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
 
 
 __all__ = ['ServiceManager', 'ManagerCallback',
@@ -26,8 +32,11 @@ __all__ = ['ServiceManager', 'ManagerCallback',
            'service_restart', 'service_stop']
 
 
+FINGERPRINT_KEY = 'charmhelpers.services.fingerprint.{}'
+
+
 class ServiceManager(object):
-    def __init__(self, services=None):
+    def __init__(self, services=None, incremental=False, workers=None):
         """
         Register a list of services, given their definitions.
 
@@ -43,6 +52,8 @@ class ServiceManager(object):
                 "start": <one or more callbacks>,
                 "stop": <one or more callbacks>,
                 "ports": <list of ports to manage>,
+                "config_keys": <list of config options the service uses>,
+                "depends_on": <list of services to reconfigure first>,
             }
 
         The 'required_data' list should contain dicts of required data (or
@@ -85,6 +96,26 @@ class ServiceManager(object):
         and the default 'stop' handler will close the ports prior to stopping
         the service.
 
+        If `incremental` is True, the inputs of each ready service are
+        fingerprinted and stored in :mod:`charmhelpers.core.unitdata`, and a
+        service whose fingerprint is unchanged since it was last configured
+        is skipped: its 'data_ready' and 'start' callbacks are not run.
+        Skipped services are listed in the `skipped` attribute. The inputs
+        are the contents of the 'required_data' items, the charm config (only
+        the options listed in 'config_keys', if given), the template sources
+        and rendered targets of template callbacks, the callbacks themselves
+        and the 'ports'. All services are reconfigured in the upgrade-charm
+        hook. Fingerprints are kept out of the unitdata revision history and
+        saved along with the charm's own changes when it flushes the store
+        (e.g. at the end of ``kv().hook_scope()``); until then, services are
+        reconfigured as usual.
+
+        The 'depends_on' list names services that must be reconfigured
+        before this one, for example a load balancer fronting API services.
+        If `workers` is greater than one, the callbacks of up to that many
+        services that do not depend on each other run concurrently in
+        threads, so their template rendering and restarts overlap. Callbacks
+        must then be safe to run alongside other services' callbacks.
 
         Examples:
 
@@ -117,6 +148,9 @@ class ServiceManager(object):
         """
         self._ready_file = os.path.join(hookenv.charm_dir(), 'READY-SERVICES.json')
         self._ready = None
+        self.incremental = incremental
+        self.workers = workers
+        self.skipped = []
         self.services = OrderedDict()
         for service in services or []:
             service_name = service['service']
@@ -183,21 +217,142 @@ class ServiceManager(object):
         if ready, optionally restart them.
 
         If no service names are given, reconfigures all registered services.
+        In incremental mode, ready services whose inputs are unchanged are
+        skipped and listed in `skipped`.
+
+        Services are reconfigured after the services listed in their
+        'depends_on'. With `workers` greater than one, the callbacks of
+        services that do not depend on each other run concurrently; the
+        readiness checks and the bookkeeping stay in the calling thread.
         """
-        for service_name in service_names or self.services.keys():
-            if self.is_ready(service_name):
-                self.fire_event('data_ready', service_name)
-                self.fire_event('start', service_name, default=[
-                    service_restart,
-                    manage_ports])
-                self.save_ready(service_name)
-            else:
-                if self.was_ready(service_name):
-                    self.fire_event('data_lost', service_name)
-                self.fire_event('stop', service_name, default=[
-                    manage_ports,
-                    service_stop])
-                self.save_lost(service_name)
+        self.skipped = []
+        service_names = list(service_names or self.services.keys())
+        dependencies = dict(
+            (service_name,
+             self.services.get(service_name, {}).get('depends_on', []))
+            for service_name in service_names)
+        # Work out the waves up front so circular dependencies are
+        # reported before anything is reconfigured.
+        waves = list(host.dependency_waves(service_names, dependencies))
+        pool = None
+        if self.workers and self.workers > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(self.workers)
+        else:
+            waves = [[service_name] for wave in waves
+                     for service_name in wave]
+        try:
+            for wave in waves:
+                plans = [plan for plan in map(self._plan_reconfigure, wave)
+                         if plan is not None]
+                if pool is None or len(plans) < 2:
+                    for plan in plans:
+                        self._fire_reconfigure_events(plan)
+                        self._finish_reconfigure(plan)
+                    continue
+                errors = pool.map(self._try_reconfigure_events, plans)
+                for plan, error in zip(plans, errors):
+                    if error is None:
+                        self._finish_reconfigure(plan)
+                for error in errors:
+                    if error is not None:
+                        six.reraise(*error)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        if self.skipped:
+            hookenv.log('Services unchanged, not reconfigured: {}'.format(
+                ', '.join(self.skipped)), hookenv.DEBUG)
+
+    def _plan_reconfigure(self, service_name):
+        """Return (service_name, ready, was_ready, fingerprint), or None if
+        the service is skipped"""
+        fingerprint = None
+        if self.is_ready(service_name):
+            if self.incremental:
+                fingerprint = self.fingerprint(service_name)
+                if self._unchanged(service_name, fingerprint):
+                    self.skipped.append(service_name)
+                    return None
+            return service_name, True, None, fingerprint
+        return service_name, False, self.was_ready(service_name), fingerprint
+
+    def _fire_reconfigure_events(self, plan):
+        service_name, ready, was_ready, _ = plan
+        if ready:
+            self.fire_event('data_ready', service_name)
+            self.fire_event('start', service_name, default=[
+                service_restart,
+                manage_ports])
+        else:
+            if was_ready:
+                self.fire_event('data_lost', service_name)
+            self.fire_event('stop', service_name, default=[
+                manage_ports,
+                service_stop])
+
+    def _try_reconfigure_events(self, plan):
+        try:
+            self._fire_reconfigure_events(plan)
+        except Exception:
+            return sys.exc_info()
+
+    def _finish_reconfigure(self, plan):
+        service_name, ready, _, fingerprint = plan
+        if ready:
+            self.save_ready(service_name)
+            if fingerprint is not None:
+                # Rendering changes the targets, which are inputs too.
+                self._save_fingerprint(service_name,
+                                       self.fingerprint(service_name))
+        else:
+            self.save_lost(service_name)
+            if self.incremental:
+                self._save_fingerprint(service_name, None)
+
+    def fingerprint(self, service_name):
+        """
+        Return a digest of the inputs of a registered service.
+
+        See the `incremental` argument of :class:`ServiceManager` for the
+        inputs considered.
+        """
+        service = self.get_service(service_name)
+        config = hookenv.config()
+        if 'config_keys' in service:
+            config = dict((key, config.get(key))
+                          for key in service['config_keys'])
+        inputs = {
+            'required_data': [dict(req) for req in
+                              service.get('required_data', [])],
+            'config': dict(config),
+            'ports': list(service.get('ports', [])),
+            'callbacks': dict((event, [_callback_fingerprint(callback)
+                                       for callback in
+                                       _callbacks(service.get(event))])
+                              for event in ('data_ready', 'start')),
+        }
+        serialized = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode('UTF-8')).hexdigest()
+
+    def _unchanged(self, service_name, fingerprint):
+        if hookenv.hook_name() == 'upgrade-charm':
+            return False
+        if not self.was_ready(service_name):
+            return False
+        return unitdata.kv().get(
+            FINGERPRINT_KEY.format(service_name)) == fingerprint
+
+    def _save_fingerprint(self, service_name, fingerprint):
+        key = FINGERPRINT_KEY.format(service_name)
+        kv = unitdata.kv()
+        if kv.get(key) == fingerprint:
+            return
+        if fingerprint is None:
+            kv.unset(key, history=False)
+        else:
+            kv.set(key, fingerprint, history=False)
 
     def stop_services(self, *service_names):
         """
@@ -224,12 +379,7 @@ class ServiceManager(object):
         Fire a data_ready, data_lost, start, or stop event on a given service.
         """
         service = self.get_service(service_name)
-        callbacks = service.get(event_name, default)
-        if not callbacks:
-            return
-        if not isinstance(callbacks, Iterable):
-            callbacks = [callbacks]
-        for callback in callbacks:
+        for callback in _callbacks(service.get(event_name, default)):
             if isinstance(callback, ManagerCallback):
                 callback(self, service_name, event_name)
             else:
@@ -285,6 +435,59 @@ class ServiceManager(object):
         return service_name in self._ready
 
 
+def _callbacks(callbacks):
+    """Return an event's callbacks as a list"""
+    if not callbacks:
+        return []
+    if not isinstance(callbacks, Iterable):
+        return [callbacks]
+    return list(callbacks)
+
+
+def _file_fingerprint(path):
+    try:
+        with open(path, 'rb') as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+    except (IOError, OSError, TypeError):
+        return None
+
+
+def _template_fingerprint(source, template_loader=None):
+    if template_loader is None:
+        if not os.path.isabs(source):
+            source = os.path.join(hookenv.charm_dir() or '', 'templates',
+                                  source)
+        return _file_fingerprint(source)
+    try:
+        text = template_loader.get_source(None, source)[0]
+    except Exception:
+        # A source we cannot read is always considered changed.
+        return str(uuid.uuid4())
+    return hashlib.sha256(text.encode('UTF-8')).hexdigest()
+
+
+def _callback_fingerprint(callback):
+    """Return what identifies a callback and the files it works on"""
+    func = getattr(callback, 'func', callback)  # functools.partial
+    name = getattr(func, '__name__', type(func).__name__)
+    result = {'callback': '{}.{}'.format(getattr(func, '__module__', ''),
+                                         name)}
+    if (isinstance(callback, ManagerCallback) and
+            hasattr(callback, 'source') and hasattr(callback, 'target')):
+        # A TemplateCallback
+        result.update({
+            'source': callback.source,
+            'source_hash': _template_fingerprint(
+                callback.source, getattr(callback, 'template_loader', None)),
+            'target': callback.target,
+            'target_hash': _file_fingerprint(callback.target),
+            'owner': getattr(callback, 'owner', None),
+            'group': getattr(callback, 'group', None),
+            'perms': getattr(callback, 'perms', None),
+        })
+    return result
+
+
 class ManagerCallback(object):
     """
     Special case of a callback that takes the `ServiceManager` instance
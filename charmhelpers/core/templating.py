@@ -14,14 +14,153 @@
 
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
+
+import six
 
 from charmhelpers.core import host
 from charmhelpers.core import hookenv
 
+# Compiled templates are kept in this directory under the charm directory,
+# so they survive across hook invocations.
+BYTECODE_CACHE_DIR = '.jinja2-bytecode'
+# Number of environments for explicit template loaders to keep; those
+# for templates directories are always kept.
+MAX_LOADER_ENVIRONMENTS = 32
+
+_environments = OrderedDict()
+_bytecode_caches = {}
+_lock = threading.RLock()
+_stats = {}
+
+
+def _import_jinja2():
+    try:
+        import jinja2
+    except ImportError:
+        try:
+            from charmhelpers.fetch import apt_install
+        except ImportError:
+            hookenv.log('Could not import jinja2, and could not import '
+                        'charmhelpers.fetch to install it',
+                        level=hookenv.ERROR)
+            raise
+        if sys.version_info.major == 2:
+            apt_install('python-jinja2', fatal=True)
+        else:
+            apt_install('python3-jinja2', fatal=True)
+        import jinja2
+    return jinja2
+
+
+def bytecode_cache_dir():
+    """Return the directory compiled templates are cached in, or None if
+    there is no charm directory."""
+    charm_dir = hookenv.charm_dir()
+    if not charm_dir:
+        return None
+    return os.path.join(charm_dir, BYTECODE_CACHE_DIR)
+
+
+def _bytecode_cache(jinja2):
+    try:
+        cache_dir = bytecode_cache_dir()
+        if cache_dir is None:
+            return None
+        if cache_dir not in _bytecode_caches:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            _bytecode_caches[cache_dir] = jinja2.FileSystemBytecodeCache(
+                cache_dir)
+        return _bytecode_caches[cache_dir]
+    except (IOError, OSError, TypeError):
+        # Rendering works without the cache, only slower.
+        return None
+
+
+def _record(name, seconds):
+    with _lock:
+        _stats[name + 's'] = _stats.get(name + 's', 0) + 1
+        _stats[name + '_time'] = _stats.get(name + '_time', 0.0) + seconds
+
+
+def _time_compiles(env):
+    compile_ = env.compile
+
+    def compile(*args, **kwargs):
+        start = time.time()
+        try:
+            return compile_(*args, **kwargs)
+        finally:
+            _record('compile', time.time() - start)
+    env.compile = compile
+
+
+def environment(templates_dir=None, template_loader=None):
+    """
+    Return the shared Jinja2 environment for a templates directory or a
+    template loader.
+
+    Environments are created once per process and keep their compiled
+    templates in memory. Compiled templates are also written to
+    `bytecode_cache_dir()`, so templates that have not changed are not
+    compiled again in later hooks.
+
+    If omitted, `templates_dir` defaults to the `templates` folder in the charm.
+    """
+    jinja2 = _import_jinja2()
+    if template_loader is not None:
+        key = template_loader
+    else:
+        if templates_dir is None:
+            templates_dir = os.path.join(hookenv.charm_dir(), 'templates')
+        key = os.path.abspath(templates_dir)
+    with _lock:
+        env = _environments.get(key)
+        if env is None:
+            loader = template_loader or jinja2.FileSystemLoader(templates_dir)
+            env = jinja2.Environment(loader=loader,
+                                     bytecode_cache=_bytecode_cache(jinja2))
+            _time_compiles(env)
+            _environments[key] = env
+            loaders = [k for k in _environments
+                       if not isinstance(k, six.string_types)]
+            for k in loaders[:-MAX_LOADER_ENVIRONMENTS]:
+                del _environments[k]
+    return env
+
+
+def stats():
+    """
+    Return counters for the templates rendered by this process.
+
+    The result has the number of 'environments', and the count and total
+    seconds of template compiles ('compiles', 'compile_time'), loads
+    ('loads', 'load_time') and renders ('renders', 'render_time'). Templates
+    found in the bytecode cache are loaded without being compiled.
+    """
+    with _lock:
+        result = {'environments': len(_environments)}
+        for name in ('compile', 'load', 'render'):
+            result[name + 's'] = _stats.get(name + 's', 0)
+            result[name + '_time'] = _stats.get(name + '_time', 0.0)
+    return result
+
+
+def clear_cache():
+    """Discard the shared environments and reset the counters"""
+    with _lock:
+        _environments.clear()
+        _bytecode_caches.clear()
+        _stats.clear()
+
 
 def render(source, target, context, owner='root', group='root',
            perms=0o444, templates_dir=None, encoding='UTF-8',
-           template_loader=None, config_template=None):
+           template_loader=None, config_template=None, atomic=False,
+           return_changed=False):
     """
     Render a template.
 
@@ -36,40 +175,32 @@ def render(source, target, context, owner='root', group='root',
     config_template may be provided to render from a provided template instead
     of loading from a file.
 
-    The `owner`, `group`, and `perms` options will be passed to `write_file`.
+    The `owner`, `group`, `perms` and `atomic` options will be passed to
+    `write_file`. The target is left untouched if the rendered content,
+    ownership and permissions already match.
 
     If omitted, `templates_dir` defaults to the `templates` folder in the charm.
 
+    Templates are loaded through the shared `environment()`, so each is only
+    compiled once, see `stats()`.
+
     The rendered template will be written to the file as well as being returned
-    as a string.
+    as a string. With `return_changed`, a `(content, changed)` tuple is
+    returned instead, where `changed` is the result of `write_file`: True if
+    the target was written or its ownership or permissions corrected, so
+    callers can skip restarting services when nothing changed. It is always
+    False when `target` is None.
 
     Note: Using this requires python-jinja2 or python3-jinja2; if it is not
     installed, calling this will attempt to use charmhelpers.fetch.apt_install
     to install it.
     """
-    try:
-        from jinja2 import FileSystemLoader, Environment, exceptions
-    except ImportError:
-        try:
-            from charmhelpers.fetch import apt_install
-        except ImportError:
-            hookenv.log('Could not import jinja2, and could not import '
-                        'charmhelpers.fetch to install it',
-                        level=hookenv.ERROR)
-            raise
-        if sys.version_info.major == 2:
-            apt_install('python-jinja2', fatal=True)
-        else:
-            apt_install('python3-jinja2', fatal=True)
-        from jinja2 import FileSystemLoader, Environment, exceptions
-
-    if template_loader:
-        template_env = Environment(loader=template_loader)
-    else:
-        if templates_dir is None:
-            templates_dir = os.path.join(hookenv.charm_dir(), 'templates')
-        template_env = Environment(loader=FileSystemLoader(templates_dir))
+    exceptions = _import_jinja2().exceptions
+    if not template_loader and templates_dir is None:
+        templates_dir = os.path.join(hookenv.charm_dir(), 'templates')
+    template_env = environment(templates_dir, template_loader)
 
+    start = time.time()
     # load from a string if provided explicitly
     if config_template is not None:
         template = template_env.from_string(config_template)
@@ -82,12 +213,20 @@ def render(source, target, context, owner='root', group='root',
                         (source, templates_dir),
                         level=hookenv.ERROR)
             raise e
+    _record('load', time.time() - start)
+    start = time.time()
     content = template.render(context)
+    _record('render', time.time() - start)
     if target is not None:
         target_dir = os.path.dirname(target)
         if not os.path.exists(target_dir):
             # This is a terrible default directory permission, as the file
             # or its siblings will often contain secrets.
             host.mkdir(os.path.dirname(target), owner, group, perms=0o755)
-        host.write_file(target, content.encode(encoding), owner, group, perms)
+        changed = host.write_file(target, content.encode(encoding), owner,
+                                  group, perms, atomic=atomic)
+    else:
+        changed = False
+    if return_changed:
+        return content, changed
     return content
@@ -0,0 +1,340 @@
+# Copyright 2014-2015 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tracing of the hook tools and other commands run by charm helpers.
+
+When enabled, every call made through ``subprocess.call``,
+``subprocess.check_call``, ``subprocess.check_output`` (and
+``subprocess.run`` where available) is recorded with the tool name, a
+normalised class of its arguments, the charm helper that spawned it and
+its wall time. Traces are written in the Chrome trace event format, which
+can be loaded into ``chrome://tracing`` or summarised with
+``chlp trace-summary``.
+
+Tracing is enabled for a whole hook by setting ``CHARM_HELPERS_TRACE_DIR``
+in the environment; a trace file is written to that directory when the
+hook process exits::
+
+    CHARM_HELPERS_TRACE_DIR=/var/log/charm-traces hooks/config-changed
+
+or explicitly from charm code::
+
+    from charmhelpers.core import tracing
+    tracing.enable('/var/log/charm-traces')
+"""
+
+import atexit
+import functools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import six
+
+TRACE_DIR_ENV = 'CHARM_HELPERS_TRACE_DIR'
+TRACED_FUNCTIONS = ('call', 'check_call', 'check_output', 'run')
+# Tools whose first positional argument selects what they do
+SUBCOMMAND_TOOLS = ('apt-get', 'apt-mark', 'ceph', 'dpkg', 'ip', 'rbd',
+                    'snap', 'systemctl')
+
+
+def command_tool(cmd):
+    """Return the name of the tool run by a subprocess command.
+
+    :param cmd: Command as passed to subprocess, a list or a shell string.
+    :returns: Base name of the executable.
+    :rtype: str
+    """
+    if isinstance(cmd, six.string_types):
+        cmd = cmd.split()
+    if not cmd:
+        return ''
+    return os.path.basename(str(cmd[0]))
+
+
+def args_class(cmd):
+    """Return a normalised description of a command's arguments.
+
+    Option names are kept and their values, along with positional
+    arguments, are dropped, so that calls which only differ by relation id,
+    unit or key fall into the same class. The first positional argument is
+    kept for tools listed in ``SUBCOMMAND_TOOLS``.
+
+    :param cmd: Command as passed to subprocess, a list or a shell string.
+    :returns: e.g. ``relation-get --format -r``.
+    :rtype: str
+    """
+    if isinstance(cmd, six.string_types):
+        cmd = cmd.split()
+    if not cmd:
+        return ''
+    tool = command_tool(cmd)
+    parts = [tool]
+    subcommand = tool in SUBCOMMAND_TOOLS
+    for arg in cmd[1:]:
+        arg = str(arg)
+        if arg.startswith('-') and len(arg) > 1:
+            parts.append(arg.split('=', 1)[0])
+        elif subcommand:
+            parts.append(arg)
+            subcommand = False
+    return ' '.join(parts)
+
+
+def _caller(frame):
+    """Return 'module.function' of the charm helper that ran a command"""
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module not in (__name__, 'subprocess'):
+            name = '{}.{}'.format(module, frame.f_code.co_name)
+            if module.startswith('charmhelpers.'):
+                return name
+            fallback = fallback or name
+        frame = frame.f_back
+    return fallback or ''
+
+
+class Tracer(object):
+    """Record the commands run through the subprocess module.
+
+    :param hook_name: Name recorded in the trace metadata, by default the
+                      name of the running hook.
+    :type hook_name: str
+    """
+
+    def __init__(self, hook_name=None):
+        self.hook_name = hook_name or os.path.basename(sys.argv[0])
+        self.unit = os.environ.get('JUJU_UNIT_NAME')
+        self.started = time.time()
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._originals = {}
+
+    def install(self):
+        """Wrap the subprocess functions so their calls are recorded"""
+        for name in TRACED_FUNCTIONS:
+            func = getattr(subprocess, name, None)
+            if func is None or name in self._originals:
+                continue
+            self._originals[name] = func
+            setattr(subprocess, name, self._wrap(func))
+
+    def uninstall(self):
+        """Restore the original subprocess functions"""
+        for name, func in self._originals.items():
+            setattr(subprocess, name, func)
+        self._originals = {}
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            # check_call and check_output are built on call and run; only
+            # the outermost call is recorded.
+            if getattr(self._local, 'active', False):
+                return func(*args, **kwargs)
+            self._local.active = True
+            cmd = args[0] if args else kwargs.get('args')
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.active = False
+                self.record(cmd, start, time.time() - start,
+                            _caller(sys._getframe(1)))
+        traced._traced = func
+        return traced
+
+    def record(self, cmd, start, duration, caller=''):
+        """Record a command.
+
+        :param cmd: Command as passed to subprocess.
+        :param start: Start time, in seconds since the epoch.
+        :type start: float
+        :param duration: Wall time, in seconds.
+        :type duration: float
+        :param caller: Helper that ran the command.
+        :type caller: str
+        """
+        event = {
+            'tool': command_tool(cmd),
+            'args_class': args_class(cmd),
+            'caller': caller,
+            'start': start,
+            'duration': duration,
+            'tid': threading.current_thread().ident,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def chrome_trace(self):
+        """Return the recorded events in the Chrome trace event format.
+
+        :rtype: dict
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        return {
+            'traceEvents': [{
+                'name': event['tool'],
+                'cat': event['args_class'],
+                'ph': 'X',
+                'ts': int((event['start'] - self.started) * 1e6),
+                'dur': int(event['duration'] * 1e6),
+                'pid': pid,
+                'tid': event['tid'],
+                'args': {'args_class': event['args_class'],
+                         'caller': event['caller']},
+            } for event in events],
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'hook': self.hook_name,
+                'unit': self.unit,
+                'started': self.started,
+            },
+        }
+
+    def write(self, path):
+        """Write the trace to path as JSON.
+
+        :param path: File to write.
+        :type path: str
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def trace_path(self, trace_dir):
+        """Return a unique trace file name for this hook in trace_dir"""
+        unit = (self.unit or 'unit').replace('/', '-')
+        return os.path.join(trace_dir, '{}-{}-{}-{}.json'.format(
+            unit, self.hook_name, int(self.started), os.getpid()))
+
+
+_tracer = None
+
+
+def enable(trace_dir=None, hook_name=None):
+    """Start tracing subprocess calls.
+
+    :param trace_dir: If given, the trace is written to a new file in this
+                      directory when the process exits.
+    :type trace_dir: str
+    :param hook_name: Name recorded in the trace.
+    :type hook_name: str
+    :returns: The active tracer.
+    :rtype: Tracer
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(hook_name)
+        _tracer.install()
+        if trace_dir:
+            atexit.register(_write_trace, _tracer, trace_dir)
+    return _tracer
+
+
+def _write_trace(tracer, trace_dir):
+    try:
+        if not os.path.isdir(trace_dir):
+            os.makedirs(trace_dir)
+        tracer.write(tracer.trace_path(trace_dir))
+    except (IOError, OSError):
+        pass
+
+
+def disable():
+    """Stop tracing and return the tracer that was active, if any.
+
+    :rtype: Optional[Tracer]
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.uninstall()
+    return tracer
+
+
+def tracer():
+    """Return the active tracer, or None if tracing is not enabled.
+
+    :rtype: Optional[Tracer]
+    """
+    return _tracer
+
+
+def enable_from_environment():
+    """Enable tracing if ``CHARM_HELPERS_TRACE_DIR`` is set"""
+    trace_dir = os.environ.get(TRACE_DIR_ENV)
+    if trace_dir:
+        enable(trace_dir)
+
+
+def load_events(path):
+    """Load the events from a trace file written by :meth:`Tracer.write`.
+
+    :param path: Trace file.
+    :type path: str
+    :returns: List of event dicts with tool, args_class, caller and duration
+              (in seconds).
+    :rtype: list
+    """
+    with open(path) as f:
+        trace = json.load(f)
+    events = []
+    for event in trace.get('traceEvents', []):
+        if event.get('ph') != 'X':
+            continue
+        args = event.get('args', {})
+        events.append({
+            'tool': event.get('name', ''),
+            'args_class': args.get('args_class', event.get('cat', '')),
+            'caller': args.get('caller', ''),
+            'duration': event.get('dur', 0) / 1e6,
+        })
+    return events
+
+
+def summarize(events, key=('tool', 'args_class')):
+    """Aggregate events by key.
+
+    :param events: Events, as recorded by a :class:`Tracer` or returned by
+                   :func:`load_events`.
+    :type events: list
+    :param key: Event fields to group by.
+    :type key: tuple
+    :returns: One dict per group with the key fields, count, total, mean
+              and max wall time, slowest total first.
+    :rtype: list
+    """
+    groups = {}
+    for event in events:
+        group = tuple(event.get(k, '') for k in key)
+        stats = groups.setdefault(group, {'count': 0, 'total': 0.0,
+                                          'max': 0.0})
+        stats['count'] += 1
+        stats['total'] += event['duration']
+        stats['max'] = max(stats['max'], event['duration'])
+    summary = []
+    for group, stats in groups.items():
+        row = dict(zip(key, group))
+        row.update(stats)
+        row['mean'] = stats['total'] / stats['count']
+        summary.append(row)
+    summary.sort(key=lambda row: row['total'], reverse=True)
+    return summary
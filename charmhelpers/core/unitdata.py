@@ -156,8 +156,13 @@ import pprint
 import sqlite3
 import sys
 
+import six
+
 __author__ = 'Kapil Thangavelu <kapil.foss@gmail.com>'
 
+_UNDECODED = object()
+_MAX_CHAR = six.unichr(sys.maxunicode)
+
 
 class Storage(object):
     """Simple key value database for local unit state within charms.
@@ -170,8 +175,30 @@ class Storage(object):
     Note: to facilitate unit testing, ':memory:' can be passed as the
     path parameter which causes sqlite3 to only build the db in memory.
     This should only be used for testing purposes.
+
+    Decoded values are cached in process, so the database is assumed
+    not to be modified by anything other than this instance while it is
+    open.
+
+    The sqlite journal mode can be chosen with ``journal_mode`` (or the
+    ``UNIT_STATE_DB_JOURNAL_MODE`` environment variable), e.g. 'WAL' to
+    make commits cheaper and allow concurrent readers. Other values than
+    those in ``JOURNAL_MODES`` raise ValueError.
+
+    Revision history is kept forever unless ``keep_revisions`` and/or
+    ``keep_days`` are set (or the ``UNIT_STATE_DB_KEEP_REVISIONS`` and
+    ``UNIT_STATE_DB_KEEP_DAYS`` environment variables), in which case
+    older history is pruned at the end of every :meth:`hook_scope`. See
+    also :meth:`compact`.
     """
-    def __init__(self, path=None):
+
+    # Keys per statement when querying many keys at once; sqlite limits
+    # the number of bound parameters (999 on older releases).
+    _BATCH_SIZE = 500
+    JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+
+    def __init__(self, path=None, journal_mode=None, keep_revisions=None,
+                 keep_days=None):
         self.db_path = path
         if path is None:
             if 'UNIT_STATE_DB' in os.environ:
@@ -179,13 +206,26 @@ class Storage(object):
             else:
                 self.db_path = os.path.join(
                     os.environ.get('CHARM_DIR', ''), '.unit-state.db')
+        if journal_mode is None:
+            journal_mode = os.environ.get('UNIT_STATE_DB_JOURNAL_MODE')
+        if journal_mode and journal_mode.upper() not in self.JOURNAL_MODES:
+            raise ValueError('Invalid sqlite journal mode: %r' % journal_mode)
+        if keep_revisions is None and 'UNIT_STATE_DB_KEEP_REVISIONS' in os.environ:
+            keep_revisions = int(os.environ['UNIT_STATE_DB_KEEP_REVISIONS'])
+        if keep_days is None and 'UNIT_STATE_DB_KEEP_DAYS' in os.environ:
+            keep_days = float(os.environ['UNIT_STATE_DB_KEEP_DAYS'])
+        self.keep_revisions = keep_revisions
+        self.keep_days = keep_days
         if self.db_path != ':memory:':
             with open(self.db_path, 'a') as f:
                 os.fchmod(f.fileno(), 0o600)
         self.conn = sqlite3.connect('%s' % self.db_path)
         self.cursor = self.conn.cursor()
+        if journal_mode:
+            self.cursor.execute('pragma journal_mode=%s' % journal_mode)
         self.revision = None
         self._closed = False
+        self._cache = {}
         self._init()
 
     def close(self):
@@ -197,13 +237,29 @@ class Storage(object):
         self._closed = True
 
     def get(self, key, default=None, record=False):
-        self.cursor.execute('select data from kv where key=?', [key])
-        result = self.cursor.fetchone()
-        if not result:
+        try:
+            serialized, value = self._cache[key]
+        except KeyError:
+            self.cursor.execute('select data from kv where key=?', [key])
+            result = self.cursor.fetchone()
+            serialized = result[0] if result else None
+            value = _UNDECODED
+            self._remember(key, serialized)
+        if serialized is None:
             return default
+        if value is _UNDECODED:
+            value = json.loads(serialized)
+            self._remember(key, serialized, value)
         if record:
-            return Record(json.loads(result[0]))
-        return json.loads(result[0])
+            return Record(value)
+        return value
+
+    def _remember(self, key, serialized, value=_UNDECODED):
+        """Cache the serialized value of key, and its decoded value if it
+        is immutable and so safe to hand out to several callers."""
+        if isinstance(value, (dict, list)):
+            value = _UNDECODED
+        self._cache[key] = (serialized, value)
 
     def getrange(self, key_prefix, strip=False):
         """
@@ -215,16 +271,28 @@ class Storage(object):
             names in the returned dict
         :return dict: A (possibly empty) dict of key-value mappings
         """
-        self.cursor.execute("select key, data from kv where key like ?",
-                            ['%s%%' % key_prefix])
-        result = self.cursor.fetchall()
+        return dict(self.iterrange(key_prefix, strip))
 
-        if not result:
-            return {}
-        if not strip:
-            key_prefix = ''
-        return dict([
-            (k[len(key_prefix):], json.loads(v)) for k, v in result])
+    def iterrange(self, key_prefix, strip=False):
+        """
+        Iterate over the keys starting with a common prefix, in key order,
+        yielding (key, value) tuples without loading the whole range into
+        memory.
+
+        :param str key_prefix: Common prefix among all keys
+        :param bool strip: Optionally strip the common prefix from the key
+            names
+        """
+        where, params = _prefix_clause(key_prefix)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                "select key, data from kv %s order by key" % where, params)
+            offset = len(key_prefix) if strip else 0
+            for k, v in cursor:
+                yield k[offset:], json.loads(v)
+        finally:
+            cursor.close()
 
     def update(self, mapping, prefix=""):
         """
@@ -234,20 +302,59 @@ class Storage(object):
         :param str prefix: Optional prefix to apply to all keys in `mapping`
             before setting
         """
-        for k, v in mapping.items():
-            self.set("%s%s" % (prefix, k), v)
-
-    def unset(self, key):
+        serialized = dict(("%s%s" % (prefix, k), json.dumps(v))
+                          for k, v in mapping.items())
+        existing = self._fetch_serialized(serialized.keys())
+        changed = [(k, v) for k, v in serialized.items()
+                   if existing.get(k) != v]
+        if not changed:
+            return
+        self.cursor.executemany(
+            'insert or replace into kv (key, data) values (?, ?)', changed)
+        for k, v in changed:
+            self._remember(k, v)
+        if self.revision:
+            self.cursor.executemany(
+                '''insert or replace into kv_revisions (
+                revision, key, data) values (?, ?, ?)''',
+                [(self.revision, k, v) for k, v in changed])
+
+    def _fetch_serialized(self, keys):
+        """Return a mapping of the serialized values of existing keys"""
+        result = {}
+        missing = []
+        for key in keys:
+            if key in self._cache:
+                if self._cache[key][0] is not None:
+                    result[key] = self._cache[key][0]
+            else:
+                missing.append(key)
+        for i in range(0, len(missing), self._BATCH_SIZE):
+            batch = missing[i:i + self._BATCH_SIZE]
+            self.cursor.execute(
+                'select key, data from kv where key in (%s)' %
+                ','.join(['?'] * len(batch)), batch)
+            found = dict(self.cursor.fetchall())
+            for key in batch:
+                self._remember(key, found.get(key))
+            result.update(found)
+        return result
+
+    def unset(self, key, history=True):
         """
         Remove a key from the database entirely.
+
+        :param str key: Key to remove
+        :param bool history: Record the removal in the revision history
         """
+        self._remember(key, None)
         self.cursor.execute('delete from kv where key=?', [key])
-        if self.revision and self.cursor.rowcount:
+        if history and self.revision and self.cursor.rowcount:
             self.cursor.execute(
                 'insert into kv_revisions values (?, ?, ?)',
                 [key, self.revision, json.dumps('DELETED')])
 
-    def unsetrange(self, keys=None, prefix=""):
+    def unsetrange(self, keys=None, prefix="", history=True):
         """
         Remove a range of keys starting with a common prefix, from the database
         entirely.
@@ -255,71 +362,56 @@ class Storage(object):
         :param list keys: List of keys to remove.
         :param str prefix: Optional prefix to apply to all keys in ``keys``
             before removing.
+        :param bool history: Record the removal in the revision history
         """
         if keys is not None:
             keys = ['%s%s' % (prefix, key) for key in keys]
+            for key in keys:
+                self._remember(key, None)
             self.cursor.execute('delete from kv where key in (%s)' % ','.join(['?'] * len(keys)), keys)
-            if self.revision and self.cursor.rowcount:
+            if history and self.revision and self.cursor.rowcount:
                 self.cursor.execute(
                     'insert into kv_revisions values %s' % ','.join(['(?, ?, ?)'] * len(keys)),
                     list(itertools.chain.from_iterable((key, self.revision, json.dumps('DELETED')) for key in keys)))
         else:
-            self.cursor.execute('delete from kv where key like ?',
-                                ['%s%%' % prefix])
-            if self.revision and self.cursor.rowcount:
+            for key in list(self._cache):
+                if key.startswith(prefix):
+                    del self._cache[key]
+            where, params = _prefix_clause(prefix)
+            self.cursor.execute('delete from kv %s' % where, params)
+            if history and self.revision and self.cursor.rowcount:
                 self.cursor.execute(
                     'insert into kv_revisions values (?, ?, ?)',
                     ['%s%%' % prefix, self.revision, json.dumps('DELETED')])
 
-    def set(self, key, value):
+    def set(self, key, value, history=True):
         """
         Set a value in the database.
 
         :param str key: Key to set the value for
         :param value: Any JSON-serializable value to be set
+        :param bool history: Record the change in the revision history,
+            e.g. False for caches that can be recomputed
         """
         serialized = json.dumps(value)
 
-        self.cursor.execute('select data from kv where key=?', [key])
-        exists = self.cursor.fetchone()
-
         # Skip mutations to the same value
-        if exists:
-            if exists[0] == serialized:
-                return value
+        if self._fetch_serialized([key]).get(key) == serialized:
+            return value
 
-        if not exists:
-            self.cursor.execute(
-                'insert into kv (key, data) values (?, ?)',
-                (key, serialized))
-        else:
-            self.cursor.execute('''
-            update kv
-            set data = ?
-            where key = ?''', [serialized, key])
+        self.cursor.execute(
+            'insert or replace into kv (key, data) values (?, ?)',
+            (key, serialized))
+        self._remember(key, serialized)
 
         # Save
-        if not self.revision:
+        if not history or not self.revision:
             return value
 
         self.cursor.execute(
-            'select 1 from kv_revisions where key=? and revision=?',
-            [key, self.revision])
-        exists = self.cursor.fetchone()
-
-        if not exists:
-            self.cursor.execute(
-                '''insert into kv_revisions (
-                revision, key, data) values (?, ?, ?)''',
-                (self.revision, key, serialized))
-        else:
-            self.cursor.execute(
-                '''
-                update kv_revisions
-                set data = ?
-                where key = ?
-                and   revision = ?''',
-                [serialized, key, self.revision])
+            '''insert or replace into kv_revisions (
+            revision, key, data) values (?, ?, ?)''',
+            (self.revision, key, serialized))
 
         return value
 
@@ -370,7 +462,102 @@ class Storage(object):
             self.revision = None
             raise
         else:
-            self.flush()
+            if self.keep_revisions is not None or self.keep_days is not None:
+                self.prune()
+                self.flush()
+                # Only reclaims space if compact() enabled incremental
+                # auto-vacuum; a no-op otherwise.
+                self.cursor.execute('pragma incremental_vacuum')
+                self.cursor.fetchall()
+            else:
+                self.flush()
+
+    def prune(self, keep_revisions=None, keep_days=None):
+        """Remove revision history outside the retention limits.
+
+        A revision is removed if it is not among the last
+        ``keep_revisions`` revisions or is older than ``keep_days`` days.
+        Limits default to those the storage was created with; with no
+        limits nothing is removed. Current values in the kv table are
+        never affected.
+
+        The deletion is part of the current transaction.
+
+        :param int keep_revisions: Number of most recent revisions to keep
+        :param float keep_days: Age in days of the oldest revision to keep
+        :return int: The number of revisions removed
+        """
+        if keep_revisions is None:
+            keep_revisions = self.keep_revisions
+        if keep_days is None:
+            keep_days = self.keep_days
+        cutoffs = []
+        if keep_revisions is not None:
+            self.cursor.execute(
+                'select version from hooks order by version desc '
+                'limit 1 offset ?', [max(keep_revisions, 0)])
+            row = self.cursor.fetchone()
+            if row:
+                cutoffs.append(row[0] + 1)
+        if keep_days is not None:
+            oldest = (datetime.datetime.utcnow() -
+                      datetime.timedelta(days=keep_days)).isoformat()
+            self.cursor.execute(
+                'select coalesce(max(version), 0) from hooks where date < ?',
+                [oldest])
+            cutoffs.append(self.cursor.fetchone()[0] + 1)
+        if not cutoffs:
+            return 0
+        cutoff = max(cutoffs)
+        if self.revision:
+            # Never prune the revision currently being recorded.
+            cutoff = min(cutoff, self.revision)
+        self.cursor.execute(
+            'delete from kv_revisions where revision < ?', [cutoff])
+        self.cursor.execute('delete from hooks where version < ?', [cutoff])
+        return self.cursor.rowcount
+
+    def compact(self, keep_revisions=None, keep_days=None):
+        """Prune revision history and rebuild the database file to return
+        the freed space to the filesystem.
+
+        Pending changes are committed first. The database is switched to
+        incremental auto-vacuum, so that later pruning at the end of each
+        :meth:`hook_scope` releases space without a full rebuild.
+
+        This can't be called from within a :meth:`hook_scope`.
+
+        :param int keep_revisions: Number of most recent revisions to keep
+        :param float keep_days: Age in days of the oldest revision to keep
+        :return int: The number of revisions removed
+        :raises RuntimeError: If called within a :meth:`hook_scope`
+        """
+        if self.revision:
+            raise RuntimeError("compact() can't be called within a "
+                               "hook_scope()")
+        removed = self.prune(keep_revisions, keep_days)
+        self.flush()
+        self.cursor.execute('pragma auto_vacuum=incremental')
+        self.cursor.execute('vacuum')
+        return removed
+
+    def stats(self):
+        """Return a dict describing the size of the database.
+
+        :return dict: Row counts of the kv, kv_revisions and hooks tables
+            and the allocated and free size of the database in bytes.
+        """
+        result = {}
+        for table in ('kv', 'kv_revisions', 'hooks'):
+            self.cursor.execute('select count(*) from %s' % table)
+            result[table] = self.cursor.fetchone()[0]
+        pragmas = {}
+        for pragma in ('page_size', 'page_count', 'freelist_count'):
+            self.cursor.execute('pragma %s' % pragma)
+            pragmas[pragma] = self.cursor.fetchone()[0]
+        result['size'] = pragmas['page_size'] * pragmas['page_count']
+        result['free'] = pragmas['page_size'] * pragmas['freelist_count']
+        return result
 
     def flush(self, save=True):
         if save:
@@ -379,6 +566,7 @@ class Storage(object):
             return
         else:
             self.conn.rollback()
+            self._cache.clear()
 
     def _init(self):
         self.cursor.execute('''
@@ -422,6 +610,23 @@ class Storage(object):
         pprint.pprint(self.cursor.fetchall(), stream=fh)
 
 
+def _prefix_clause(prefix):
+    """Return a where clause and parameters matching keys starting with
+    prefix.
+
+    The clause is expressed as a key range rather than with ``like`` so
+    sqlite can satisfy it from the primary key index, and so '_' and '%'
+    in the prefix are matched literally.
+    """
+    if not prefix:
+        return '', []
+    upper = prefix.rstrip(_MAX_CHAR)
+    if not upper:
+        return 'where key >= ?', [prefix]
+    upper = upper[:-1] + six.unichr(ord(upper[-1]) + 1)
+    return 'where key >= ? and key < ?', [prefix, upper]
+
+
 def _parse_history(d):
     return (d[0], d[1], json.loads(d[2]), d[3],
             datetime.datetime.strptime(d[-1], "%Y-%m-%dT%H:%M:%S.%f"))
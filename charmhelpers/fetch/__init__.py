@@ -93,6 +93,8 @@ add_source = fetch.add_source
 
 if __platform__ == "ubuntu":
     apt_cache = fetch.apt_cache
+    apt_cache_flush = fetch.apt_cache_flush
+    installed_versions = fetch.installed_versions
     apt_install = fetch.apt_install
     apt_update = fetch.apt_update
     apt_upgrade = fetch.apt_upgrade
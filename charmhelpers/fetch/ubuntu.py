@@ -201,8 +201,25 @@ def filter_missing_packages(packages):
     )
 
 
-def apt_cache(in_memory=True, progress=None):
-    """Build and return an apt cache."""
+# Files whose modification invalidates the shared apt cache handle.
+APT_CACHE_STAMP_PATHS = ['/var/lib/dpkg/status', '/var/lib/apt/lists']
+_apt_cache_handle = None
+_apt_cache_stamp = None
+
+
+def _apt_cache_state():
+    """Return a tuple of mtimes describing the state of the package database.
+    """
+    state = []
+    for path in APT_CACHE_STAMP_PATHS:
+        try:
+            state.append(os.stat(path).st_mtime)
+        except OSError:
+            state.append(None)
+    return tuple(state)
+
+
+def _build_apt_cache(in_memory=True, progress=None):
     from apt import apt_pkg
     apt_pkg.init()
     if in_memory:
@@ -211,6 +228,55 @@ def apt_cache(in_memory=True, progress=None):
     return apt_pkg.Cache(progress)
 
 
+def apt_cache(in_memory=True, progress=None):
+    """Build and return an apt cache.
+
+    The default in-memory cache is built once per process and reused by
+    later calls.  It is rebuilt after apt commands run through this module
+    (apt_install, apt_update, apt_purge, ...) or when the dpkg status file
+    or apt lists change on disk; see also apt_cache_flush().
+
+    :param in_memory: bool: Do not write the binary cache files to disk.
+    :param progress: apt progress object, passed to apt_pkg.Cache.  A fresh
+        cache is always built when progress is given.
+    """
+    global _apt_cache_handle, _apt_cache_stamp
+    if not in_memory or progress is not None:
+        return _build_apt_cache(in_memory, progress)
+    state = _apt_cache_state()
+    if _apt_cache_handle is None or _apt_cache_stamp != state:
+        _apt_cache_handle = _build_apt_cache()
+        _apt_cache_stamp = state
+    return _apt_cache_handle
+
+
+def apt_cache_flush():
+    """Drop the shared apt cache so the next apt_cache() call rebuilds it."""
+    global _apt_cache_handle, _apt_cache_stamp
+    _apt_cache_handle = None
+    _apt_cache_stamp = None
+
+
+def installed_versions(packages):
+    """Return the installed version of each package in a single cache pass.
+
+    :param packages: list of package names.
+    :returns: OrderedDict of package: version string, or None if the package
+        is not installed or unknown to apt.
+    """
+    cache = apt_cache()
+    versions = OrderedDict()
+    for package in packages:
+        try:
+            pkg = cache[package]
+        except KeyError:
+            versions[package] = None
+            continue
+        versions[package] = (
+            pkg.current_ver.ver_str if pkg.current_ver else None)
+    return versions
+
+
 def apt_install(packages, options=None, fatal=False):
     """Install one or more packages."""
     if options is None:
@@ -585,14 +651,18 @@ def _run_apt_command(cmd, fatal=False):
     cmd_env = {
         'DEBIAN_FRONTEND': os.environ.get('DEBIAN_FRONTEND', 'noninteractive')}
 
-    if fatal:
-        _run_with_retries(
-            cmd, cmd_env=cmd_env, retry_exitcodes=(1, APT_NO_LOCK,),
-            retry_message="Couldn't acquire DPKG lock")
-    else:
-        env = os.environ.copy()
-        env.update(cmd_env)
-        subprocess.call(cmd, env=env)
+    try:
+        if fatal:
+            _run_with_retries(
+                cmd, cmd_env=cmd_env, retry_exitcodes=(1, APT_NO_LOCK,),
+                retry_message="Couldn't acquire DPKG lock")
+        else:
+            env = os.environ.copy()
+            env.update(cmd_env)
+            subprocess.call(cmd, env=env)
+    finally:
+        # the package database may have changed, even on failure
+        apt_cache_flush()
 
 
 def get_upstream_version(package):
@@ -8,6 +8,9 @@ from mock import (
     ANY,
 )
 import json
+import os
+import shutil
+import tempfile
 from pprint import pformat
 import yaml
 import csv
@@ -145,6 +148,50 @@ class SubCommandTest(TestCase):
         self.assertEqual(self.cl.exit_code, 1)
 
 
+class UnitdataCommandTest(TestCase):
+    """Test the unitdata subcommands"""
+
+    def setUp(self):
+        super(UnitdataCommandTest, self).setUp()
+        import charmhelpers.cli.unitdata  # noqa: F401 registers the command
+        from charmhelpers.core import unitdata
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.kv = unitdata.Storage(os.path.join(self.tmpdir, 'state.db'))
+        self.addCleanup(self.kv.close)
+        patcher = patch.object(unitdata, '_KV', self.kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def unitdata(self, *argv):
+        args = cli.cmdline.argument_parser.parse_args(('unitdata',) + argv)
+        return args.func(args.action, args.key, args.value,
+                         args.keep_revisions, args.keep_days)
+
+    def test_get_set(self):
+        self.assertEqual(self.unitdata('set', 'foo', 'bar'), '')
+        self.assertEqual(self.unitdata('get', 'foo'), 'bar')
+
+    def test_stats(self):
+        with self.kv.hook_scope('install'):
+            self.kv.set('foo', 'bar')
+        stats = self.unitdata('stats')
+        self.assertEqual((stats['kv'], stats['kv_revisions'],
+                          stats['hooks']), (1, 1, 1))
+        self.assertEqual(stats['size'], os.path.getsize(self.kv.db_path))
+
+    def test_compact(self):
+        for i in range(5):
+            with self.kv.hook_scope('hook%d' % i):
+                self.kv.set('foo', 'x' * 1000 + str(i))
+        result = self.unitdata('compact', '--keep-revisions', '2')
+        self.assertEqual(result['revisions_removed'], 3)
+        self.assertLessEqual(result['size_after'], result['size_before'])
+        self.assertEqual(self.kv.stats()['kv_revisions'], 2)
+        self.assertEqual(self.unitdata('compact', '--keep-days', '0')
+                         ['revisions_removed'], 2)
+
+
 class OutputFormatterTest(TestCase):
     def setUp(self):
         super(OutputFormatterTest, self).setUp()
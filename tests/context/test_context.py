@@ -48,9 +48,49 @@ class TestRelations(unittest.TestCase):
         # Relation data is loaded on demand, not on instantiation.
         self.assertFalse(hookenv.relation_get.called)
 
-        # But we did have to retrieve some lists of units etc.
-        self.assertGreaterEqual(hookenv.relation_ids.call_count, 2)
-        self.assertGreaterEqual(hookenv.related_units.call_count, 2)
+        # And so are the relation ids and units of relations we have
+        # not looked at.
+        hookenv.relation_ids.assert_called_once_with('rel')
+        self.assertFalse(hookenv.related_units.called)
+
+    def test_relations_lazy(self):
+        rels = context.Relations()
+        self.assertFalse(hookenv.relation_types.called)
+
+        rel = rels['rel']['rel:10']
+        self.assertFalse(hookenv.related_units.called)
+        self.assertEqual(list(rel.keys()), ['svc_rel/10'])
+        hookenv.related_units.assert_called_once_with('rel:10')
+
+        # Everything is memoized.
+        self.assertIs(rels['rel']['rel:10'], rel)
+        self.assertEqual(len(rels), 2)
+        self.assertEqual(hookenv.relation_types.call_count, 1)
+        self.assertEqual(hookenv.relation_ids.call_count, 1)
+        self.assertEqual(hookenv.related_units.call_count, 1)
+        self.assertTrue('pear' in rels)
+        self.assertEqual(rels['rel'], {'rel:9': rels['rel']['rel:9'],
+                                       'rel:10': rel})
+
+    def test_relations_lazy_mutators(self):
+        # Every accessor loads the mapping first.
+        self.assertIsInstance(context.Relations().pop('rel', None),
+                              context.RelationIds)
+        self.assertEqual(context.Relations().popitem()[0], 'rel')
+        self.assertIsInstance(context.Relations().setdefault('rel'),
+                              context.RelationIds)
+        rels = context.Relations()
+        rels.update(other=None)
+        self.assertEqual(list(rels), ['pear', 'rel', 'other'])
+        rels = context.Relations()
+        if hasattr(rels, 'move_to_end'):
+            rels.move_to_end('pear')
+            self.assertEqual(list(rels), ['rel', 'pear'])
+        hookenv.relation_types.reset_mock()
+        rels = context.Relations()
+        rels.clear()
+        self.assertEqual(len(rels), 0)
+        self.assertFalse(hookenv.relation_types.called)
 
     def test_relations_peer(self):
         # The Relations instance has a short cut to the peer relation.
@@ -118,6 +158,21 @@ class TestRelations(unittest.TestCase):
         # I use this for logging.
         self.assertEqual(str(r), 'rel:10 (svc_rel/9)')
 
+    def test_relationinfo_remote_data_memoized(self):
+        hookenv.relation_get.return_value = {'key': 'value'}
+        r = context.RelationInfo('rel:10', 'svc_rel/9')
+        self.assertEqual(r['key'], 'value')
+        self.assertEqual(dict(r), {'key': 'value'})
+        hookenv.relation_get.assert_called_once_with(unit='svc_rel/9',
+                                                     rid='rel:10')
+
+    def test_relationinfo_local_data_not_memoized(self):
+        hookenv.relation_get.return_value = {'key': 'value'}
+        r = context.RelationInfo('rel:10', hookenv.local_unit())
+        self.assertEqual(r['key'], 'value')
+        hookenv.relation_get.return_value = {'key': 'new'}
+        self.assertEqual(r['key'], 'new')
+
     def test_relationinfo_local(self):
         r = context.RelationInfo('rel:10', hookenv.local_unit())
 
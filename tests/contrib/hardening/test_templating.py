@@ -308,3 +308,19 @@ class TemplatingTestCase(TestCase):
             os.remove(path)
 
         super(TemplatingTestCase, self).tearDown()
+
+
+class Jinja2InstallTestCase(TestCase):
+
+    def test_updates_apt_before_installing_jinja2(self):
+        from six.moves import reload_module
+        self.addCleanup(reload_module, templating)
+        calls = []
+        with patch.dict('sys.modules', {'jinja2': None}), \
+                patch('charmhelpers.fetch.apt_update',
+                      lambda **kw: calls.append(('update', kw))), \
+                patch('charmhelpers.fetch.apt_install',
+                      lambda pkg, **kw: calls.append(('install', pkg))):
+            reload_module(templating)
+        self.assertEqual(calls[0], ('update', {'fatal': True}))
+        self.assertEqual(calls[1][0], 'install')
@@ -794,6 +794,98 @@ class IPTest(unittest.TestCase):
         self.assertEqual(net_ip.port_has_listener('ip-address', 70), True)
         subprocess_call.assert_called_with(['nc', '-z', 'ip-address', '70'])
 
+    def test_listening_ports(self):
+        tcp = (
+            '  sl  local_address rem_address   st tx_queue rx_queue\n'
+            '   0: 00000000:0016 00000000:0000 0A 00000000:00000000\n'
+            '   1: 0100007F:0CEA 00000000:0000 0A 00000000:00000000\n'
+            '   2: 0A00000A:0016 0200000A:D431 01 00000000:00000000\n')
+        tcp6 = (
+            '  sl  local_address                         remote_address'
+            '                        st\n'
+            '   0: 00000000000000000000000000000000:1F90 '
+            '00000000000000000000000000000000:0000 0A\n')
+        files = {'/proc/net/tcp': tcp, '/proc/net/tcp6': tcp6}
+
+        def _open(path, *args, **kwargs):
+            return mock.mock_open(read_data=files[path])()
+
+        with patch.object(six.moves.builtins, 'open', side_effect=_open):
+            self.assertEqual(net_ip.listening_ports(), {22, 3306, 8080})
+
+    def test_listening_sockets(self):
+        tcp = (
+            '  sl  local_address rem_address   st tx_queue rx_queue\n'
+            '   0: 00000000:0016 00000000:0000 0A 00000000:00000000\n'
+            '   1: 0100007F:0CEA 00000000:0000 0A 00000000:00000000\n'
+            '   2: 0A00000A:0016 0200000A:D431 01 00000000:00000000\n')
+        tcp6 = (
+            '  sl  local_address                         remote_address'
+            '                        st\n'
+            '   0: 00000000000000000000000000000000:1F90 '
+            '00000000000000000000000000000000:0000 0A\n'
+            '   1: 0000000000000000FFFF00000A00000A:0050 '
+            '00000000000000000000000000000000:0000 0A\n')
+        files = {'/proc/net/tcp': tcp, '/proc/net/tcp6': tcp6}
+
+        def _open(path, *args, **kwargs):
+            return mock.mock_open(read_data=files[path])()
+
+        with patch.object(six.moves.builtins, 'open', side_effect=_open):
+            self.assertEqual(net_ip.listening_sockets(),
+                             {('0.0.0.0', 22), ('127.0.0.1', 3306),
+                              ('::', 8080), ('10.0.0.10', 80)})
+
+    @patch.object(net_ip, 'port_has_listener')
+    @patch.object(net_ip, 'listening_sockets')
+    def test_ports_have_listener(self, listening_sockets, port_has_listener):
+        listening_sockets.return_value = {
+            ('0.0.0.0', 22), ('::', 9000), ('10.0.0.10', 8080),
+            ('127.0.0.1', 3306)}
+        result = net_ip.ports_have_listener('0.0.0.0',
+                                            [22, '80', 8080, 9000, 3306])
+        self.assertEqual(list(result.items()),
+                         [(22, True), ('80', False), (8080, False),
+                          (9000, True), (3306, True)])
+        listening_sockets.assert_called_once_with()
+        self.assertEqual(
+            list(net_ip.ports_have_listener('10.0.0.10',
+                                            [22, 8080, 3306]).items()),
+            [(22, True), (8080, True), (3306, False)])
+        self.assertEqual(
+            list(net_ip.ports_have_listener('::ffff:127.0.0.1',
+                                            [3306]).items()),
+            [(3306, True)])
+        self.assertFalse(port_has_listener.called)
+
+    @patch.object(net_ip, 'listening_sockets')
+    def test_ports_have_listener_wildcard_loopback(self, listening_sockets):
+        listening_sockets.return_value = {('127.0.0.1', 3306), ('::1', 5000)}
+        for address in ('0.0.0.0', '::'):
+            self.assertEqual(
+                list(net_ip.ports_have_listener(address, [3306, 5000])
+                     .items()),
+                [(3306, True), (5000, True)])
+        self.assertEqual(
+            list(net_ip.ports_have_listener('10.0.0.10', [3306, 5000])
+                 .items()),
+            [(3306, False), (5000, False)])
+
+    @patch.object(net_ip, 'port_has_listener')
+    @patch.object(net_ip, 'listening_sockets')
+    def test_ports_have_listener_fallback(self, listening_sockets,
+                                          port_has_listener):
+        listening_sockets.return_value = None
+        port_has_listener.side_effect = [True, False]
+        result = net_ip.ports_have_listener('0.0.0.0', [22, 80])
+        self.assertEqual(list(result.items()), [(22, True), (80, False)])
+        port_has_listener.reset_mock()
+        port_has_listener.side_effect = [True]
+        listening_sockets.reset_mock()
+        net_ip.ports_have_listener('localhost', [22])
+        port_has_listener.assert_called_once_with('localhost', 22)
+        self.assertFalse(listening_sockets.called)
+
     @patch.object(net_ip, 'log', lambda *args, **kwargs: None)
     @patch.object(net_ip, 'config')
     @patch.object(net_ip, 'network_get_primary_address')
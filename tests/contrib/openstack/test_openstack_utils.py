@@ -2,6 +2,7 @@ import io
 import os
 import contextlib
 import unittest
+from collections import OrderedDict
 from copy import copy
 from tests.helpers import patch_open
 from testtools import TestCase
@@ -142,6 +143,19 @@ class FakeReverse(object):
         return '156.94.189.91.in-addr.arpa'
 
 
+def fake_states(states):
+    """Side effect for the bulk services_running/ports_have_listener checks.
+
+    states is either a single boolean for every key or a list of booleans,
+    one per key in the order requested.
+    """
+    def _states(*args):
+        keys = list(args[-1])
+        values = states if isinstance(states, list) else [states] * len(keys)
+        return OrderedDict(zip(keys, values))
+    return _states
+
+
 class FakeDNSName(object):
 
     def __init__(self, dnsname):
@@ -159,6 +173,11 @@ class FakeDNS(object):
 
 class OpenStackHelpersTestCase(TestCase):
 
+    def setUp(self):
+        super(OpenStackHelpersTestCase, self).setUp()
+        fetch.apt_cache_flush()
+        self.addCleanup(fetch.apt_cache_flush)
+
     def _apt_cache(self):
         # mocks out the apt cache
         def cache_get(package):
@@ -916,45 +935,52 @@ class OpenStackHelpersTestCase(TestCase):
         self.assertTrue(actual_parm1 == 'blocked')
         self.assertTrue(actual_parm2 == expected1 or actual_parm2 == expected2)
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    def test_per_service_checks_still_importable(self):
+        # Charms patch these names in their own unit tests.
+        with patch('charmhelpers.contrib.openstack.utils.service_running'), \
+                patch('charmhelpers.contrib.openstack.utils.'
+                      'port_has_listener'):
+            pass
+
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_with_services_list(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
 
         services = ['database', 'identity']
         # Assume that the service and ports are open.
-        port_has_listener.return_value = True
-        service_running.return_value = True
+        ports_have_listener.side_effect = fake_states(True)
+        services_running.side_effect = fake_states(True)
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
         status_set.assert_called_with('active', 'Unit is ready')
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_services_list_not_running(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
 
         services = ['database', 'identity']
-        port_has_listener.return_value = True
+        ports_have_listener.side_effect = fake_states(True)
         # Fail the identity service
-        service_running.side_effect = [True, False]
+        services_running.side_effect = fake_states([True, False])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -962,15 +988,15 @@ class OpenStackHelpersTestCase(TestCase):
             'blocked',
             'Services not running that should be: identity')
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_with_services(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -980,22 +1006,22 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'identity', 'ports': [30]},
         ]
         # Assume that the service and ports are open.
-        port_has_listener.return_value = True
-        service_running.return_value = True
+        ports_have_listener.side_effect = fake_states(True)
+        services_running.side_effect = fake_states(True)
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
         status_set.assert_called_with('active', 'Unit is ready')
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_service_not_running(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -1004,9 +1030,9 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
-        port_has_listener.return_value = True
+        ports_have_listener.side_effect = fake_states(True)
         # Fail the identity service
-        service_running.side_effect = [True, False]
+        services_running.side_effect = fake_states([True, False])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -1014,15 +1040,15 @@ class OpenStackHelpersTestCase(TestCase):
             'blocked',
             'Services not running that should be: identity')
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_port_not_open(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -1031,9 +1057,9 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
-        port_has_listener.side_effect = [True, False, True]
+        ports_have_listener.side_effect = fake_states([True, False, True])
         # Fail the identity service
-        service_running.return_value = True
+        services_running.side_effect = fake_states(True)
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -1042,19 +1068,19 @@ class OpenStackHelpersTestCase(TestCase):
             'Services with ports not open that should be:'
             ' database: [20]')
 
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=False)
     def test_set_os_workload_status_complete_ports_not_open(
-            self, is_unit_paused_set, status_set, log, port_has_listener):
+            self, is_unit_paused_set, status_set, log, ports_have_listener):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
 
         ports = [50, 60, 70]
-        port_has_listener.side_effect = [True, False, True]
+        ports_have_listener.side_effect = fake_states([True, False, True])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, ports=ports)
@@ -1077,15 +1103,15 @@ class OpenStackHelpersTestCase(TestCase):
             'maintenance',
             "Paused. Use 'resume' action to resume normal service.")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=True)
     def test_set_os_workload_status_paused_services_check(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -1094,8 +1120,8 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
-        port_has_listener.return_value = False
-        service_running.side_effect = [False, False]
+        ports_have_listener.side_effect = fake_states(False)
+        services_running.side_effect = fake_states([False, False])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -1103,15 +1129,15 @@ class OpenStackHelpersTestCase(TestCase):
             'maintenance',
             "Paused. Use 'resume' action to resume normal service.")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=True)
     def test_set_os_workload_status_paused_services_fail(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -1120,9 +1146,9 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
-        port_has_listener.return_value = False
+        ports_have_listener.side_effect = fake_states(False)
         # Fail the identity service
-        service_running.side_effect = [False, True]
+        services_running.side_effect = fake_states([False, True])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -1130,15 +1156,15 @@ class OpenStackHelpersTestCase(TestCase):
             'blocked',
             "Services should be paused but these services running: identity")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=True)
     def test_set_os_workload_status_paused_services_ports_fail(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener, service_running):
+            ports_have_listener, services_running):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
@@ -1148,8 +1174,8 @@ class OpenStackHelpersTestCase(TestCase):
             {'service': 'identity', 'ports': [30]},
         ]
         # make the service 20 port be still listening.
-        port_has_listener.side_effect = [False, True, False]
-        service_running.return_value = False
+        ports_have_listener.side_effect = fake_states([False, True, False])
+        services_running.side_effect = fake_states(False)
 
         openstack.set_os_workload_status(
             configs, required_interfaces, services=services)
@@ -1158,20 +1184,20 @@ class OpenStackHelpersTestCase(TestCase):
             "Services should be paused but these service:ports are open:"
             " database: [20]")
 
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=True)
     def test_set_os_workload_status_paused_ports_check(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener):
+            ports_have_listener):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
 
         ports = [50, 60, 70]
-        port_has_listener.side_effect = [False, False, False]
+        ports_have_listener.side_effect = fake_states([False, False, False])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, ports=ports)
@@ -1179,21 +1205,21 @@ class OpenStackHelpersTestCase(TestCase):
             'maintenance',
             "Paused. Use 'resume' action to resume normal service.")
 
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     @patch.object(openstack, 'juju_log')
     @patch('charmhelpers.contrib.openstack.utils.status_set')
     @patch('charmhelpers.contrib.openstack.utils.is_unit_paused_set',
            return_value=True)
     def test_set_os_workload_status_paused_ports_fail(
             self, is_unit_paused_set, status_set, log,
-            port_has_listener):
+            ports_have_listener):
         configs = MagicMock()
         configs.complete_contexts.return_value = []
         required_interfaces = {}
 
         # fail port 70 to make it seem to be running
         ports = [50, 60, 70]
-        port_has_listener.side_effect = [False, False, True]
+        ports_have_listener.side_effect = fake_states([False, False, True])
 
         openstack.set_os_workload_status(
             configs, required_interfaces, ports=ports)
@@ -1202,26 +1228,26 @@ class OpenStackHelpersTestCase(TestCase):
             "Services should be paused but "
             "these ports which should be closed, but are open: 70")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_simple_services(
-            self, port_has_listener, service_running):
+            self, ports_have_listener, services_running):
         services = ['database', 'identity']
-        port_has_listener.return_value = False
-        service_running.return_value = False
+        ports_have_listener.side_effect = fake_states(False)
+        services_running.side_effect = fake_states(False)
 
         state, message = openstack.check_actually_paused(
             services)
         self.assertEquals(state, None)
         self.assertEquals(message, None)
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_simple_services_fail(
-            self, port_has_listener, service_running):
+            self, ports_have_listener, services_running):
         services = ['database', 'identity']
-        port_has_listener.return_value = False
-        service_running.side_effect = [False, True]
+        ports_have_listener.side_effect = fake_states(False)
+        services_running.side_effect = fake_states([False, True])
 
         state, message = openstack.check_actually_paused(
             services)
@@ -1230,34 +1256,34 @@ class OpenStackHelpersTestCase(TestCase):
             message,
             "Services should be paused but these services running: identity")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_services_dict(
-            self, port_has_listener, service_running):
+            self, ports_have_listener, services_running):
         services = [
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
         # Assume that the service and ports are open.
-        port_has_listener.return_value = False
-        service_running.return_value = False
+        ports_have_listener.side_effect = fake_states(False)
+        services_running.side_effect = fake_states(False)
 
         state, message = openstack.check_actually_paused(
             services)
         self.assertEquals(state, None)
         self.assertEquals(message, None)
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_services_dict_fail(
-            self, port_has_listener, service_running):
+            self, ports_have_listener, services_running):
         services = [
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
         # Assume that the service and ports are open.
-        port_has_listener.return_value = False
-        service_running.side_effect = [False, True]
+        ports_have_listener.side_effect = fake_states(False)
+        services_running.side_effect = fake_states([False, True])
 
         state, message = openstack.check_actually_paused(
             services)
@@ -1266,17 +1292,17 @@ class OpenStackHelpersTestCase(TestCase):
             message,
             "Services should be paused but these services running: identity")
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_services_dict_ports_fail(
-            self, port_has_listener, service_running):
+            self, ports_have_listener, services_running):
         services = [
             {'service': 'database', 'ports': [10, 20]},
             {'service': 'identity', 'ports': [30]},
         ]
         # Assume that the service and ports are open.
-        port_has_listener.side_effect = [False, True, False]
-        service_running.return_value = False
+        ports_have_listener.side_effect = fake_states([False, True, False])
+        services_running.side_effect = fake_states(False)
 
         state, message = openstack.check_actually_paused(
             services)
@@ -1285,12 +1311,12 @@ class OpenStackHelpersTestCase(TestCase):
                           'Services should be paused but these service:ports'
                           ' are open: database: [20]')
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_ports_okay(
-            self, port_has_listener, service_running):
-        port_has_listener.side_effect = [False, False, False]
-        service_running.return_value = False
+            self, ports_have_listener, services_running):
+        ports_have_listener.side_effect = fake_states([False, False, False])
+        services_running.side_effect = fake_states(False)
         ports = [50, 60, 70]
 
         state, message = openstack.check_actually_paused(
@@ -1298,12 +1324,12 @@ class OpenStackHelpersTestCase(TestCase):
         self.assertEquals(state, None)
         self.assertEquals(state, None)
 
-    @patch('charmhelpers.contrib.openstack.utils.service_running')
-    @patch('charmhelpers.contrib.openstack.utils.port_has_listener')
+    @patch('charmhelpers.contrib.openstack.utils.services_running')
+    @patch('charmhelpers.contrib.openstack.utils.ports_have_listener')
     def test_check_actually_paused_ports_fail(
-            self, port_has_listener, service_running):
-        port_has_listener.side_effect = [False, True, False]
-        service_running.return_value = False
+            self, ports_have_listener, services_running):
+        ports_have_listener.side_effect = fake_states([False, True, False])
+        services_running.side_effect = fake_states(False)
         ports = [50, 60, 70]
 
         state, message = openstack.check_actually_paused(
@@ -1,11 +1,16 @@
 
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 
 from mock import patch, call, MagicMock
 
+import charmhelpers.contrib.openstack.context as os_context
 import charmhelpers.contrib.openstack.templating as templating
 
+import jinja2
 from jinja2.exceptions import TemplateNotFound
 
 import six
@@ -177,10 +182,47 @@ class TemplatingTests(unittest.TestCase):
         self.renderer.register('/tmp/foo', [self.context])
         with patch.object(self.renderer, '_get_template') as _get_t:
             fake_tmpl = MockTemplate()
+            fake_tmpl.render.return_value = 'foo = bar'
             _get_t.return_value = fake_tmpl
             self.renderer.write('/tmp/foo')
             _open.assert_called_with('/tmp/foo', 'wb')
 
+    def test_write_only_changed_config(self):
+        '''It only replaces config files whose content changed'''
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        foo = os.path.join(tmpdir, 'foo.conf')
+        bar = os.path.join(tmpdir, 'bar.conf')
+        os.mkdir(os.path.join(tmpdir, 'real'))
+        real_bar = os.path.join(tmpdir, 'real', 'bar.conf')
+        with open(real_bar, 'w') as f:
+            f.write('old')
+        os.chmod(real_bar, 0o640)
+        os.symlink(real_bar, bar)
+        rendered = {foo: 'foo = 1', bar: 'bar = 1'}
+        self.renderer.register(foo, [self.context])
+        self.renderer.register(bar, [self.context])
+        with patch.object(self.renderer, 'render') as render:
+            render.side_effect = lambda f: rendered[f]
+            self.assertEqual(self.renderer.write_all(),
+                             {foo: True, bar: True})
+            bar_inode = os.stat(bar).st_ino
+            self.assertEqual(self.renderer.write_all(),
+                             {foo: False, bar: False})
+            self.assertEqual(os.stat(bar).st_ino, bar_inode)
+
+            rendered[bar] = 'bar = 2'
+            self.assertEqual(self.renderer.write_all(),
+                             {foo: False, bar: True})
+        with open(bar) as f:
+            self.assertEqual(f.read(), 'bar = 2')
+        self.assertTrue(os.path.islink(bar))
+        self.assertEqual(os.stat(bar).st_mode & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         ['bar.conf', 'foo.conf', 'real'])
+        self.assertEqual(os.listdir(os.path.join(tmpdir, 'real')),
+                         ['bar.conf'])
+
     def test_write_all(self):
         '''It writes out all configuration files at once'''
         self.context.set(interfaces=['fooservice'], context={'foo': 'bar'})
@@ -195,6 +237,146 @@ class TemplatingTests(unittest.TestCase):
             self.assertEquals(sorted(ex_calls), sorted(_write.call_args_list))
             pass
 
+    @patch(builtin_open)
+    def test_write_all_evaluates_contexts_once(self, _open):
+        '''It evaluates each shared context generator once per pass'''
+        shared = MagicMock(return_value={'foo': 'bar'}, interfaces=['foo'])
+        other = MagicMock(return_value={'baz': 'qux'}, interfaces=['baz'])
+        self.renderer.register('/tmp/foo', [shared])
+        self.renderer.register('/tmp/bar', [shared, other])
+        with patch.object(self.renderer, '_get_template') as _get_t:
+            fake_tmpl = MockTemplate()
+            fake_tmpl.render.return_value = ''
+            _get_t.return_value = fake_tmpl
+            self.renderer.write_all()
+            fake_tmpl.render.assert_any_call({'foo': 'bar', 'baz': 'qux'})
+        self.assertEqual(shared.call_count, 1)
+        self.assertEqual(other.call_count, 1)
+        self.assertEqual(sorted(self.renderer.context_timings,
+                                key=lambda c: c.interfaces),
+                         [other, shared])
+
+        # Outside of a pass, generators are called for every render.
+        self.renderer.render('/tmp/foo')
+        self.renderer.render('/tmp/foo')
+        self.assertEqual(shared.call_count, 3)
+
+    @patch(builtin_open)
+    def test_write_all_concurrent_contexts(self, _open):
+        '''It evaluates context generators concurrently when asked to'''
+        both_running = threading.Event()
+        running = []
+        threads = {}
+
+        def generator(name, concurrent=True):
+            def evaluate():
+                threads[name] = threading.current_thread()
+                if concurrent:
+                    running.append(name)
+                    if len(running) == 2:
+                        both_running.set()
+                    both_running.wait(5)
+                return {'key': name, name: True}
+            return MagicMock(side_effect=evaluate, interfaces=[name],
+                             concurrent=concurrent)
+
+        amqp, db = generator('amqp'), generator('db')
+        haproxy = generator('haproxy', concurrent=False)
+        renderer = templating.OSConfigRenderer(
+            templates_dir=os.path.dirname(__file__),
+            openstack_release='folsom', context_workers=4)
+        renderer.register('/tmp/foo', [amqp, db, haproxy])
+        renderer.register('/tmp/bar', [haproxy, db])
+        with patch.object(renderer, '_get_template') as _get_t:
+            fake_tmpl = MockTemplate()
+            fake_tmpl.render.return_value = ''
+            _get_t.return_value = fake_tmpl
+            renderer.write_all()
+            # Later generators win, as when evaluated one at a time.
+            fake_tmpl.render.assert_has_calls([
+                call({'key': 'haproxy', 'amqp': True, 'db': True,
+                      'haproxy': True}),
+                call({'key': 'db', 'db': True, 'haproxy': True}),
+            ])
+        self.assertTrue(both_running.is_set())
+        self.assertIs(threads['haproxy'], threading.current_thread())
+        self.assertEqual(list(renderer.context_timings),
+                         [amqp, db, haproxy])
+        for generator in (amqp, db, haproxy):
+            self.assertEqual(generator.call_count, 1)
+
+    def test_complete_contexts_concurrent_memoized(self):
+        '''It does not re-evaluate templates with complete contexts'''
+        amqp = MagicMock(return_value={'amqp': True}, interfaces=['amqp'],
+                         concurrent=True)
+        db = MagicMock(return_value={'db': True}, interfaces=['db'],
+                       concurrent=True)
+        renderer = templating.OSConfigRenderer(
+            templates_dir=os.path.dirname(__file__),
+            openstack_release='folsom', context_workers=4)
+        renderer.register('/tmp/foo', [amqp, db])
+        renderer.register('/tmp/bar', [db])
+        for _ in range(3):
+            self.assertEqual(sorted(renderer.complete_contexts()),
+                             ['amqp', 'db', 'db'])
+        self.assertEqual(amqp.call_count, 1)
+        self.assertEqual(db.call_count, 1)
+
+    def test_complete_contexts_does_not_log(self):
+        '''It does not spend a juju-log call on each render pass'''
+        self.context.set(interfaces=['fooservice'], context={'foo': 'bar'})
+        self.renderer.register('/tmp/foo', [self.context])
+        templating.log.reset_mock()
+        self.renderer.complete_contexts()
+        self.assertFalse(templating.log.called)
+
+    def test_generators_not_concurrent_by_default(self):
+        '''It runs generators in the calling thread unless they opt in'''
+        threads = []
+
+        class Generator(FakeContextGenerator):
+            def __call__(self):
+                threads.append(threading.current_thread())
+                return {'foo': 'bar'}
+
+        self.assertFalse(os_context.OSContextGenerator.concurrent)
+        context_pass = templating.ContextPass()
+        context_pass.evaluate_all([Generator(), Generator()], workers=4)
+        self.assertEqual(threads, [threading.current_thread()] * 2)
+
+    def test_stock_generators_concurrent(self):
+        '''It evaluates read-only stock generators in worker threads'''
+        threads = []
+        rdata = {'host': 'db', 'user': 'nova', 'password': 'secret',
+                 'glance-api-server': 'http://glance:9292'}
+
+        def relation_ids(reltype):
+            threads.append(threading.current_thread())
+            return ['{}:1'.format(reltype)]
+
+        with patch.multiple(os_context,
+                            relation_ids=MagicMock(side_effect=relation_ids),
+                            related_units=MagicMock(return_value=['svc/0']),
+                            relation_get=MagicMock(
+                                side_effect=lambda key, **kw: rdata[key]),
+                            log=MagicMock()):
+            db = os_context.PostgresqlDBContext(database='nova')
+            image = os_context.ImageServiceContext()
+            context_pass = templating.ContextPass()
+            context_pass.evaluate_all([db, image], workers=2)
+            self.assertEqual(context_pass(db)['database_host'], 'db')
+            self.assertEqual(context_pass(image),
+                             {'glance_api_servers': 'http://glance:9292'})
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        # Generators writing files stay in the calling thread.
+        self.assertTrue(os_context.AMQPContext().concurrent)
+        self.assertFalse(os_context.AMQPContext(ssl_dir='/etc/nova')
+                         .concurrent)
+        self.assertFalse(os_context.SharedDBContext(ssl_dir='/etc/nova')
+                         .concurrent)
+        self.assertFalse(os_context.CephContext.concurrent)
+
     @patch.object(templating, 'get_loader')
     def test_reset_template_loader_for_new_os_release(self, loader):
         self.loader.set('')
@@ -267,6 +449,90 @@ class TemplatingTests(unittest.TestCase):
                     [common_tmplts]]
         self.assertEquals(dirs, expected)
 
+    def _template_tree(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        for name, content in (('nova.conf', 'base {{ foo }}'),
+                              ('etc_nova_api-paste.ini', 'base paste'),
+                              ('grizzly/nova.conf', 'grizzly {{ foo }}'),
+                              ('havana/nova.conf', 'havana {{ foo }}')):
+            path = os.path.join(tmpdir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(content)
+        return tmpdir
+
+    def test_template_index(self):
+        '''It indexes templates in the same order as the choice loader'''
+        tmpdir = self._template_tree()
+        index = templating.template_index(tmpdir, 'grizzly')
+        self.assertEqual(index['nova.conf'],
+                         os.path.join(tmpdir, 'grizzly', 'nova.conf'))
+        self.assertEqual(index['etc_nova_api-paste.ini'],
+                         os.path.join(tmpdir, 'etc_nova_api-paste.ini'))
+        self.assertEqual(index['havana/nova.conf'],
+                         os.path.join(tmpdir, 'havana', 'nova.conf'))
+        self.assertEqual(
+            templating.template_index(tmpdir, 'folsom')['nova.conf'],
+            os.path.join(tmpdir, 'nova.conf'))
+
+    def test_template_index_follows_symlinks(self):
+        '''It indexes templates under symlinked subdirectories'''
+        tmpdir = self._template_tree()
+        shared = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared)
+        with open(os.path.join(shared, 'section-keystone'), 'w') as f:
+            f.write('keystone')
+        os.symlink(shared, os.path.join(tmpdir, 'grizzly', 'parts'))
+        index = templating.template_index(tmpdir, 'grizzly')
+        self.assertEqual(
+            index['parts/section-keystone'],
+            os.path.join(tmpdir, 'grizzly', 'parts', 'section-keystone'))
+
+    def test_template_index_cached_per_revision(self):
+        '''It builds the template index once per charm revision'''
+        tmpdir = self._template_tree()
+        with patch.object(templating, '_charm_revision') as revision, \
+                patch.object(templating, '_template_dirs',
+                             wraps=templating._template_dirs) as dirs:
+            revision.return_value = '42'
+            templating.template_index(tmpdir, 'grizzly')
+            templating.template_index(tmpdir, 'grizzly')
+            self.assertEqual(dirs.call_count, 1)
+            revision.return_value = '43'
+            templating.template_index(tmpdir, 'grizzly')
+            self.assertEqual(dirs.call_count, 2)
+
+    def test_template_index_loader(self):
+        '''It loads indexed templates without probing the search path'''
+        tmpdir = self._template_tree()
+        loader = templating.get_loader(tmpdir, 'havana', indexed=True)
+        self.assertIsInstance(loader, templating.TemplateIndexLoader)
+        contents, path, uptodate = loader.get_source(None, 'nova.conf')
+        self.assertEqual(contents, 'havana {{ foo }}')
+        self.assertEqual(path, os.path.join(tmpdir, 'havana', 'nova.conf'))
+        self.assertTrue(uptodate())
+        with patch(builtin_open) as _open:
+            self.assertRaises(TemplateNotFound, loader.get_source, None,
+                              'missing.conf')
+            self.assertFalse(_open.called)
+
+    @patch.object(templating, 'Environment', jinja2.Environment)
+    def test_render_indexed_templates(self):
+        '''It renders templates resolved through the template index'''
+        tmpdir = self._template_tree()
+        renderer = templating.OSConfigRenderer(
+            templates_dir=tmpdir, openstack_release='grizzly',
+            indexed_templates=True)
+        self.context.set(interfaces=['fooservice'], context={'foo': 'bar'})
+        renderer.register('/etc/nova/nova.conf', [self.context])
+        renderer.register('/etc/nova/api-paste.ini', [self.context])
+        self.assertEqual(renderer.render('/etc/nova/nova.conf'),
+                         'grizzly bar')
+        self.assertEqual(renderer.render('/etc/nova/api-paste.ini'),
+                         'base paste')
+
     def test_register_template_with_list_of_contexts(self):
         '''Ensure registering a template with a list of context generators'''
         def _c1():
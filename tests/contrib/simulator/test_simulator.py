@@ -0,0 +1,99 @@
+import os
+
+from testtools import TestCase
+
+from charmhelpers.core import hookenv
+from charmhelpers.contrib.simulator import HookToolSimulator, Model, scale
+
+
+class ModelTest(TestCase):
+
+    def test_generate(self):
+        model = Model.generate(peers=3, relations=7, remote_units=50)
+        self.assertEqual(len(model.relation_ids('cluster')), 1)
+        self.assertEqual(len(model.relations), 8)
+        self.assertEqual(model.remote_units, 52)
+        md = model.metadata()
+        self.assertEqual(md['peers'], {'cluster': {'interface': 'cluster'}})
+        self.assertEqual(md['requires']['shared-db'],
+                         {'interface': 'mysql-shared'})
+
+
+class HookToolSimulatorTest(TestCase):
+
+    def setUp(self):
+        super(HookToolSimulatorTest, self).setUp()
+        self.model = Model.generate(peers=3, relations=2, remote_units=4,
+                                    settings=1, config={'debug': True},
+                                    leader_settings={'token': 'abc'})
+        self.sim = HookToolSimulator(self.model, hook_name='install')
+        self.sim.__enter__()
+        self.addCleanup(self.sim.__exit__, None, None, None)
+
+    def test_relation_reads(self):
+        self.assertEqual(hookenv.local_unit(), 'local/0')
+        self.assertEqual(hookenv.relation_ids('shared-db'), ['shared-db:1'])
+        self.assertEqual(hookenv.related_units('shared-db:1'),
+                         ['remote-0/0', 'remote-0/1'])
+        self.assertEqual(
+            hookenv.relation_get('db_host', rid='shared-db:1',
+                                 unit='remote-0/1'),
+            self.model.relations['shared-db:1']['units']['remote-0/1'][
+                'db_host'])
+        self.assertIsNone(hookenv.relation_get(rid='shared-db:1',
+                                               unit='nobody/0'))
+        self.assertEqual(sorted(hookenv.relation_types()),
+                         ['amqp', 'cluster', 'ha', 'identity-service',
+                          'shared-db', 'website'])
+        self.assertEqual(self.sim.calls, {'relation-ids': 1,
+                                          'relation-list': 1,
+                                          'relation-get': 2})
+        self.assertEqual(self.sim.forks, 4)
+
+    def test_writes_and_other_tools(self):
+        hookenv.relation_set(relation_id='amqp:2', username='nova')
+        self.assertEqual(self.model.relations['amqp:2']['local']['username'],
+                         'nova')
+        hookenv.leader_set(token=None, other='x')
+        self.assertEqual(hookenv.leader_get(), {'other': 'x'})
+        self.assertTrue(hookenv.is_leader())
+        self.assertEqual(hookenv.config('debug'), True)
+        self.assertEqual(hookenv.network_get_primary_address('website'),
+                         self.model.address)
+        self.assertEqual(
+            hookenv.ingress_address(rid='amqp:2', unit='remote-1/0'),
+            self.model.relations['amqp:2']['units']['remote-1/0'][
+                'ingress-address'])
+        hookenv.log('hello', hookenv.WARNING)
+        self.assertEqual(self.sim.log, [(hookenv.WARNING, 'hello')])
+
+    def test_environment_restored(self):
+        charm_dir = self.sim.charm_dir
+        self.assertTrue(os.path.exists(os.path.join(charm_dir,
+                                                    'metadata.yaml')))
+        self.sim.__exit__(None, None, None)
+        self.assertFalse(os.path.exists(charm_dir))
+        self.assertNotEqual(os.environ.get('CHARM_DIR'), charm_dir)
+        self.sim.__enter__()
+
+
+class ScaleTest(TestCase):
+
+    def test_run(self):
+        rows = scale.run(sizes=[(2, 5, 10)], repeat=1)
+        self.assertEqual([row['scenario'] for row in rows],
+                         list(scale.SCENARIOS))
+        for row in rows:
+            self.assertNotIn('error', row)
+            self.assertGreater(row['forks'], 10)
+        hookenv_row = rows[0]
+        # 6 relation types, 6 relations, 11 remote units
+        self.assertEqual(hookenv_row['calls'], {'relation-ids': 6,
+                                                'relation-list': 6,
+                                                'relation-get': 11})
+
+    def test_run_reports_errors(self):
+        scale.SCENARIOS['broken'] = lambda model: 1 / 0
+        self.addCleanup(scale.SCENARIOS.pop, 'broken')
+        rows = scale.run(sizes=[(1, 1, 1)], scenarios=['broken'], repeat=1)
+        self.assertTrue(rows[0]['error'].startswith('ZeroDivisionError'))
@@ -1,8 +1,11 @@
+import errno
 import os
 import json
 from subprocess import CalledProcessError
 import shutil
 import tempfile
+import threading
+import time
 import types
 from mock import call, MagicMock, mock_open, patch, sentinel
 from testtools import TestCase
@@ -36,6 +39,13 @@ peers:
 
 def _clean_globals():
     hookenv.cache.clear()
+    hookenv.relation_prefetch(False)
+    hookenv.log_buffering(False)
+    hookenv._deferred_relation_settings.clear()
+    hookenv._deferred_leader_settings.clear()
+    hookenv.defer_writes(False)
+    hookenv.persistent_cache(False)
+    hookenv.network_prefetch(False)
     del hookenv._atstart[:]
     del hookenv._atexit[:]
 
@@ -339,6 +349,62 @@ class HelpersTest(TestCase):
             hookenv.log('foo', level)
             mock_call.assert_called_with(['juju-log', '-l', level, 'foo'])
 
+    @patch('subprocess.call')
+    def test_buffered_log_batches_messages_in_order(self, mock_call):
+        hookenv.log_buffering(flush_interval=60)
+        hookenv.log('one')
+        hookenv.log('two')
+        hookenv.log('three', hookenv.WARNING)
+        hookenv.log('four')
+        self.assertFalse(mock_call.called)
+
+        hookenv.log_flush()
+
+        self.assertEqual(mock_call.call_args_list, [
+            call(['juju-log', 'one\ntwo']),
+            call(['juju-log', '-l', hookenv.WARNING, 'three']),
+            call(['juju-log', 'four']),
+        ])
+
+    @patch('subprocess.call')
+    def test_buffered_log_errors_are_synchronous(self, mock_call):
+        hookenv.log_buffering(flush_interval=60)
+        hookenv.log('queued', hookenv.DEBUG)
+        hookenv.log('broken', hookenv.ERROR)
+
+        self.assertEqual(mock_call.call_args_list, [
+            call(['juju-log', '-l', hookenv.DEBUG, 'queued']),
+            call(['juju-log', '-l', hookenv.ERROR, 'broken']),
+        ])
+
+    @patch('subprocess.call')
+    def test_buffered_log_flushed_by_batch_size(self, mock_call):
+        hookenv.log_buffering(flush_interval=60, batch_size=2)
+        hookenv.log('one')
+        hookenv.log('two')
+        for _ in range(100):
+            if mock_call.called:
+                break
+            time.sleep(0.01)
+        mock_call.assert_called_once_with(['juju-log', 'one\ntwo'])
+
+    @patch('subprocess.call')
+    def test_buffered_log_falls_back_to_sync_on_failure(self, mock_call):
+        hookenv.log_buffering(flush_interval=60)
+        hookenv.log('one')
+        hookenv.log('two', hookenv.INFO)
+        mock_call.side_effect = [OSError(errno.EPERM, 'denied'), 0, 0, 0]
+        self.assertRaises(OSError, hookenv.log_flush)
+
+        hookenv.log('three')
+
+        self.assertEqual(mock_call.call_args_list, [
+            call(['juju-log', 'one']),
+            call(['juju-log', 'one']),
+            call(['juju-log', '-l', hookenv.INFO, 'two']),
+            call(['juju-log', 'three']),
+        ])
+
     @patch('charmhelpers.core.hookenv._cache_config', None)
     @patch('charmhelpers.core.hookenv.charm_dir')
     @patch('subprocess.check_output')
@@ -1208,6 +1274,101 @@ class HelpersTest(TestCase):
         # relation_set should flush any entries for local_unit
         self.assertTrue(len(hookenv.cache) == 1)
 
+    @patch('charmhelpers.core.hookenv.relation_types')
+    @patch('charmhelpers.core.hookenv.local_unit')
+    @patch('subprocess.check_output')
+    def test_relation_prefetch_serves_reads_from_snapshot(self, check_output,
+                                                          local_unit,
+                                                          relation_types):
+        local_unit.return_value = 'local/0'
+        relation_types.return_value = ['db']
+
+        def _tool(args, **kwargs):
+            if args[0] == 'relation-ids':
+                return json.dumps(['db:1']).encode('UTF-8')
+            if args[0] == 'relation-list':
+                return json.dumps(['mysql/0', 'mysql/1']).encode('UTF-8')
+            return json.dumps({'host': args[-1],
+                               'port': '3306'}).encode('UTF-8')
+        check_output.side_effect = _tool
+        hookenv.relation_prefetch()
+
+        self.assertEqual(hookenv.relation_ids('db'), ['db:1'])
+        self.assertEqual(hookenv.related_units('db:1'),
+                         ['mysql/0', 'mysql/1'])
+        for unit in ('mysql/0', 'mysql/1'):
+            self.assertEqual(hookenv.relation_get('host', unit, 'db:1'), unit)
+            self.assertEqual(hookenv.relation_get('port', unit, 'db:1'),
+                             '3306')
+        self.assertEqual(hookenv.relation_get('missing', 'mysql/0', 'db:1'),
+                         None)
+        self.assertEqual(hookenv.relation_get(unit='mysql/1', rid='db:1'),
+                         {'host': 'mysql/1', 'port': '3306'})
+        # relation-ids, relation-list and one relation-get per unit
+        # including the local unit.
+        self.assertEqual(check_output.call_count, 5)
+        check_output.assert_any_call(['relation-get', '--format=json',
+                                      '-r', 'db:1', '-', 'local/0'])
+
+    @patch('charmhelpers.core.hookenv.relation_types')
+    @patch('charmhelpers.core.hookenv.local_unit')
+    @patch('subprocess.check_output')
+    def test_relation_prefetch_unit_read_fails(self, check_output,
+                                               local_unit, relation_types):
+        local_unit.return_value = 'local/0'
+        relation_types.return_value = ['db']
+
+        def _tool(args, **kwargs):
+            if args[0] == 'relation-ids':
+                return json.dumps(['db:1']).encode('UTF-8')
+            if args[0] == 'relation-list':
+                return json.dumps(['mysql/0', 'mysql/1']).encode('UTF-8')
+            if args[-1] == 'mysql/0':
+                raise CalledProcessError(1, 'relation-get')
+            return json.dumps({'host': args[-1]}).encode('UTF-8')
+        check_output.side_effect = _tool
+        hookenv.relation_prefetch()
+
+        self.assertEqual(hookenv.relation_get('host', 'mysql/1', 'db:1'),
+                         'mysql/1')
+        self.assertRaises(CalledProcessError, hookenv.relation_get,
+                          'host', 'mysql/0', 'db:1')
+        # The failed unit is read again live, the others are not.
+        self.assertEqual(
+            [c[0][0][-1] for c in check_output.call_args_list
+             if c[0][0][0] == 'relation-get'],
+            ['mysql/0', 'mysql/1', 'local/0', 'mysql/0'])
+
+    @patch('charmhelpers.core.hookenv.relation_types')
+    @patch('charmhelpers.core.hookenv.local_unit')
+    @patch('subprocess.check_call')
+    @patch('subprocess.check_output')
+    def test_relation_prefetch_invalidated_by_relation_set(self, check_output,
+                                                           check_call,
+                                                           local_unit,
+                                                           relation_types):
+        local_unit.return_value = 'local/0'
+        relation_types.return_value = ['db']
+        settings = {'host': 'old'}
+
+        def _tool(args, **kwargs):
+            if args[0] == 'relation-ids':
+                return json.dumps(['db:1']).encode('UTF-8')
+            if args[0] == 'relation-list':
+                return json.dumps([]).encode('UTF-8')
+            if args[0] == 'relation-set':
+                return ''
+            return json.dumps(settings).encode('UTF-8')
+        check_output.side_effect = _tool
+        hookenv.relation_prefetch()
+
+        self.assertEqual(hookenv.relation_get('host', 'local/0', 'db:1'),
+                         'old')
+        settings['host'] = 'new'
+        hookenv.relation_set(relation_id='db:1', host='new')
+        self.assertEqual(hookenv.relation_get('host', 'local/0', 'db:1'),
+                         'new')
+
     @patch('subprocess.check_output')
     def test_gets_relation_with_relation_id(self, check_output):
         check_output.return_value = json.dumps('BAR').encode('UTF-8')
@@ -1309,6 +1470,77 @@ class HelpersTest(TestCase):
             self.assertEqual("{foo: '{''bar'': 1}'}", f.read().strip())
         remove.assert_called_with(temp_file)
 
+    @patch('charmhelpers.core.hookenv.local_unit')
+    @patch('subprocess.check_output')
+    @patch('subprocess.check_call')
+    def test_deferred_relation_set_coalesced(self, check_call, check_output,
+                                             local_unit):
+        local_unit.return_value = 'foo/0'
+        current = {'a': '1', 'b': '2', 'private-address': '10.0.0.1'}
+
+        def _check_output(args, **kwargs):
+            if args[:2] == ['relation-set', '--help']:
+                return ''
+            self.assertEqual(args[:3], ['relation-get', '--format=json',
+                                        '-r'])
+            rid = args[3]
+            return json.dumps(current if rid == 'db:1' else {}).encode()
+        check_output.side_effect = _check_output
+
+        hookenv.defer_writes()
+        hookenv.relation_set(relation_id='db:1', a=1)
+        hookenv.relation_set(relation_id='db:1', b=3, c=None)
+        hookenv.relation_set(relation_id='db:2', relation_settings={'x': 'y'})
+        hookenv.relation_set(relation_id='db:1', c=4)
+        self.assertFalse(check_call.called)
+
+        # pending writes are visible to the local unit
+        self.assertEqual(
+            hookenv.relation_get(unit='foo/0', rid='db:1'),
+            {'a': '1', 'b': '3', 'c': '4', 'private-address': '10.0.0.1'})
+        self.assertEqual(
+            hookenv.relation_get('b', unit='foo/0', rid='db:1'), '3')
+
+        hookenv._run_atexit()
+
+        self.assertEqual(check_call.call_args_list, [
+            call(['relation-set', '-r', 'db:1', 'b=3', 'c=4']),
+            call(['relation-set', '-r', 'db:2', 'x=y']),
+        ])
+
+    @patch('subprocess.check_output')
+    @patch('subprocess.check_call')
+    def test_deferred_relation_set_no_op(self, check_call, check_output):
+        check_output.return_value = json.dumps({'a': '1'}).encode()
+        with patch.dict('os.environ', {'JUJU_UNIT_NAME': 'foo/0',
+                                       'JUJU_RELATION_ID': 'db:1'}):
+            hookenv.defer_writes()
+            hookenv.relation_set(a=1, b=None)
+            hookenv.flush_deferred_writes()
+        self.assertFalse(check_call.called)
+
+    @patch('subprocess.check_output')
+    @patch('subprocess.check_call')
+    def test_deferred_leader_set(self, check_call, check_output):
+        check_output.return_value = json.dumps({'a': '1'}).encode()
+        hookenv.defer_writes()
+        hookenv.leader_set({'a': 1})
+        hookenv.leader_set(b='x')
+        hookenv.leader_set(c=None)
+        self.assertEqual(hookenv.leader_get(), {'a': '1', 'b': 'x'})
+        self.assertFalse(check_call.called)
+
+        hookenv.defer_writes(False)
+
+        check_call.assert_called_once_with(['leader-set', 'b=x'])
+
+    @patch('subprocess.check_output')
+    def test_deferred_leader_set_unsupported(self, check_output):
+        check_output.side_effect = OSError
+        hookenv.defer_writes()
+        hookenv.leader_set(a=1)
+        self.assertRaises(NotImplementedError, hookenv.flush_deferred_writes)
+
     def test_lists_relation_types(self):
         open_ = mock_open()
         open_.return_value = io.BytesIO(CHARM_METADATA)
@@ -1328,6 +1560,39 @@ class HelpersTest(TestCase):
                 metadata = hookenv.metadata()
         self.assertEqual(metadata, yaml.safe_load(CHARM_METADATA))
 
+    def test_metadata_index_saved_and_reused(self):
+        charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, charm_dir)
+        md_path = os.path.join(charm_dir, 'metadata.yaml')
+        with open(md_path, 'wb') as f:
+            f.write(CHARM_METADATA)
+
+        with patch.dict('os.environ', {'CHARM_DIR': charm_dir}):
+            self.assertEqual(hookenv.relation_to_role_and_interface(
+                'testprov'), ('provides', 'mock'))
+            self.assertTrue(os.path.exists(
+                os.path.join(charm_dir, hookenv.METADATA_INDEX)))
+
+            # A later hook loads the saved index without parsing YAML
+            hookenv.cache.clear()
+            with patch.object(hookenv.yaml, 'safe_load') as safe_load:
+                self.assertEqual(hookenv.charm_name(), 'testmock')
+                self.assertEqual(hookenv.interface_to_relations('mock'),
+                                 ['testprov', 'testreqs', 'testpeer'])
+                self.assertEqual(
+                    hookenv.role_and_interface_to_relations('peers', 'mock'),
+                    ['testpeer'])
+                self.assertFalse(safe_load.called)
+
+            # Changing metadata.yaml invalidates the saved index
+            hookenv.cache.clear()
+            with open(md_path, 'wb') as f:
+                f.write(CHARM_METADATA.replace(b'testprov', b'website'))
+            self.assertEqual(hookenv.relation_to_interface('website'),
+                             'mock')
+            self.assertEqual(hookenv.relation_to_role_and_interface(
+                'testprov'), (None, None))
+
     @patch('charmhelpers.core.hookenv.relation_ids')
     @patch('charmhelpers.core.hookenv.metadata')
     def test_peer_relation_id(self, metadata, relation_ids):
@@ -1443,6 +1708,170 @@ class HelpersTest(TestCase):
         self.assertEquals(cache_function(unserializable), 'qux')
         self.assertEquals(calls, ['hello', 'foo', 'baz', unserializable])
 
+    def test_cached_decorator_counts_and_flushes(self):
+        calls = []
+
+        @hookenv.cached
+        def cache_function(unit, rid=None):
+            calls.append((unit, rid))
+            return unit
+
+        cache_function('foo/0', rid='db:1')
+        cache_function('foo/0', rid='db:1')
+        cache_function('foo/1', rid='db:2')
+        self.assertEqual(hookenv.cache.stats(),
+                         {'hits': 1, 'misses': 2, 'size': 2,
+                          'maxsize': None})
+        hookenv.cache.flush_relation('db:1')
+        self.assertEqual(len(hookenv.cache), 1)
+        cache_function('foo/0', rid='db:1')
+        self.assertEqual(len(calls), 3)
+        hookenv.cache.flush_function(cache_function)
+        self.assertEqual(len(hookenv.cache), 0)
+
+    def test_cache_evicts_least_recently_used(self):
+        def func(attribute):
+            pass
+
+        cache = hookenv.Cache(maxsize=2)
+        a, b, c = [cache.make_key(func, (k,), {}) for k in 'abc']
+        cache.set(a, 1)
+        cache.set(b, 2)
+        self.assertEqual(cache.get(a), 1)
+        cache.set(c, 3)
+        self.assertEqual(list(cache), [a, c])
+        self.assertEqual(cache.get(b, 'missing'), 'missing')
+        cache.flush('b')
+        self.assertEqual(len(cache), 2)
+        cache.flush('func')
+        self.assertEqual(len(cache), 0)
+
+    def _persistent_kv(self):
+        from charmhelpers.core import unitdata
+        kv = unitdata.Storage(':memory:')
+        patcher = patch.object(unitdata, '_KV', kv)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        hookenv.persistent_cache()
+        return kv
+
+    @patch.object(hookenv, 'hook_name')
+    def test_cached_persists_across_hooks(self, hook_name):
+        kv = self._persistent_kv()
+        hook_name.return_value = 'update-status'
+        calls = []
+
+        @hookenv.cached(persist=True)
+        def cache_function(attribute):
+            calls.append(attribute)
+            return {'attribute': attribute}
+
+        with kv.hook_scope('update-status'):
+            self.assertEqual(cache_function('foo'), {'attribute': 'foo'})
+        # Saved with the charm's own changes, outside of the history.
+        self.assertEqual(hookenv._atexit, [])
+        self.assertEqual(kv.stats()['kv_revisions'], 0)
+
+        # A new hook, with an empty in-memory cache.
+        hookenv.cache.clear()
+        hookenv.persistent_cache()
+        self.assertEqual(cache_function('foo'), {'attribute': 'foo'})
+        self.assertEqual(calls, ['foo'])
+        self.assertEqual(
+            list(kv.getrange(hookenv.PERSISTENT_CACHE_PREFIX)),
+            ['charmhelpers.hookenv.cache.cache_function:[["foo"], {}]'])
+
+        # Disabled, the function is only cached for the hook.
+        hookenv.cache.clear()
+        hookenv.persistent_cache(False)
+        cache_function('foo')
+        self.assertEqual(calls, ['foo', 'foo'])
+
+    @patch.object(hookenv, 'hook_name')
+    def test_cached_persistent_invalidation(self, hook_name):
+        self._persistent_kv()
+        hook_name.return_value = 'update-status'
+        calls = []
+
+        @hookenv.cached(persist=True)
+        def cache_function():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(cache_function(), 1)
+        for hook, expected in [('update-status', 1),
+                               ('db-relation-departed', 2),
+                               ('db-relation-changed', 2),
+                               ('config-changed', 3)]:
+            hook_name.return_value = hook
+            hookenv.cache.clear()
+            hookenv.persistent_cache()
+            self.assertEqual(cache_function(), expected)
+
+        hookenv.cache.clear()
+        hookenv.flush_persistent_cache(cache_function)
+        self.assertEqual(cache_function(), 4)
+
+    @patch.object(hookenv, 'hook_name')
+    @patch.object(hookenv.time, 'time')
+    def test_cached_persistent_ttl(self, time_, hook_name):
+        self._persistent_kv()
+        hook_name.return_value = 'update-status'
+        time_.return_value = 1000.0
+        calls = []
+
+        @hookenv.cached(persist=True, ttl=60)
+        def cache_function():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(cache_function(), 1)
+        hookenv.cache.clear()
+        time_.return_value = 1059.0
+        self.assertEqual(cache_function(), 1)
+        hookenv.cache.clear()
+        time_.return_value = 1060.0
+        self.assertEqual(cache_function(), 2)
+
+    @patch.object(hookenv, 'hook_name')
+    def test_cached_persistent_skips_unserializable(self, hook_name):
+        kv = self._persistent_kv()
+        hook_name.return_value = 'install'
+
+        @hookenv.cached(persist=True)
+        def cache_function(arg):
+            return object()
+
+        cache_function(object())
+        cache_function('foo')
+        self.assertEqual(kv.getrange(hookenv.PERSISTENT_CACHE_PREFIX), {})
+
+    @patch.object(hookenv, 'hook_name')
+    def test_cached_persistent_not_from_threads(self, hook_name):
+        kv = self._persistent_kv()
+        hook_name.return_value = 'install'
+
+        @hookenv.cached(persist=True)
+        def cache_function():
+            return 'value'
+
+        thread = threading.Thread(target=cache_function)
+        thread.start()
+        thread.join()
+        self.assertEqual(kv.getrange(hookenv.PERSISTENT_CACHE_PREFIX), {})
+
+    @patch('subprocess.check_output')
+    @patch.object(hookenv, 'hook_name')
+    def test_network_get_primary_not_cached(self, hook_name, check_output):
+        kv = self._persistent_kv()
+        hook_name.return_value = 'update-status'
+        check_output.return_value = b'192.168.22.1'
+        hookenv.network_get_primary_address('mybinding')
+        self.assertEqual(hookenv.network_get_primary_address('mybinding'),
+                         '192.168.22.1')
+        self.assertEqual(check_output.call_count, 2)
+        self.assertEqual(kv.getrange(hookenv.PERSISTENT_CACHE_PREFIX), {})
+
     def test_gets_charm_dir(self):
         with patch.dict('os.environ', {}):
             self.assertEqual(hookenv.charm_dir(), None)
@@ -2025,6 +2454,95 @@ ingress-addresses:
         self.assertEqual(len(ip['bind-addresses']), 1)
         self.assertEqual(ip['ingress-addresses'], ['10.136.107.33'])
 
+    @patch('charmhelpers.core.hookenv.juju_version')
+    @patch('subprocess.check_output')
+    def test_network_get_fetched_once(self, check_output, juju_version):
+        juju_version.return_value = '2.3.0'
+        check_output.return_value = b"""
+bind-addresses:
+- addresses:
+  - address: 10.5.0.2
+    cidr: 10.5.0.0/16
+        """
+        hookenv.network_get('mybinding')
+        hookenv.network_get('mybinding')
+        self.assertEqual(hookenv.network_get_primary_address('mybinding'),
+                         '10.5.0.2')
+        check_output.assert_called_once_with(
+            ['network-get', 'mybinding', '--format', 'yaml'], stderr=-2)
+
+        # Refetched on request, and in the next hook.
+        hookenv.network_get('mybinding', refresh=True)
+        self.assertEqual(check_output.call_count, 2)
+        hookenv._run_atexit()
+        hookenv.network_get('mybinding')
+        self.assertEqual(check_output.call_count, 3)
+
+    @patch('charmhelpers.core.hookenv.metadata')
+    @patch('charmhelpers.core.hookenv.juju_version')
+    @patch('subprocess.check_output')
+    def test_network_prefetch(self, check_output, juju_version, metadata):
+        juju_version.return_value = '2.3.0'
+        metadata.return_value = {
+            'requires': {'db': {'interface': 'mysql'}},
+            'extra-bindings': {'public': None, 'missing': None},
+        }
+        outputs = {
+            'db': b"""
+bind-addresses:
+- addresses:
+  - address: 10.5.0.2
+    cidr: 10.5.0.0/16
+  - address: 10.6.0.2
+    cidr: 10.6.0.0/16
+ingress-addresses:
+- 10.5.0.2
+egress-subnets:
+- 10.5.0.0/16
+""",
+            'public': b"""
+bind-addresses:
+- addresses:
+  - address: 192.168.1.2
+    cidr: 192.168.1.0/24
+""",
+        }
+
+        def network_get(cmd, stderr=None):
+            if cmd[1] in outputs:
+                return outputs[cmd[1]]
+            raise CalledProcessError(
+                1, cmd, b'no network config found for binding')
+        check_output.side_effect = network_get
+
+        hookenv.network_prefetch()
+        self.assertEqual(hookenv.network_get_primary_address('db'),
+                         '10.5.0.2')
+        self.assertEqual(hookenv.network_get_primary_address('public'),
+                         '192.168.1.2')
+        self.assertEqual(hookenv.network_get('db')['ingress-addresses'],
+                         ['10.5.0.2'])
+        self.assertEqual(check_output.call_count, 3)
+
+        bindings = hookenv.network_bindings()
+        self.assertEqual(bindings.addresses('db'), ['10.5.0.2', '10.6.0.2'])
+        self.assertEqual(list(bindings.index().items()), [
+            ('db', {'addresses': ['10.5.0.2', '10.6.0.2'],
+                    'cidrs': ['10.5.0.0/16', '10.6.0.0/16'],
+                    'ingress-addresses': ['10.5.0.2'],
+                    'egress-subnets': ['10.5.0.0/16']}),
+            ('public', {'addresses': ['192.168.1.2'],
+                        'cidrs': ['192.168.1.0/24'],
+                        'ingress-addresses': [],
+                        'egress-subnets': []}),
+        ])
+
+        # Bindings that could not be prefetched are looked up on their own.
+        self.assertRaises(hookenv.NoNetworkBinding,
+                          hookenv.network_get_primary_address, 'missing')
+        check_output.assert_called_with(
+            ['network-get', '--primary-address', 'missing'], stderr=-2)
+
     @patch('subprocess.check_call')
     def test_add_metric(self, check_call_):
         hookenv.add_metric(flips='1.5', flops='2.1')
@@ -1,4 +1,7 @@
+import grp
+import hashlib
 import os.path
+import pwd
 from collections import OrderedDict
 import subprocess
 from tempfile import mkdtemp
@@ -15,7 +18,7 @@ from tests.helpers import patch_open
 from tests.helpers import mock_open as mocked_open
 import six
 
-from charmhelpers.core import host
+from charmhelpers.core import host, unitdata
 
 
 MOUNT_LINES = ("""
@@ -149,6 +152,49 @@ class HelpersTest(TestCase):
         self.assertFalse(result)
         mock_call.assert_called_with(['service', service_name, action])
 
+    @patch.object(host, 'init_is_systemd')
+    @patch('subprocess.check_output')
+    def test_services_running_systemd_single_call(self, check_output,
+                                                  systemd):
+        systemd.return_value = True
+        check_output.return_value = (
+            b'Id=foo.service\nActiveState=active\n\n'
+            b'Id=bar.service\nActiveState=inactive\n\n'
+            b'Id=baz.service\nActiveState=active\n')
+
+        result = host.services_running(['foo', 'bar', 'baz'])
+
+        self.assertEqual(list(result.items()),
+                         [('foo', True), ('bar', False), ('baz', True)])
+        check_output.assert_called_once_with(
+            ['systemctl', 'show', '--no-pager', '--property=Id,ActiveState',
+             'foo', 'bar', 'baz'], stderr=subprocess.STDOUT)
+
+    @patch.object(host, 'service_running')
+    @patch.object(host, 'init_is_systemd')
+    @patch('subprocess.check_output')
+    def test_services_running_falls_back_per_service(self, check_output,
+                                                     systemd,
+                                                     service_running):
+        systemd.return_value = True
+        check_output.side_effect = subprocess.CalledProcessError(1, 'show')
+        service_running.side_effect = [False, True]
+
+        result = host.services_running(['foo', 'bar'])
+
+        self.assertEqual(list(result.items()), [('foo', False), ('bar', True)])
+        service_running.assert_has_calls([call('foo'), call('bar')])
+
+    @patch.object(host, 'service_running')
+    @patch.object(host, 'init_is_systemd')
+    def test_services_running_upstart(self, systemd, service_running):
+        systemd.return_value = False
+        service_running.side_effect = [True, False]
+
+        result = host.services_running(['foo', 'bar'])
+
+        self.assertEqual(list(result.items()), [('foo', True), ('bar', False)])
+
     @patch.object(host, 'service')
     def test_starts_a_service(self, service):
         service_name = 'foo-service'
@@ -1178,6 +1224,76 @@ class HelpersTest(TestCase):
             self.assertEqual(mock_open.call_count, 1)  # Called to read
             self.assertEqual(os_.chown.call_count, 0)
 
+    @patch.object(host, 'log')
+    def test_write_file_reports_changes(self, log):
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'conf')
+        user = pwd.getpwuid(os.getuid()).pw_name
+        group = grp.getgrgid(os.getgid()).gr_name
+        kwargs = dict(owner=user, group=group, perms=0o640)
+        self.assertTrue(host.write_file(path, b'content', **kwargs))
+        os.utime(path, (0, 0))
+        self.assertFalse(host.write_file(path, 'content', **kwargs))
+        self.assertEqual(os.stat(path).st_mtime, 0)
+        kwargs['perms'] = 0o600
+        self.assertTrue(host.write_file(path, b'content', **kwargs))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertTrue(host.write_file(path, b'new', **kwargs))
+        self.assertNotEqual(os.stat(path).st_mtime, 0)
+
+    @patch.object(host, 'log')
+    def test_write_file_atomic(self, log):
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'conf')
+        user = pwd.getpwuid(os.getuid()).pw_name
+        group = grp.getgrgid(os.getgid()).gr_name
+        kwargs = dict(owner=user, group=group, perms=0o640, atomic=True)
+        self.assertTrue(host.write_file(path, b'old', **kwargs))
+        inode = os.stat(path).st_ino
+        self.assertFalse(host.write_file(path, b'old', **kwargs))
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertTrue(host.write_file(path, b'new', **kwargs))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+        self.assertEqual(os.listdir(tmpdir), ['conf'])
+
+    @patch.object(host, 'log')
+    def test_write_file_atomic_symlink(self, log):
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'real'))
+        real_path = os.path.join(tmpdir, 'real', 'conf')
+        path = os.path.join(tmpdir, 'conf')
+        with open(real_path, 'wb') as f:
+            f.write(b'old')
+        os.symlink(real_path, path)
+        self.assertTrue(host.write_file(path, b'new', owner=os.getuid(),
+                                        group=os.getgid(), perms=0o600,
+                                        atomic=True))
+        self.assertTrue(os.path.islink(path))
+        with open(real_path, 'rb') as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertEqual(os.stat(real_path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(os.path.join(tmpdir, 'real')), ['conf'])
+
+    @patch.object(host, 'log')
+    def test_write_file_atomic_keeps_xattrs(self, log):
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'conf')
+        with open(path, 'wb') as f:
+            f.write(b'old')
+        try:
+            os.setxattr(path, 'user.charm', b'value')
+        except (AttributeError, OSError):
+            self.skipTest('extended attributes not supported')
+        host.write_file(path, b'new', owner=os.getuid(), group=os.getgid(),
+                        perms=0o600, atomic=True)
+        self.assertEqual(os.getxattr(path, 'user.charm'), b'value')
+
     @patch.object(host, 'log')
     @patch.object(host, 'os')
     def test_writes_binary_contents(self, os_, log):
@@ -1360,6 +1476,79 @@ class HelpersTest(TestCase):
             result = host.file_hash(filename, hash_type='sha1')
             self.assertEqual(result, self._hash_files[filename])
 
+    def test_file_hash_chunked(self):
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'big')
+        content = b'x' * (host.HASH_CHUNK_SIZE * 2 + 10)
+        with open(path, 'wb') as f:
+            f.write(content)
+        self.assertEqual(host.file_hash(path),
+                         hashlib.md5(content).hexdigest())
+        with open(path, 'wb') as f:
+            f.write(content[:host.HASH_CHUNK_SIZE])
+        self.assertEqual(host.file_hash(path, 'sha256'),
+                         hashlib.sha256(
+                             content[:host.HASH_CHUNK_SIZE]).hexdigest())
+
+    @patch.dict('os.environ', {'CHARM_DIR': '', 'JUJU_CHARM_DIR': ''})
+    @patch.object(host, 'file_hash')
+    def test_cached_file_hash(self, file_hash):
+        self.addCleanup(host._hash_cache.clear)
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'conf')
+        with open(path, 'w') as f:
+            f.write('old')
+        os.utime(path, (0, 0))
+        file_hash.return_value = 'old-hash'
+        self.assertEqual(host.cached_file_hash(path), 'old-hash')
+        self.assertEqual(host.cached_file_hash(path), 'old-hash')
+        self.assertEqual(file_hash.call_count, 1)
+
+        # Recently modified files are not trusted to the cache.
+        with open(path, 'w') as f:
+            f.write('new')
+        file_hash.return_value = 'new-hash'
+        self.assertEqual(host.cached_file_hash(path), 'new-hash')
+        self.assertEqual(host.cached_file_hash(path), 'new-hash')
+        self.assertEqual(file_hash.call_count, 3)
+
+    @patch.object(host, 'file_hash')
+    def test_cached_file_hash_persisted(self, file_hash):
+        self.addCleanup(host._hash_cache.clear)
+        self.addCleanup(host.persist_file_hashes, False)
+        tmpdir = mkdtemp()
+        self.addCleanup(rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'conf')
+        key = 'host.file_hash:md5:' + path
+        with open(path, 'w') as f:
+            f.write('old')
+        os.utime(path, (0, 0))
+        file_hash.return_value = 'old-hash'
+        kv = unitdata.Storage(':memory:')
+        with patch.object(unitdata, '_KV', kv), \
+                patch.object(host, 'charm_dir', return_value=tmpdir):
+            # Not persisted unless enabled.
+            host.cached_file_hash(path)
+            self.assertIsNone(kv.get(key))
+            host._hash_cache.clear()
+
+            host.persist_file_hashes()
+            with kv.hook_scope('config-changed'):
+                host.cached_file_hash(path)
+                host._hash_cache.clear()
+                self.assertEqual(host.cached_file_hash(path), 'old-hash')
+            self.assertEqual(file_hash.call_count, 2)
+            self.assertEqual(kv.get(key)['hash'], 'old-hash')
+            self.assertEqual(kv.stats()['kv_revisions'], 0)
+
+            os.unlink(path)
+            file_hash.return_value = None
+            self.assertIsNone(host.cached_file_hash(path))
+            self.assertIsNone(kv.get(key))
+            self.assertNotIn(key, host._hash_cache)
+
     @patch.object(host, 'file_hash')
     def test_check_hash(self, file_hash):
         file_hash.return_value = 'good-hash'
@@ -1609,6 +1798,51 @@ class HelpersTest(TestCase):
         self.assertEquals([call('restart', 'haproxy')], service.call_args_list)
         self.assertEquals([call('some-api')], service_reload.call_args_list)
 
+    @patch.object(host, 'service')
+    def test_restart_services_sequential(self, service):
+        timings = host.restart_services(['a', 'b', 'c'], stopstart=True)
+        self.assertEqual(list(timings), ['a', 'b', 'c'])
+        self.assertEqual(service.call_args_list, [
+            call('stop', 'a'), call('start', 'a'),
+            call('stop', 'b'), call('start', 'b'),
+            call('stop', 'c'), call('start', 'c')])
+
+    @patch.object(host, 'service')
+    def test_restart_services_concurrent_with_dependencies(self, service):
+        timings = host.restart_services(
+            ['haproxy', 'api1', 'api2', 'apache2'], workers=4,
+            dependencies={'haproxy': ['api1', 'api2', 'memcached'],
+                          'apache2': ['haproxy']})
+        self.assertEqual(set(timings), set(['haproxy', 'api1', 'api2',
+                                            'apache2']))
+        restarted = [c[0][1] for c in service.call_args_list]
+        self.assertEqual(set(restarted[:2]), set(['api1', 'api2']))
+        self.assertEqual(restarted[2:], ['haproxy', 'apache2'])
+
+    @patch.object(host, 'service')
+    def test_restart_services_circular_dependencies(self, service):
+        self.assertRaises(ValueError, host.restart_services,
+                          ['a', 'b', 'c'], dependencies={'a': ['b'],
+                                                         'b': ['a']})
+        self.assertFalse(service.called)
+
+    @patch.object(host, 'log')
+    @patch.object(host, 'restart_services')
+    @patch.object(host, 'path_hash')
+    def test_restart_on_change_helper_concurrent(self, path_hash,
+                                                 restart_services, log):
+        path_hash.side_effect = [{}, {'/etc/a': 'x'}]
+        restart_services.return_value = OrderedDict([('a', 1.0)])
+        timings = {}
+        host.restart_on_change_helper(lambda: None, {'/etc/a': ['a']},
+                                      restart_workers=2,
+                                      restart_dependencies={'a': []},
+                                      restart_timings=timings)
+        restart_services.assert_called_once_with(['a'], False, None, 2,
+                                                 {'a': []})
+        self.assertEqual(timings, {'a': 1.0})
+        self.assertFalse(log.called)
+
     @patch.object(osplatform, 'get_platform')
     def test_lsb_release_ubuntu(self, platform):
         platform.return_value = 'ubuntu'
@@ -1,10 +1,14 @@
 import os
 import mock
+import shutil
+import tempfile
+import threading
 import unittest
 import uuid
 from charmhelpers.core import hookenv
 from charmhelpers.core import host
 from charmhelpers.core import services
+from charmhelpers.core import unitdata
 from functools import partial
 
 
@@ -118,6 +122,190 @@ class TestServiceManager(unittest.TestCase):
             mock.call('service2'),
         ], any_order=True)
 
+    def _incremental_setup(self, config, data):
+        charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, charm_dir)
+        self.mcharm_dir.return_value = charm_dir
+        os.mkdir(os.path.join(charm_dir, 'templates'))
+        self.template = os.path.join(charm_dir, 'templates', 'svc.conf')
+        with open(self.template, 'w') as fp:
+            fp.write('{{ host }}')
+        self.target = os.path.join(charm_dir, 'svc.conf')
+        self.config = config
+        self.data = data
+        for target, attribute, value in [
+                (unitdata, '_KV', unitdata.Storage(':memory:')),
+                (hookenv, 'hook_name', mock.Mock(return_value='config-changed')),
+                (hookenv, 'config', mock.Mock(return_value=config)),
+                (hookenv, 'log', mock.Mock())]:
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(hookenv._atexit.__delitem__, slice(None))
+
+    def _incremental_manager(self, config_keys=None):
+        def render(source, target, context, *args, **kwargs):
+            with open(target, 'w') as fp:
+                fp.write(context['host'])
+        patcher = mock.patch.object(services.helpers.templating, 'render',
+                                    side_effect=render)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.started = []
+        service = {'service': 'svc', 'required_data': [self.data],
+                   'data_ready': [services.template(source='svc.conf',
+                                                    target=self.target)],
+                   'start': self.started.append}
+        if config_keys is not None:
+            service['config_keys'] = config_keys
+        return services.ServiceManager([service], incremental=True)
+
+    def test_reconfigure_incremental(self):
+        self._incremental_setup({'debug': False}, {'host': 'a'})
+        manager = self._incremental_manager()
+        manager.reconfigure_services()
+        self.assertEqual(len(self.started), 1)
+        self.assertEqual(manager.skipped, [])
+
+        # Nothing changed.
+        manager = self._incremental_manager()
+        manager.reconfigure_services()
+        self.assertEqual(len(self.started), 0)
+        self.assertEqual(manager.skipped, ['svc'])
+
+        # Each input changing reconfigures the service.
+        def append(path, text):
+            with open(path, 'a') as fp:
+                fp.write(text)
+        for change in [lambda: self.data.update(host='b'),
+                       lambda: self.config.update(debug=True),
+                       lambda: append(self.template, '!'),
+                       lambda: append(self.target, 'edited')]:
+            change()
+            manager = self._incremental_manager()
+            manager.reconfigure_services()
+            self.assertEqual(len(self.started), 1)
+            self.assertEqual(manager.skipped, [])
+
+    def test_reconfigure_incremental_no_history(self):
+        self._incremental_setup({}, {'host': 'a'})
+        kv = unitdata.kv()
+        with kv.hook_scope('config-changed'):
+            self._incremental_manager().reconfigure_services()
+            self.assertIsNotNone(
+                kv.get(services.base.FINGERPRINT_KEY.format('svc')))
+        kv.cursor.execute('select count(*) from kv_revisions')
+        self.assertEqual(kv.cursor.fetchone()[0], 0)
+        self.assertEqual(hookenv._atexit, [])
+
+    def test_reconfigure_incremental_config_keys(self):
+        self._incremental_setup({'debug': False, 'port': 80}, {'host': 'a'})
+        manager = self._incremental_manager(config_keys=['port'])
+        manager.reconfigure_services()
+        self.config['debug'] = True
+        manager = self._incremental_manager(config_keys=['port'])
+        manager.reconfigure_services()
+        self.assertEqual(manager.skipped, ['svc'])
+
+    def test_reconfigure_incremental_upgrade_charm(self):
+        self._incremental_setup({}, {'host': 'a'})
+        manager = self._incremental_manager()
+        manager.reconfigure_services()
+        manager = self._incremental_manager()
+        hookenv.hook_name.return_value = 'upgrade-charm'
+        manager.reconfigure_services()
+        self.assertEqual(len(self.started), 1)
+
+    @mock.patch.object(services.ServiceManager, 'save_ready')
+    def test_reconfigure_workers(self, save_ready):
+        events = []
+        both_rendering = threading.Event()
+        rendering = []
+
+        def render(service_name):
+            rendering.append(service_name)
+            if len(rendering) == 2:
+                both_rendering.set()
+            # Only returns promptly if the other service renders
+            # at the same time.
+            both_rendering.wait(5)
+            events.append(('data_ready', service_name))
+
+        def start(service_name):
+            events.append(('start', service_name))
+
+        manager = services.ServiceManager([
+            {'service': 'haproxy', 'data_ready': render, 'start': start,
+             'depends_on': ['api1', 'api2']},
+            {'service': 'api1', 'data_ready': render, 'start': start},
+            {'service': 'api2', 'data_ready': render, 'start': start},
+        ], workers=4)
+        manager.reconfigure_services()
+        self.assertTrue(both_rendering.is_set())
+        self.assertEqual(events[-2:], [('data_ready', 'haproxy'),
+                                       ('start', 'haproxy')])
+        self.assertEqual(sorted(events[:-2]), [
+            ('data_ready', 'api1'), ('data_ready', 'api2'),
+            ('start', 'api1'), ('start', 'api2')])
+        save_ready.assert_has_calls([mock.call('api1'), mock.call('api2'),
+                                     mock.call('haproxy')])
+
+    @mock.patch.object(services.ServiceManager, 'save_ready')
+    def test_reconfigure_workers_unitdata(self, save_ready):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        conf = os.path.join(tmpdir, 'svc.conf')
+        with open(conf, 'w') as f:
+            f.write('conf')
+        os.utime(conf, (0, 0))
+        kv = unitdata.Storage(os.path.join(tmpdir, 'state.db'))
+        self.addCleanup(kv.close)
+        host.persist_file_hashes()
+        self.addCleanup(host.persist_file_hashes, False)
+        hashes = []
+
+        def render(service_name):
+            hashes.append(host.path_hash(conf))
+
+        with mock.patch.object(unitdata, '_KV', kv), \
+                mock.patch.object(host, 'charm_dir', return_value=tmpdir):
+            # The connection now belongs to the main thread.
+            kv.get('foo')
+            manager = services.ServiceManager([
+                {'service': 'api1', 'data_ready': render, 'start': []},
+                {'service': 'api2', 'data_ready': render, 'start': []},
+            ], workers=2)
+            manager.reconfigure_services()
+        self.assertEqual(len(hashes), 2)
+        self.assertEqual(hashes[0], {conf: host.file_hash(conf)})
+
+    @mock.patch.object(services.ServiceManager, 'save_ready')
+    def test_reconfigure_workers_failure(self, save_ready):
+        def fail(service_name):
+            raise ValueError(service_name)
+
+        manager = services.ServiceManager([
+            {'service': 'api1', 'data_ready': fail, 'start': []},
+            {'service': 'api2', 'data_ready': [], 'start': []},
+            {'service': 'haproxy', 'depends_on': ['api1']},
+        ], workers=2)
+        self.assertRaises(ValueError, manager.reconfigure_services)
+        save_ready.assert_called_once_with('api2')
+
+    @mock.patch.object(services.ServiceManager, 'fire_event')
+    def test_reconfigure_dependency_order(self, fire_event):
+        manager = services.ServiceManager([
+            {'service': 'haproxy', 'depends_on': ['api']},
+            {'service': 'api'},
+        ])
+        with mock.patch.object(manager, 'save_ready'):
+            manager.reconfigure_services()
+        self.assertEqual([c[0][1] for c in fire_event.call_args_list],
+                         ['api', 'api', 'haproxy', 'haproxy'])
+
+        manager.services['api']['depends_on'] = ['haproxy']
+        self.assertRaises(ValueError, manager.reconfigure_services)
+
     @mock.patch.object(services.ServiceManager, 'save_ready')
     @mock.patch.object(services.ServiceManager, 'fire_event')
     @mock.patch.object(services.ServiceManager, 'is_ready')
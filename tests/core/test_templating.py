@@ -21,10 +21,61 @@ class TestTemplating(unittest.TestCase):
                                                   'charm_dir')
         self._charm_dir_mock = self._charm_dir_patch.start()
         self._charm_dir_mock.side_effect = lambda: self.charm_dir
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = mock.patch.object(
+            templating, 'bytecode_cache_dir',
+            lambda: os.path.join(self.cache_dir, 'bytecode'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        templating.clear_cache()
+        self.addCleanup(templating.clear_cache)
 
     def tearDown(self):
         self._charm_dir_patch.stop()
 
+    @mock.patch.object(templating.host, 'log')
+    def test_render_shares_environment(self, log):
+        context = {'nginx_port': 80}
+        templating.render('test.conf', None, context,
+                          templates_dir=TEMPLATES_DIR)
+        env = templating.environment(TEMPLATES_DIR)
+        self.assertIs(templating.environment(TEMPLATES_DIR + '/'), env)
+        content = templating.render('test.conf', None, context,
+                                    templates_dir=TEMPLATES_DIR)
+        self.assertIn('listen 80', content)
+        stats = templating.stats()
+        self.assertEqual(stats['environments'], 1)
+        self.assertEqual(stats['compiles'], 1)
+        self.assertEqual(stats['loads'], 2)
+        self.assertEqual(stats['renders'], 2)
+        self.assertGreater(stats['render_time'], 0)
+
+    @mock.patch.object(templating.host, 'log')
+    def test_render_bytecode_cache(self, log):
+        templating.render('test.conf', None, {'nginx_port': 80},
+                          templates_dir=TEMPLATES_DIR)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir,
+                                                     'bytecode'))), 1)
+
+        # A later hook loads the compiled template.
+        templating.clear_cache()
+        content = templating.render('test.conf', None, {'nginx_port': 81},
+                                    templates_dir=TEMPLATES_DIR)
+        self.assertIn('listen 81', content)
+        self.assertEqual(templating.stats()['compiles'], 0)
+        self.assertEqual(templating.stats()['loads'], 1)
+
+    def test_loader_environments_bounded(self):
+        loaders = [jinja2.DictLoader({}) for _ in
+                   range(templating.MAX_LOADER_ENVIRONMENTS + 1)]
+        envs = [templating.environment(template_loader=loader)
+                for loader in loaders]
+        self.assertIs(templating.environment(template_loader=loaders[-1]),
+                      envs[-1])
+        self.assertEqual(templating.stats()['environments'],
+                         templating.MAX_LOADER_ENVIRONMENTS)
+
     @mock.patch.object(templating.host.os, 'fchown')
     @mock.patch.object(templating.host, 'mkdir')
     @mock.patch.object(templating.host, 'log')
@@ -154,6 +205,44 @@ class TestTemplating(unittest.TestCase):
         finally:
             shutil.rmtree(tmpdir, ignore_errors=True)
 
+    @mock.patch.object(templating.host, 'log')
+    def test_render_atomic_unchanged(self, log):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        fn1 = os.path.join(tmpdir, 'test.conf')
+        kwargs = dict(owner=pwd.getpwuid(os.getuid()).pw_name,
+                      group=grp.getgrgid(os.getgid()).gr_name,
+                      templates_dir=TEMPLATES_DIR, atomic=True)
+        templating.render('test.conf', fn1, {'nginx_port': 80}, **kwargs)
+        os.utime(fn1, (0, 0))
+        templating.render('test.conf', fn1, {'nginx_port': 80}, **kwargs)
+        self.assertEqual(os.stat(fn1).st_mtime, 0)
+        templating.render('test.conf', fn1, {'nginx_port': 81}, **kwargs)
+        with open(fn1) as f:
+            self.assertIn('listen 81', f.read())
+        self.assertEqual(os.listdir(tmpdir), ['test.conf'])
+
+    @mock.patch.object(templating.host, 'log')
+    def test_render_return_changed(self, log):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        fn1 = os.path.join(tmpdir, 'test.conf')
+        kwargs = dict(owner=pwd.getpwuid(os.getuid()).pw_name,
+                      group=grp.getgrgid(os.getgid()).gr_name,
+                      templates_dir=TEMPLATES_DIR, return_changed=True)
+        content, changed = templating.render('test.conf', fn1,
+                                             {'nginx_port': 80}, **kwargs)
+        self.assertIn('listen 80', content)
+        self.assertTrue(changed)
+        self.assertEqual(
+            templating.render('test.conf', fn1, {'nginx_port': 80},
+                              **kwargs),
+            (content, False))
+        self.assertTrue(templating.render('test.conf', fn1,
+                                          {'nginx_port': 81}, **kwargs)[1])
+        self.assertFalse(templating.render('test.conf', None,
+                                           {'nginx_port': 82}, **kwargs)[1])
+
     @mock.patch.object(templating, 'hookenv')
     @mock.patch('jinja2.Environment')
     def test_load_error(self, Env, hookenv):
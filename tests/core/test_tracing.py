@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import patch
+
+from charmhelpers.core import tracing
+
+
+class ArgsClassTest(unittest.TestCase):
+
+    def test_command_tool(self):
+        self.assertEqual(tracing.command_tool(['/usr/bin/juju-log', 'x']),
+                         'juju-log')
+        self.assertEqual(tracing.command_tool('nc -z 1.2.3.4 80'), 'nc')
+        self.assertEqual(tracing.command_tool([]), '')
+
+    def test_args_class_drops_values(self):
+        self.assertEqual(
+            tracing.args_class(['relation-get', '--format=json', '-r',
+                                'db:1', '-', 'mysql/0']),
+            'relation-get --format -r')
+        self.assertEqual(
+            tracing.args_class(['relation-get', '--format=json', '-r',
+                                'db:2', 'host', 'mysql/1']),
+            'relation-get --format -r')
+
+    def test_args_class_keeps_subcommand(self):
+        self.assertEqual(
+            tracing.args_class(['apt-get', '--assume-yes', 'install', 'vim']),
+            'apt-get --assume-yes install')
+        self.assertEqual(
+            tracing.args_class(['systemctl', 'is-active', 'apache2']),
+            'systemctl is-active')
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        super(TracerTest, self).setUp()
+        self.addCleanup(tracing.disable)
+        self.trace_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.trace_dir)
+
+    def test_records_outermost_call_only(self):
+        tracer = tracing.enable(hook_name='config-changed')
+        self.assertIs(tracing.tracer(), tracer)
+        subprocess.check_output(['true'])
+        subprocess.call(['true', '--flag=1'])
+        tracing.disable()
+        subprocess.call(['true'])
+
+        self.assertIsNone(tracing.tracer())
+        self.assertEqual([e['args_class'] for e in tracer.events],
+                         ['true', 'true --flag'])
+        self.assertEqual(tracer.events[0]['caller'],
+                         '{}.test_records_outermost_call_only'.format(
+                             __name__))
+        self.assertFalse(hasattr(subprocess.call, '_traced'))
+
+    def test_enable_from_environment(self):
+        with patch.dict('os.environ',
+                        {tracing.TRACE_DIR_ENV: self.trace_dir}):
+            with patch.object(tracing.atexit, 'register') as register:
+                tracing.enable_from_environment()
+        self.assertIsNotNone(tracing.tracer())
+        register.assert_called_once_with(tracing._write_trace,
+                                         tracing.tracer(), self.trace_dir)
+
+    def test_chrome_trace_round_trip(self):
+        tracer = tracing.Tracer(hook_name='install')
+        tracer.started = 100.0
+        tracer.record(['relation-get', '-r', 'db:1', '-'], 100.5, 0.25,
+                      'charmhelpers.core.hookenv._relation_get')
+        tracer.record(['relation-get', '-r', 'db:2', '-'], 101.0, 0.75,
+                      'charmhelpers.core.hookenv._relation_get')
+        tracer.record(['juju-log', 'hello'], 101.0, 0.5,
+                      'charmhelpers.core.hookenv._juju_log')
+        path = os.path.join(self.trace_dir, 'trace.json')
+        tracer.write(path)
+
+        with open(path) as f:
+            trace = json.load(f)
+        self.assertEqual(trace['otherData']['hook'], 'install')
+        self.assertEqual(trace['traceEvents'][0]['ts'], 500000)
+        self.assertEqual(trace['traceEvents'][0]['dur'], 250000)
+        self.assertEqual(trace['traceEvents'][0]['ph'], 'X')
+
+        summary = tracing.summarize(tracing.load_events(path))
+        self.assertEqual(
+            [(row['args_class'], row['count'], row['total'], row['max'])
+             for row in summary],
+            [('relation-get -r', 2, 1.0, 0.75), ('juju-log', 1, 0.5, 0.5)])
+        self.assertEqual(summary[0]['mean'], 0.5)
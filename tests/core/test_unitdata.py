@@ -15,7 +15,7 @@ import shutil
 import tempfile
 import unittest
 
-from mock import patch
+from mock import MagicMock, patch
 
 from charmhelpers.core.unitdata import Storage, HookData, kv
 
@@ -145,6 +145,66 @@ class StorageTest(unittest.TestCase):
             (2, 'a', 'false', 'start'),
             (3, 'a', '"DELETED"', "config-changed")])
 
+    def test_prune_keep_revisions(self):
+        kv = Storage(':memory:')
+        for i in range(5):
+            with kv.hook_scope('hook%d' % i):
+                kv.set('a', i)
+        self.assertEqual(kv.prune(keep_revisions=2), 3)
+        history = [h[:-1] for h in kv.gethistory('a')]
+        self.assertEqual(history, [(4, 'a', '3', 'hook3'),
+                                   (5, 'a', '4', 'hook4')])
+        self.assertEqual(kv.get('a'), 4)
+
+    def test_prune_keep_days(self):
+        kv = Storage(':memory:')
+        for i in range(3):
+            with kv.hook_scope('hook%d' % i):
+                kv.set('a', i)
+        kv.cursor.execute("update hooks set date='2000-01-01T00:00:00.0' "
+                          "where version < 3")
+        self.assertEqual(kv.prune(keep_days=1), 2)
+        self.assertEqual([h[0] for h in kv.gethistory('a')], [3])
+
+    def test_set_unset_without_history(self):
+        kv = Storage(':memory:')
+        with kv.hook_scope('install'):
+            kv.set('cache', 1, history=False)
+            kv.set('a', 1)
+        with kv.hook_scope('config-changed'):
+            kv.unset('cache', history=False)
+        self.assertIsNone(kv.get('cache'))
+        self.assertEqual(kv.gethistory('cache'), [])
+        self.assertEqual(len(kv.gethistory('a')), 1)
+
+    def test_hook_scope_applies_retention(self):
+        kv = Storage(':memory:', keep_revisions=1)
+        for i in range(3):
+            with kv.hook_scope('hook%d' % i):
+                kv.set('a', i)
+        self.assertEqual([h[0] for h in kv.gethistory('a')], [3])
+        self.assertEqual(kv.stats()['hooks'], 1)
+
+    def test_compact(self):
+        with tempfile.NamedTemporaryFile() as fh:
+            kv = Storage(fh.name)
+            for i in range(20):
+                with kv.hook_scope('hook%d' % i):
+                    kv.update(dict(('k%d' % j, 'x' * 100 + str(i))
+                                   for j in range(50)))
+            before = kv.stats()
+            self.assertEqual(before['kv'], 50)
+            self.assertEqual(before['kv_revisions'], 1000)
+            self.assertEqual(kv.compact(keep_revisions=1), 19)
+            after = kv.stats()
+            self.assertEqual(after['kv_revisions'], 50)
+            self.assertEqual(after['free'], 0)
+            self.assertLess(after['size'], before['size'])
+            self.assertEqual(os.path.getsize(fh.name), after['size'])
+            with kv.hook_scope('hook'):
+                self.assertRaises(RuntimeError, kv.compact)
+            kv.close()
+
     def test_flush_and_close_on_closed(self):
         kv = Storage(':memory:')
         kv.close()
@@ -198,6 +258,61 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(
             kv.getrange('x_', True), {'a': False, 'b': True})
 
+    def test_update_records_revisions(self):
+        kv = Storage(':memory:')
+        with kv.hook_scope('install'):
+            kv.update({'a': 1, 'b': 2}, prefix='x.')
+        with kv.hook_scope('config-changed'):
+            kv.update({'a': 1, 'b': 3}, prefix='x.')
+        self.assertEqual([h[:-1] for h in kv.gethistory('x.a')],
+                         [(1, 'x.a', '1', 'install')])
+        self.assertEqual([h[:-1] for h in kv.gethistory('x.b')],
+                         [(1, 'x.b', '2', 'install'),
+                          (2, 'x.b', '3', 'config-changed')])
+
+    def test_update_many_keys(self):
+        kv = Storage(':memory:')
+        data = dict(('k%d' % i, i) for i in range(2000))
+        kv.update(data, prefix='bulk.')
+        self.assertEqual(kv.getrange('bulk.', strip=True), data)
+        self.assertEqual(kv.get('bulk.k1999'), 1999)
+
+    def test_get_is_cached(self):
+        kv = Storage(':memory:')
+        kv.set('x', {'a': [1]})
+        kv.set('y', 'val')
+        kv.cursor = cursor = MagicMock(wraps=kv.cursor)
+        self.assertEqual(kv.get('y'), 'val')
+        value = kv.get('x')
+        value['a'].append(2)
+        self.assertEqual(kv.get('x'), {'a': [1]})
+        self.assertEqual(kv.get('missing', 'default'), 'default')
+        self.assertEqual(kv.get('missing', 'default'), 'default')
+        self.assertEqual(cursor.execute.call_count, 1)
+
+    def test_get_cache_dropped_on_rollback(self):
+        kv = Storage(':memory:')
+        kv.set('x', 1)
+        kv.flush()
+        kv.set('x', 2)
+        self.assertEqual(kv.get('x'), 2)
+        kv.flush(False)
+        self.assertEqual(kv.get('x'), 1)
+
+    def test_journal_mode(self):
+        with tempfile.NamedTemporaryFile() as fh:
+            kv = Storage(fh.name, journal_mode='WAL')
+            kv.cursor.execute('pragma journal_mode')
+            self.assertEqual(kv.cursor.fetchone()[0], 'wal')
+            kv.close()
+
+    def test_journal_mode_invalid(self):
+        for mode in ('bogus', 'WAL; drop table kv'):
+            self.assertRaises(ValueError, Storage, ':memory:',
+                              journal_mode=mode)
+        with patch.dict('os.environ', {'UNIT_STATE_DB_JOURNAL_MODE': 'x'}):
+            self.assertRaises(ValueError, Storage, ':memory:')
+
     def test_keyrange(self):
         kv = Storage(':memory:')
         kv.set('docker.net_mtu', 1)
@@ -211,6 +326,52 @@ class StorageTest(unittest.TestCase):
             kv.getrange('docker.', True),
             {'net_mtu': 1, 'net_type': 'vxlan', 'net_nack': True})
 
+    def test_keyrange_literal_wildcards(self):
+        kv = Storage(':memory:')
+        kv.update({'a_1': 1, 'ab1': 2, 'a%2': 3, 'a_': 4})
+        self.assertEqual(kv.getrange('a_'), {'a_1': 1, 'a_': 4})
+        self.assertEqual(kv.getrange('a%'), {'a%2': 3})
+        kv.unsetrange(prefix='a_')
+        self.assertEqual(kv.getrange('a'), {'ab1': 2, 'a%2': 3})
+        self.assertEqual(kv.get('a_1'), None)
+
+    def test_iterrange(self):
+        kv = Storage(':memory:')
+        kv.update({'b': 0, 'c': 3, 'a': 4}, prefix='x.')
+        kv.set('y', 1)
+        it = kv.iterrange('x.', strip=True)
+        self.assertEqual(next(it), ('a', 4))
+        self.assertEqual(list(it), [('b', 0), ('c', 3)])
+        self.assertEqual(len(list(kv.iterrange(''))), 4)
+
+    def test_range_uses_primary_key(self):
+        kv = Storage(':memory:')
+        kv.cursor.execute(
+            'explain query plan select key, data from kv '
+            'where key >= ? and key < ?', ['a', 'b'])
+        plan = ' '.join(str(row[-1]) for row in kv.cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+
+    def test_range_scan_cost_vs_table_size(self):
+        """Benchmark: the cost of a fixed size range scan (in sqlite VM
+        instructions) must not grow with the size of the table."""
+        costs = {}
+        for size in (1000, 10000, 50000):
+            kv = Storage(':memory:')
+            kv.update(dict(('k%06d' % i, i) for i in range(size)))
+            kv.update(dict(('peer.%02d' % i, i) for i in range(50)))
+            steps = [0]
+
+            def _count():
+                steps[0] += 1
+            kv.conn.set_progress_handler(_count, 1)
+            self.assertEqual(len(kv.getrange('peer.')), 50)
+            kv.unsetrange(prefix='peer.')
+            kv.conn.set_progress_handler(None, 1)
+            costs[size] = steps[0]
+            kv.close()
+        self.assertLess(costs[50000], costs[1000] * 1.5, costs)
+
     def test_get_set_unset(self):
         kv = Storage(':memory:')
         kv.hook_scope('test')
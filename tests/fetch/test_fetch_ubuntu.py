@@ -98,6 +98,11 @@ def getenv(update=None):
 
 class FetchTest(TestCase):
 
+    def setUp(self):
+        super(FetchTest, self).setUp()
+        fetch.apt_cache_flush()
+        self.addCleanup(fetch.apt_cache_flush)
+
     @patch("charmhelpers.fetch.ubuntu.log")
     @patch('apt_pkg.Cache')
     def test_filter_packages_missing_ubuntu(self, cache, log):
@@ -462,6 +467,11 @@ class FetchTest(TestCase):
 
 class AptTests(TestCase):
 
+    def setUp(self):
+        super(AptTests, self).setUp()
+        fetch.apt_cache_flush()
+        self.addCleanup(fetch.apt_cache_flush)
+
     @patch('subprocess.call')
     @patch('charmhelpers.fetch.ubuntu.log')
     def test_apt_upgrade_non_fatal(self, log, mock_call):
@@ -717,6 +727,42 @@ class AptTests(TestCase):
         self.assertEqual(fetch.get_upstream_version('emacs'), None)
         self.assertEqual(fetch.get_upstream_version('unknown'), None)
 
+    @patch('apt_pkg.Cache')
+    def test_installed_versions(self, cache):
+        cache.side_effect = fake_apt_cache
+        self.assertEqual(
+            list(fetch.installed_versions(['vim', 'emacs', 'unknown']).items()),
+            [('vim', '2:7.3.547-6ubuntu5'), ('emacs', None), ('unknown', None)])
+        cache.assert_called_once_with(None)
+
+    @patch.object(fetch, '_apt_cache_state')
+    @patch('subprocess.call')
+    @patch('apt_pkg.Cache')
+    def test_apt_cache_reused_until_invalidated(self, cache, mock_call,
+                                                cache_state):
+        cache.side_effect = fake_apt_cache
+        cache_state.return_value = (1, 1)
+        first = fetch.apt_cache()
+        self.assertIs(fetch.apt_cache(), first)
+        fetch.filter_installed_packages(['vim'])
+        fetch.get_upstream_version('vim')
+        self.assertEqual(cache.call_count, 1)
+
+        # apt commands run through this module drop the handle
+        fetch.apt_update()
+        second = fetch.apt_cache()
+        self.assertIsNot(second, first)
+        self.assertEqual(cache.call_count, 2)
+
+        # as do changes to the package database made elsewhere
+        cache_state.return_value = (2, 1)
+        self.assertIsNot(fetch.apt_cache(), second)
+        self.assertEqual(cache.call_count, 3)
+
+        # non-default caches are never shared
+        fetch.apt_cache(in_memory=False)
+        self.assertEqual(cache.call_count, 4)
+
     @patch('charmhelpers.fetch.ubuntu._run_apt_command')
     def test_apt_autoremove_fatal(self, run_apt_command):
         fetch.apt_autoremove(purge=True, fatal=True)